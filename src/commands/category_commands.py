@@ -1,7 +1,10 @@
 import src.utils as utils
+from src.db.query_cache import query_cache
 from src.db.query_options import FileQueryOptions
 from src.models.category import Category
-from src.models.category_type import CategoryType
+from src.models.category_change import CategoryChange
+from src.models.category_type import CategoryType, AGGREGATION_TYPES, ALIAS_MATCH_MODES, SHARD_KEYS, \
+	DEFAULT_SHARD_SIZE
 from src.models.file import File
 from src.services.category_service import CategoryService
 from main import db_checker
@@ -9,6 +12,16 @@ from src.db.db_integrity_checker import IntegrityLevel
 from main import logger
 
 
+def save_generated_aliases(folder_ids: list[str], output_file: str, no_grouping: bool = False):
+	"""Generates aliases from children of the given folders and saves them, grouped into suggested categories."""
+	if no_grouping:
+		utils.save_aliases_to_json(CategoryService.generate_potential_aliases(folder_ids), output_file)
+	else:
+		categories, unassigned = CategoryService.suggest_categories(folder_ids)
+		utils.save_aliases_to_json(unassigned, output_file, categories)
+	logger.info(f"Aliases generated and saved to {output_file}")
+
+
 def generate_aliases_from_folders(args):
 	"""
 	Generates aliases based on folder IDs provided in the input file.
@@ -22,9 +35,7 @@ def generate_aliases_from_folders(args):
 
 	folder_ids = utils.get_lines_from_file(input_file, True)
 	if folder_ids:
-		aliases_names = CategoryService.generate_potential_aliases(folder_ids)
-		utils.save_aliases_to_json(aliases_names, output_file)
-		logger.info(f"Aliases generated and saved to {output_file}")
+		save_generated_aliases(folder_ids, output_file, args.no_grouping)
 	else:
 		logger.error(f"No main folders in {input_file} to generate aliases from.")
 
@@ -61,9 +72,7 @@ def generate_aliases_for_category_type(args):
 		folder_ids.extend([f.drive_file_id for f in extra_folders])
 
 	if folder_ids:
-		aliases_names = CategoryService.generate_potential_aliases(list(set(folder_ids)))
-		utils.save_aliases_to_json(aliases_names, output_file)
-		logger.info(f"Aliases generated and saved to {output_file}")
+		save_generated_aliases(list(set(folder_ids)), output_file, args.no_grouping)
 	else:
 		logger.error(f"No folders found for category type '{category_type_name}' to generate aliases from.")
 
@@ -90,21 +99,47 @@ def load_category_type(args):
 		logger.error(f"Error: The file {input_file} does not contain 'categories' key.")
 		return
 
+	aggregation_type = str(categories_data["aggregation_type"]).lower()
+	if aggregation_type not in AGGREGATION_TYPES:
+		logger.error(f"Error: 'aggregation_type' in {input_file} must be one of {', '.join(AGGREGATION_TYPES)}, "
+					 f"got {categories_data['aggregation_type']!r}.")
+		return
+	max_depth = categories_data.get("max_depth", 1)
+	if not isinstance(max_depth, int) or isinstance(max_depth, bool) or (max_depth < 1 and max_depth != -1):
+		logger.error(f"Error: 'max_depth' in {input_file} must be a positive integer or -1 (no limit), got {max_depth!r}.")
+		return
+	alias_match = categories_data.get("alias_match", "exact")
+	if alias_match not in ALIAS_MATCH_MODES:
+		logger.error(f"Error: 'alias_match' in {input_file} must be one of {', '.join(ALIAS_MATCH_MODES)}, "
+					 f"got {alias_match!r}.")
+		return
+	shard_by = categories_data.get("shard_by")
+	if shard_by is not None and shard_by not in SHARD_KEYS:
+		logger.error(f"Error: 'shard_by' in {input_file} must be one of {', '.join(SHARD_KEYS)} or null, got {shard_by!r}.")
+		return
+	shard_size = categories_data.get("shard_size", DEFAULT_SHARD_SIZE)
+	if not isinstance(shard_size, int) or isinstance(shard_size, bool) or shard_size < 1:
+		logger.error(f"Error: 'shard_size' in {input_file} must be a positive integer, got {shard_size!r}.")
+		return
+
+	definitions = CategoryService.parse_category_definitions(categories_data.get("categories"))
+	if definitions is None:
+		logger.error(f"Error: The file {input_file} contains invalid categories, nothing was loaded.")
+		return
+
 	logger.info(
 		f"Loading aliases from '{input_file}' for category type '{categories_data.get('category_type_name')}'...")
 
-	category_type = CategoryType.find_or_create(categories_data.get("category_type_name"),
-												categories_data.get("aggregation_type"))
-	if not category_type:
-		logger.error(f"Could not create/retrieve category type '{categories_data.get('category_type_name')}'.")
+	# The type and its options are stored in the transaction replacing its categories
+	category_type = CategoryType(name=categories_data.get("category_type_name"), aggregation_type=aggregation_type,
+								 max_depth=max_depth, alias_match=alias_match, shard_by=shard_by, shard_size=shard_size)
+	if not CategoryService.load_aliases(definitions, category_type):
 		return
-
-	Category.get_by_type(category_type)
-	for cat in Category.get_by_type(category_type):
-		cat.delete()
-	CategoryService.load_aliases(categories_data.get("categories"), category_type)
 	logger.info(f"Linking files to categories for category type '{categories_data.get('category_type_name')}'...")
-	category_type.link_all_files(temp=False)
+	with query_cache.unit_of_work("category linking"):
+		category_type.link_all_files(temp=False)
+	# Links were rewritten in place, outside of an import - the next drive-update diffs the whole type
+	CategoryChange.record([category.id for category in Category.get_by_type(category_type)])
 	logger.info(
 		f"Aliases from '{input_file}' for category type '{categories_data.get('category_type_name')}' loaded successfully.")
 
@@ -135,6 +170,8 @@ def add_categories_parsers(subparsers):
 	gen_file_aliases_parser.add_argument("input_file", type=str, help="File containing folder IDs.")
 	gen_file_aliases_parser.add_argument("--output_file", type=str, default="category_aliases.json",
 										 help="File to save generated aliases in JSON format.")
+	gen_file_aliases_parser.add_argument("--no-grouping", action="store_true",
+										 help="Do not group similar names into suggested categories, list them all as unassigned.")
 	gen_file_aliases_parser.set_defaults(func=generate_aliases_from_folders)
 
 	# Command: gen-aliases-for-category
@@ -146,6 +183,8 @@ def add_categories_parsers(subparsers):
 										help="File to save generated aliases in JSON format.")
 	gen_cat_aliases_parser.add_argument("--extra-aliases", type=str, default=None,
 										help="Path to a file containing additional folder names to include in the generation process.")
+	gen_cat_aliases_parser.add_argument("--no-grouping", action="store_true",
+										help="Do not group similar names into suggested categories, list them all as unassigned.")
 	gen_cat_aliases_parser.set_defaults(func=generate_aliases_for_category_type)
 
 	# Command: load-aliases
@@ -1,13 +1,19 @@
+import time
+
 import src.utils as utils
 from src.db.database import setup_database
+from src.db.query_options import FileQueryOptions
 from src.models.file import File
-from main import logger, db_checker
+from main import logger, db_checker, config_data
 from src.db.db_integrity_checker import IntegrityLevel
 
 
 def initialize_database(args):
-	"""Initializes the database (creates tables)."""
+	"""Initializes the database (creates tables) or upgrades the schema of an existing one."""
 	setup_database()
+	# Databases created before the folder closure table existed have files, but no closure yet
+	if File.exists(FileQueryOptions(exclude_shortcuts=False, active_only=False)) and not File.has_closure():
+		File.build_closure()
 	logger.info("Database initialized successfully.")
 
 
@@ -23,7 +29,46 @@ def update_data_in_database(args) -> bool:
 		return False
 	from src.services.update_service import UpdateService
 
-	return UpdateService.data_update(file_with_data)
+	bulk_load = config_data.import_bulk_load and not args.no_bulk_load
+	return UpdateService.data_update(file_with_data, bulk_load=bulk_load)
+
+
+def check_database(args) -> bool:
+	"""Checks the database schema and data, and with --deep also its consistency."""
+	if not db_checker.test_db_integrity(IntegrityLevel.STRUCTURE):
+		return False
+	checks = [IntegrityLevel.FILES, IntegrityLevel.CATEGORY_ONLY, IntegrityLevel.ROOT_ONLY]
+	passed = all([db_checker.test_db_integrity(level) for level in checks])
+	if not args.deep:
+		if passed:
+			logger.info("Database check passed.")
+		return passed
+
+	start_time = time.perf_counter()
+	results = db_checker.run_deep_checks()
+	if results is None:
+		return False
+	for line in results.pop('statistics'):
+		logger.info(line)
+	for check_name, problems in results.items():
+		for problem in problems:
+			logger.error(f"{check_name}: {problem}")
+		passed = passed and not problems
+	logger.info(f"Deep database check {'passed' if passed else 'found problems'} "
+				f"in {time.perf_counter() - start_time:.1f}s.")
+	return passed
+
+
+def rollback_data(args) -> bool:
+	"""Restores files and category links from before the last data update."""
+	if not db_checker.test_db_integrity(IntegrityLevel.BASE):
+		return False
+	from src.db.generations import rollback_generation
+
+	if not rollback_generation():
+		return False
+	logger.info("Restored the data from before the last update. Run rollback-data again to undo the rollback.")
+	return True
 
 
 def set_root_folder_id(args) -> bool:
@@ -95,6 +140,24 @@ def create_root_folder(args):
 		logger.error("Root folder creation failed.")
 
 
+def search_files(args) -> bool:
+	"""Searches files by name and prints the matches."""
+	if not db_checker.test_db_integrity(IntegrityLevel.FILES):
+		return False
+
+	mode = 'prefix' if args.prefix else 'phrase' if args.phrase else 'contains'
+	options = FileQueryOptions(folder_only=args.folders_only, exclude_shortcuts=not args.include_shortcuts)
+
+	start_time = time.perf_counter()
+	files = File.search_by_name(args.query, mode, args.category, args.category_type, options, args.limit)
+	elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+	for file in files:
+		print(f"{file.name}\t{file.drive_file_id}\t{file.mime_type}")
+	logger.info(f"Found {len(files)} files matching '{args.query}' ({mode}) in {elapsed_ms:.1f} ms.")
+	return True
+
+
 def add_db_parsers(subparsers):
 	"""Adds database-related subparsers to the main parser."""
 
@@ -105,9 +168,22 @@ def add_db_parsers(subparsers):
 	# Command: update-data
 	update_parser = subparsers.add_parser("update-data", help="Updates the database with new data from a JSON file.")
 	update_parser.add_argument("file_with_data", type=str,
-							   help="JSON file containing new data to update the database.")
+							   help="JSON file (array or NDJSON) containing new data to update the database.")
+	update_parser.add_argument("--no-bulk-load", action="store_true",
+							   help="Disable the bulk load mode (relaxed syncing, index rebuild) for this import.")
 	update_parser.set_defaults(func=update_data_in_database)
 
+	# Command: check-db
+	check_parser = subparsers.add_parser("check-db", help="Checks the database schema and data.")
+	check_parser.add_argument("--deep", action="store_true",
+							  help="Also check page integrity, orphaned rows and indexes, and print statistics.")
+	check_parser.set_defaults(func=check_database)
+
+	# Command: rollback-data
+	rollback_parser = subparsers.add_parser("rollback-data",
+											help="Restores files and category links from before the last update-data.")
+	rollback_parser.set_defaults(func=rollback_data)
+
 	# Command: set-root-folder
 	set_root_parser = subparsers.add_parser("set-root-folder", help="Sets the root folder ID in the database.")
 	set_root_parser.add_argument("root_folder_id", type=str, help="The ID of the root folder.")
@@ -124,3 +200,18 @@ def add_db_parsers(subparsers):
 	create_root_parser.add_argument("--force", action="store_true",
 									help="Force recreate the root folder, deleting all existing entries.")
 	create_root_parser.set_defaults(func=create_root_folder)
+
+	# Command: search
+	search_parser = subparsers.add_parser("search", help="Searches files from all drives by name.")
+	search_parser.add_argument("query", type=str, help="Text to search for. By default names must contain every word.")
+	search_mode_group = search_parser.add_mutually_exclusive_group()
+	search_mode_group.add_argument("--prefix", action="store_true", help="Match names starting with the query.")
+	search_mode_group.add_argument("--phrase", action="store_true", help="Match names containing the whole query.")
+	search_parser.add_argument("--category", type=str, default=None,
+							   help="Only show files linked to the category with this canonical name.")
+	search_parser.add_argument("--category-type", type=str, default=None,
+							   help="Only show files linked to categories of this category type.")
+	search_parser.add_argument("--folders-only", action="store_true", help="Only show folders.")
+	search_parser.add_argument("--include-shortcuts", action="store_true", help="Include shortcuts in the results.")
+	search_parser.add_argument("--limit", type=int, default=100, help="Maximum number of results (default: 100).")
+	search_parser.set_defaults(func=search_files)
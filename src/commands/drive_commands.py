@@ -41,11 +41,29 @@ def drive_fetch_data(args) -> bool:
 def drive_update(args) -> bool:
 	"""
 	Updates Google Drive structure based on current database state.
+	With --dry-run only prints the planned changes and their estimated API cost.
+	With --full diffs all categories and reconciles the output tree with Drive, instead of only
+	the categories whose file links changed since the last update.
 	"""
+	full = getattr(args, 'full', False)
 	try:
 		if not db_checker.test_db_integrity(IntegrityLevel.ROOT_ONLY):
 			return False
-		UpdateService.drive_update_all()
+		if getattr(args, 'dry_run', False):
+			plan = UpdateService.plan_drive_update(full)
+			for operation in plan.operations:
+				print(operation.describe())
+			for action, (calls, requests) in plan.api_cost().items():
+				if calls:
+					logger.info(f"{action}: {calls} API calls in {requests} HTTP requests")
+			logger.info(f"Drive update plan: {plan.summary()}")
+			writes = sum(calls for calls, _ in plan.api_cost().values())
+			if writes and config_data.drive_write_rate > 0:
+				logger.info(f"At {config_data.drive_write_rate:g} writes/s the update takes about "
+							f"{writes / config_data.drive_write_rate / 60:.1f} min.")
+			return True
+		if not UpdateService.drive_update_all(full=full):
+			return False
 	except Exception as e:
 		logger.error(f"An unhandled error occurred during Google Drive update: {e}")
 		return False
@@ -120,6 +138,17 @@ def add_drive_parsers(subparsers):
 		"drive-update",
 		help="Updates Google Drive structure based on current database state."
 	)
+	update_parser.add_argument(
+		"--dry-run",
+		action="store_true",
+		help="Only print the planned changes and their estimated API cost, without changing Google Drive."
+	)
+	update_parser.add_argument(
+		"--full",
+		action="store_true",
+		help="Diff all categories and remove items which are not part of the output tree, "
+			 "instead of only updating categories whose files changed since the last update."
+	)
 	update_parser.set_defaults(func=drive_update)
 
 	# Command: start-server
@@ -5,6 +5,24 @@ class ConfigData:
 		self.database_file = config_dict.get('DATABASE_FILE', 'drive_index.db')
 		self.log_file = config_dict.get('LOG_FILE', 'logs/dyskownik.log')
 
+		# --- Import ---
+		self.import_batch_size = int(config_dict.get('IMPORT_BATCH_SIZE', 10000))
+		self.import_bulk_load = str(config_dict.get('IMPORT_BULK_LOAD', 'True')).lower() in ('true', '1', 'yes')
+		# Worker processes matching 'pattern' category aliases, 0 for all CPU cores
+		self.categorize_workers = int(config_dict.get('CATEGORIZE_WORKERS', 0))
+		# Whether normalized file names (used by 'normalized' alias matching) drop diacritics, e.g. 'Łódź' -> 'lodz'
+		self.name_fold_diacritics = str(config_dict.get('NAME_FOLD_DIACRITICS', 'True')).lower() in ('true', '1', 'yes')
+
+		# --- Drive update ---
+		# Worker threads sending the calls of a build plan
+		self.drive_build_workers = int(config_dict.get('DRIVE_BUILD_WORKERS', 4))
+		# Drive API calls per second shared by all workers (batched calls count one by one), 0 for no limit
+		self.drive_api_rate = float(config_dict.get('DRIVE_API_RATE', 100))
+		# Sustained Drive write calls (creations, moves, renames, deletions) per second and the largest burst of them,
+		# the rate is lowered automatically on rate limit errors. 0 for no pacing of writes.
+		self.drive_write_rate = float(config_dict.get('DRIVE_WRITE_RATE', 5))
+		self.drive_write_burst = int(config_dict.get('DRIVE_WRITE_BURST', 100))
+
 		# --- Tests ---
 		self.skip_heavy_tests = str(config_dict.get('SKIP_HEAVY_TESTS', 'False')).lower() in ('true', '1', 'yes')
 		self.test_drive_folder_id = config_dict.get('TEST_DRIVE_FOLDER_ID', '')
@@ -1,15 +1,34 @@
 import sqlite3
-import re
+from contextlib import contextmanager
+from pathlib import Path
 
 from main import logger
+from src.db.query_cache import query_cache, CachingConnection
+from src.name_normalization import normalize_name
+from src.pattern_matching import compile_pattern
 
 
 def get_db_connection():
 	from main import config_data
 	"""Returns a database connection object."""
-	conn = sqlite3.connect(config_data.database_file)
+	if query_cache.active:
+		# Statements must be prepared on every execution for the authorizer to see all writes
+		conn = sqlite3.connect(config_data.database_file, cached_statements=0, factory=CachingConnection)
+	else:
+		conn = sqlite3.connect(config_data.database_file)
 	conn.row_factory = sqlite3.Row  # Enable named column access
 	conn.create_function("REGEXP", 2, regexp)
+	conn.create_function("NORMALIZE_NAME", 1, normalize_file_name, deterministic=True)
+	conn.create_function("CASEFOLD", 1, casefold, deterministic=True)
+	return conn
+
+
+def get_read_only_connection():
+	"""Returns a read-only connection, which can never modify the database (used by the deep integrity checks)."""
+	from main import config_data
+	uri = Path(config_data.database_file).resolve().as_uri() + "?mode=ro"
+	conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+	conn.row_factory = sqlite3.Row
 	return conn
 
 
@@ -20,61 +39,227 @@ def close_db_connection(conn):
 
 
 def regexp(expression_with_flags, item):
+	"""REGEXP function of SQLite, see src.pattern_matching.compile_pattern for the expression format."""
 	if item is None:
 		return False
+	return compile_pattern(expression_with_flags).match(item) is not None
 
-	match = re.match(r'^/(.*?)/([gmi]*)$', expression_with_flags)
-	if match:
-		pattern = match.group(1)
-		flags_str = match.group(2)
-	else:
-		pattern = expression_with_flags
-		flags_str = ''
 
-		regex_metachars_to_check = r'[.^$*+?{}\[\]\\|()]'
+def casefold(text: str | None) -> str | None:
+	"""CASEFOLD function of SQLite - unlike lower() it folds the case of all letters, not only ASCII ones."""
+	return text.casefold() if text is not None else None
 
-		if not (pattern.startswith('^') or pattern.endswith('$') or re.search(regex_metachars_to_check, pattern)):
-			pattern = '^' + re.escape(pattern) + '$'
 
-	re_flags = 0
-	if 'i' in flags_str:
-		re_flags |= re.IGNORECASE
+def normalize_file_name(name: str | None) -> str | None:
+	"""
+	Normalized form of a file name stored in files.name_normalized, see src.name_normalization.normalize_name.
+	Diacritics are folded depending on the NAME_FOLD_DIACRITICS setting.
+	"""
+	from main import config_data
+	return normalize_name(name, config_data.name_fold_diacritics)
 
-	return re.match(pattern, item, re_flags) is not None
 
+# Version of the schema created by setup_database, stored in PRAGMA user_version.
+# Bump it whenever setup_database changes the schema, so older databases are detected without reading their schema.
+SCHEMA_VERSION = 7
 
-def setup_database():
-	"""Set up the database by creating necessary tables if they do not exist."""
+# FTS5 table indexing files.name, rowid = files.id
+NAME_INDEX_TABLE = 'files_fts'
 
-	from main import config_data
-	conn = None
+# Tables holding one generation of imported data. Staging and previous generations use the same names
+# with a suffix. Tables referenced by foreign keys come first, see src.db.generations.
+GENERATION_TABLES = ['files', 'file_closure', NAME_INDEX_TABLE, 'file_categories']
+STAGING_SUFFIX = '_temp'
+PREVIOUS_SUFFIX = '_prev'
+
+# Secondary indexes of generation tables, as (table, columns), created for every generation
+SECONDARY_INDEXES = [
+	('files', 'name'),
+	('files', 'parent_id'),
+	('files', 'name_normalized'),
+	('file_closure', 'descendant_id, depth'),
+	# Category deletion cascades to file links - without it every deleted category scans all links
+	('file_categories', 'category_id'),
+]
+
+# Columns added after the first release, as (table, column, definition).
+# setup_database adds them to databases created by older versions, skipping tables which do not exist.
+ADDED_COLUMNS = [
+	('category_types', 'max_depth', 'INTEGER DEFAULT 1'),
+	('category_types', 'alias_match', "TEXT DEFAULT 'exact'"),
+	('category_types', 'shard_by', 'TEXT'),
+	('category_types', 'shard_size', 'INTEGER DEFAULT 1000'),
+	# Category of a category folder or shortcut, its identity while names change
+	('drive_files', 'category_id', 'INTEGER'),
+	('drive_mutations', 'category_id', 'INTEGER'),
+	*[(f'files{suffix}', 'name_normalized', 'TEXT') for suffix in ('', STAGING_SUFFIX, PREVIOUS_SUFFIX)],
+]
+
+# Connection settings used while bulk loading, restored afterwards
+BULK_LOAD_PRAGMAS = {
+	'synchronous': 'OFF',
+	'cache_size': -256 * 1024,  # in KiB
+	'temp_store': 'MEMORY',
+}
+
+
+@contextmanager
+def bulk_load_settings(conn):
+	"""
+	Tunes the connection for bulk inserts and restores the previous settings on exit.
+	The journal mode is left untouched, so an interrupted load is still rolled back cleanly.
+	"""
+	previous = {pragma: conn.execute(f"PRAGMA {pragma};").fetchone()[0] for pragma in BULK_LOAD_PRAGMAS}
 	try:
-		conn = sqlite3.connect(config_data.database_file)
-		c = conn.cursor()
-		c.execute('''
-            CREATE TABLE IF NOT EXISTS files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                drive_file_id TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                mime_type TEXT NOT NULL,
-                parent_id TEXT,
-                owner TEXT,
-                created_time TEXT,
-                modified_time TEXT,
-                size INTEGER,
-                shortcut_target_id TEXT,
-                md5_checksum TEXT,
-                active INTEGER DEFAULT 1
-            )
-        ''')
-		c.execute('''
+		for pragma, value in BULK_LOAD_PRAGMAS.items():
+			conn.execute(f"PRAGMA {pragma} = {value};")
+		yield conn
+	finally:
+		for pragma, value in previous.items():
+			conn.execute(f"PRAGMA {pragma} = {value};")
+
+
+def drop_secondary_indexes(conn, table_name: str) -> list[str]:
+	"""
+	Drops all explicitly created indexes of the table (UNIQUE and PRIMARY KEY indexes are kept).
+
+	:return: CREATE INDEX statements needed to rebuild the dropped indexes.
+	"""
+	rows = conn.execute(
+		"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL;",
+		(table_name,)).fetchall()
+	for row in rows:
+		conn.execute(f"DROP INDEX IF EXISTS {row[0]};")
+	return [row[1] for row in rows]
+
+
+def table_exists(conn, table_name: str) -> bool:
+	"""Checks whether a table (also a virtual one) exists in the database."""
+	row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (table_name,)).fetchone()
+	return row is not None
+
+
+def ensure_indexes(conn, suffix: str = '') -> None:
+	"""
+	Creates the SECONDARY_INDEXES of one generation's tables, unless the table already has an index on the columns.
+	Indexes keep their names when their table is renamed by a generation swap,
+	so a free name is picked for every new index.
+
+	:param suffix: Generation suffix of the tables ('' for the live tables).
+	"""
+	for base_table, columns in SECONDARY_INDEXES:
+		table_name = base_table + suffix
+		column_list = [column.strip() for column in columns.split(',')]
+		existing = [
+			[info[2] for info in conn.execute(f"PRAGMA index_info({index[1]})")]
+			for index in conn.execute(f"PRAGMA index_list({table_name})") if index[3] == 'c'
+		]
+		if column_list in existing:
+			continue
+
+		index_name = f"idx_{table_name}_{'_'.join(column_list)}"
+		candidate, number = index_name, 1
+		while conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?;", (candidate,)).fetchone():
+			number += 1
+			candidate = f"{index_name}_{number}"
+		conn.execute(f"CREATE INDEX {candidate} ON {table_name} ({columns})")
+
+
+def create_generation_tables(conn, suffix: str = '') -> None:
+	"""
+	Creates the tables of one generation of imported data (files, links to categories, folder closure,
+	name index) and their indexes, if they do not exist.
+
+	:param suffix: Generation suffix of the tables ('' for the live tables, STAGING_SUFFIX for the import).
+	"""
+	conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS files{suffix} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            drive_file_id TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            parent_id TEXT,
+            owner TEXT,
+            created_time TEXT,
+            modified_time TEXT,
+            size INTEGER,
+            shortcut_target_id TEXT,
+            md5_checksum TEXT,
+            active INTEGER DEFAULT 1,
+            name_normalized TEXT
+        )
+    ''')
+	conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS file_categories{suffix} (
+            file_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            PRIMARY KEY (file_id, category_id),
+            FOREIGN KEY (file_id) REFERENCES files{suffix}(id),
+            FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
+        )
+    ''')
+	conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS file_closure{suffix} (
+            ancestor_id TEXT NOT NULL,
+            descendant_id TEXT NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID
+    ''')
+	create_name_index(conn, suffix)
+	ensure_indexes(conn, suffix)
+
+
+def create_name_index(conn, suffix: str = '') -> bool:
+	"""
+	Creates the FTS5 index (trigram tokenizer) over file names, used by File.search_by_name.
+
+	:param suffix: Generation suffix of the files table the index belongs to.
+	:return: False if this SQLite build has no FTS5 or no trigram tokenizer (SQLite < 3.34).
+	"""
+	try:
+		conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {NAME_INDEX_TABLE}{suffix} "
+					 f"USING fts5(name, tokenize='trigram')")
+		return True
+	except sqlite3.OperationalError as e:
+		logger.warning(f"File name index not available, search will scan the files table: {e}")
+		return False
+
+
+def has_name_index(conn, suffix: str = '') -> bool:
+	"""Checks whether the file name index exists in the database."""
+	return table_exists(conn, NAME_INDEX_TABLE + suffix)
+
+
+def rebuild_name_index(conn, suffix: str = '') -> None:
+	"""
+	Refills the file name index from the files table, within the caller's transaction.
+
+	:param suffix: Generation suffix of the files table and its index.
+	"""
+	if not has_name_index(conn, suffix):
+		return
+	# Recreating the table is much faster than deleting its rows one by one
+	conn.execute(f"DROP TABLE {NAME_INDEX_TABLE}{suffix};")
+	create_name_index(conn, suffix)
+	conn.execute(f"INSERT INTO {NAME_INDEX_TABLE}{suffix} (rowid, name) SELECT id, name FROM files{suffix};")
+
+
+def create_schema(conn) -> None:
+	"""Creates missing tables, columns and indexes of the current schema, within the caller's transaction."""
+	c = conn.cursor()
+	c.execute('''
             CREATE TABLE IF NOT EXISTS category_types (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT UNIQUE NOT NULL,
-                aggregation_type TEXT NOT NULL
+                aggregation_type TEXT NOT NULL,
+                max_depth INTEGER DEFAULT 1,
+                alias_match TEXT DEFAULT 'exact',
+                shard_by TEXT,
+                shard_size INTEGER DEFAULT 1000
             )
         ''')
-		c.execute('''
+	c.execute('''
             CREATE TABLE IF NOT EXISTS categories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 category_type_id INTEGER NOT NULL,
@@ -82,7 +267,7 @@ def setup_database():
                 FOREIGN KEY (category_type_id) REFERENCES category_types(id) ON DELETE CASCADE
             )
         ''')
-		c.execute('''
+	c.execute('''
             CREATE TABLE IF NOT EXISTS category_aliases (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 category_id INTEGER NOT NULL,
@@ -90,51 +275,95 @@ def setup_database():
                 FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
             )
         ''')
-		c.execute('''
-            CREATE TABLE IF NOT EXISTS file_categories (
-                file_id INTEGER NOT NULL,
-                category_id INTEGER NOT NULL,
-                PRIMARY KEY (file_id, category_id),
-                FOREIGN KEY (file_id) REFERENCES files(id),
-                FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
-            )
-        ''')
-		c.execute('''
-            CREATE TABLE IF NOT EXISTS files_temp (
+	c.execute('''
+            CREATE TABLE IF NOT EXISTS drive_files (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                drive_file_id TEXT UNIQUE NOT NULL,
                 name TEXT,
-                mime_type TEXT,
+                drive_file_id TEXT UNIQUE NOT NULL,
                 parent_id TEXT,
-                owner TEXT,
-                created_time TEXT,
-                modified_time TEXT,
-                size INTEGER,
                 shortcut_target_id TEXT,
-                md5_checksum TEXT,
-                active INTEGER DEFAULT 1
-            )
-            ''')
-		c.execute('''
-            CREATE TABLE IF NOT EXISTS file_categories_temp (
-                file_id INTEGER NOT NULL,
-                category_id INTEGER NOT NULL,
-                PRIMARY KEY (file_id, category_id)
+                category_type_id INTEGER,
+                level INTEGER NOT NULL,
+                category_id INTEGER
             )
             ''')
 
-		c.execute('''
-            CREATE TABLE IF NOT EXISTS drive_files (
+	# Write-ahead journal of Drive changes, see src.models.drive_mutation
+	c.execute('''
+            CREATE TABLE IF NOT EXISTS drive_mutations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                action TEXT NOT NULL,
+                level INTEGER NOT NULL,
                 name TEXT,
-                drive_file_id TEXT UNIQUE NOT NULL,
-                parent_id TEXT,
-                shortcut_target_id TEXT,
                 category_type_id INTEGER,
-                level INTEGER NOT NULL
+                parent_id TEXT,
+                target_id TEXT,
+                drive_file_id TEXT,
+                recorded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                category_id INTEGER
+            )
+            ''')
+
+	# Categories whose file links changed since the last Drive build, see src.models.category_change
+	c.execute('''
+            CREATE TABLE IF NOT EXISTS category_changes (
+                category_id INTEGER PRIMARY KEY
             )
             ''')
 
+	c.execute("CREATE INDEX IF NOT EXISTS idx_categories_category_type_id ON categories (category_type_id)")
+	c.execute("CREATE INDEX IF NOT EXISTS idx_category_aliases_category_id ON category_aliases (category_id)")
+
+	# Older tables get the added columns before their indexes are ensured, new tables are created with them
+	for table_name, column_name, definition in ADDED_COLUMNS:
+		existing_columns = {row[1] for row in c.execute(f"PRAGMA table_info({table_name})")}
+		if existing_columns and column_name not in existing_columns:
+			c.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
+			logger.info(f"Added column '{column_name}' to table '{table_name}'.")
+
+	name_index_existed = has_name_index(conn)
+	for suffix in ('', STAGING_SUFFIX):
+		create_generation_tables(conn, suffix)
+	if table_exists(conn, f"files{PREVIOUS_SUFFIX}"):
+		ensure_indexes(conn, PREVIOUS_SUFFIX)
+	if not name_index_existed:
+		rebuild_name_index(conn)
+
+	for suffix in ('', STAGING_SUFFIX, PREVIOUS_SUFFIX):
+		if table_exists(conn, f"files{suffix}"):
+			# Fills the column for files imported before it existed
+			c.execute(f"UPDATE files{suffix} SET name_normalized = NORMALIZE_NAME(name) WHERE name_normalized IS NULL")
+
+
+def expected_schema() -> dict[str, set[str]]:
+	"""
+	Tables created by setup_database and their columns, read from the schema created in a scratch in-memory database,
+	so checks of existing databases never fall behind the schema.
+	"""
+	conn = sqlite3.connect(':memory:')
+	conn.create_function("NORMALIZE_NAME", 1, normalize_file_name, deterministic=True)
+	try:
+		create_schema(conn)
+		table_names = [row[0] for row in conn.execute(
+			"SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+		return {table_name: {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+				for table_name in table_names}
+	finally:
+		conn.close()
+
+
+def setup_database():
+	"""Set up the database by creating necessary tables if they do not exist."""
+
+	from main import config_data
+	conn = None
+	try:
+		conn = sqlite3.connect(config_data.database_file)
+		conn.create_function("NORMALIZE_NAME", 1, normalize_file_name, deterministic=True)
+		# Readers are never blocked by a writer (e.g. an import) in WAL mode. The setting is persistent.
+		conn.execute("PRAGMA journal_mode = WAL;")
+		create_schema(conn)
+		conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 		conn.commit()
 	except sqlite3.Error as e:
 		logger.error(f"Error during database setup: {e}")
@@ -151,14 +380,16 @@ def drop_database():
 	try:
 		conn = sqlite3.connect(config_data.database_file)
 		c = conn.cursor()
-		c.execute('DROP TABLE IF EXISTS files')
+		for suffix in ('', STAGING_SUFFIX, PREVIOUS_SUFFIX):
+			for table_name in reversed(GENERATION_TABLES):
+				c.execute(f'DROP TABLE IF EXISTS {table_name}{suffix}')
 		c.execute('DROP TABLE IF EXISTS category_types')
 		c.execute('DROP TABLE IF EXISTS categories')
 		c.execute('DROP TABLE IF EXISTS category_aliases')
-		c.execute('DROP TABLE IF EXISTS file_categories')
-		c.execute('DROP TABLE IF EXISTS files_temp')
-		c.execute('DROP TABLE IF EXISTS file_categories_temp')
 		c.execute('DROP TABLE IF EXISTS drive_files')
+		c.execute('DROP TABLE IF EXISTS drive_mutations')
+		c.execute('DROP TABLE IF EXISTS category_changes')
+		c.execute('PRAGMA user_version = 0')
 		conn.commit()
 	except sqlite3.Error as e:
 		logger.error(f"Error during database drop: {e}")
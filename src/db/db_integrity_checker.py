@@ -1,4 +1,7 @@
+import os
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 
@@ -11,8 +14,47 @@ class IntegrityLevel(Enum):
 	FULL = 10  # category and root checks
 
 
+# Database files changed less than this ago are too fresh for caching checks, see DBIntegrityChecker._remember
+RACY_STATE_NS = 1_000_000_000
+
+# Orphan detection queries of the deep check, as (description, query counting the orphans)
+ORPHAN_QUERIES = [
+	("file links pointing at missing files",
+	 "SELECT COUNT(*) FROM file_categories fc WHERE NOT EXISTS (SELECT 1 FROM files f WHERE f.id = fc.file_id)"),
+	("file links pointing at missing categories",
+	 "SELECT COUNT(*) FROM file_categories fc WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.id = fc.category_id)"),
+	("categories of missing category types",
+	 "SELECT COUNT(*) FROM categories c "
+	 "WHERE NOT EXISTS (SELECT 1 FROM category_types ct WHERE ct.id = c.category_type_id)"),
+	("aliases of missing categories",
+	 "SELECT COUNT(*) FROM category_aliases ca WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.id = ca.category_id)"),
+	("drive files of missing category types",
+	 "SELECT COUNT(*) FROM drive_files df WHERE df.category_type_id IS NOT NULL "
+	 "AND NOT EXISTS (SELECT 1 FROM category_types ct WHERE ct.id = df.category_type_id)"),
+	("drive files with a missing parent folder",
+	 "SELECT COUNT(*) FROM drive_files df WHERE df.level > 0 "
+	 "AND NOT EXISTS (SELECT 1 FROM drive_files p WHERE p.drive_file_id = df.parent_id)"),
+	("shortcuts to files missing from the files table",
+	 "SELECT COUNT(*) FROM drive_files df WHERE df.shortcut_target_id IS NOT NULL "
+	 "AND NOT EXISTS (SELECT 1 FROM files f WHERE f.drive_file_id = df.shortcut_target_id)"),
+]
+
+
 class DBIntegrityChecker:
-	"""Class to check the integrity of the database at various levels."""
+	"""
+	Class to check the integrity of the database at various levels.
+
+	test_db_integrity is the fast mode run before commands: one connection, the schema version from the database
+	header and the table list instead of the rows, and EXISTS sentinels instead of reading tables. Passed checks
+	are cached until the database files change, as even reading the header costs a read transaction.
+	run_deep_checks is the thorough mode of the check-db --deep command.
+	"""
+
+	def __init__(self):
+		# Tables and columns of the current schema, see src.db.database.expected_schema
+		self._expected_schema: dict[str, set[str]] | None = None
+		# Passed checks, as (database file, check) -> state of the database files when they passed
+		self._passed_checks: dict[tuple[str, str], tuple] = {}
 
 	def test_db_integrity(self, level: IntegrityLevel = IntegrityLevel.FULL) -> bool:
 		from src.db.database import get_db_connection
@@ -20,82 +62,132 @@ class DBIntegrityChecker:
 		try:
 			# 1. Check if the database file exists and is accessible
 			conn = get_db_connection()
-			conn.execute("SELECT 1;")
-			conn.close()
-			if level == IntegrityLevel.BASE:
-				return True
-
-			# 2. Check the database schema
-			if not self.check_database_schema():
-				return False
-			if level == IntegrityLevel.STRUCTURE:
-				return True
-
-			# 3. Check basic data existence (e.g., categories)
-			if level == IntegrityLevel.CATEGORY_ONLY:
-				if not self.check_category_types_existence():
-					return False
-				else:
+			try:
+				conn.execute("SELECT 1;")
+				if level == IntegrityLevel.BASE:
 					return True
 
-			# 4. Check dependent elements, e.g., root folder in Drive
-			if level == IntegrityLevel.ROOT_ONLY:
-				if not self.check_root_folder_existence():
+				# 2. Check the database schema
+				if not self.check_database_schema(conn):
 					return False
-				else:
+				if level == IntegrityLevel.STRUCTURE:
 					return True
 
-			# 5. Check files table existence and basic integrity
-			if level == IntegrityLevel.FILES:
-				if not self.check_files_existence():
-					return False
-				else:
-					return True
+				# 3. Check basic data existence (e.g., categories)
+				if level == IntegrityLevel.CATEGORY_ONLY:
+					return self.check_category_types_existence(conn)
 
-			# 10. Full integrity (category + root)
-			if not self.check_category_types_existence():
-				return False
-			if not self.check_root_folder_existence():
-				return False
+				# 4. Check dependent elements, e.g., root folder in Drive
+				if level == IntegrityLevel.ROOT_ONLY:
+					return self.check_root_folder_existence(conn)
 
-			if level == IntegrityLevel.FULL:
-				pass
+				# 5. Check files table existence and basic integrity
+				if level == IntegrityLevel.FILES:
+					return self.check_files_existence(conn)
 
-			return True
+				# 10. Full integrity (category + root)
+				return self.check_category_types_existence(conn) and self.check_root_folder_existence(conn)
+			finally:
+				conn.close()
 		except sqlite3.Error as e:
 			logger.error(f"Database not accessible or does not exist: {e}")
 			return False
 
-	def check_database_schema(self) -> bool:
-		"""Checks whether the database contains the required tables."""
-		from src.db.database import get_db_connection
+	def check_database_schema(self, conn=None) -> bool:
+		"""
+		Checks whether the database has the current schema version and every table and column setup_database
+		creates (see src.db.database.expected_schema). Outdated databases have to be upgraded with init-db.
+		"""
+		from src.db.database import get_db_connection, expected_schema, SCHEMA_VERSION
 		from main import logger
-		required_tables = {
-			'files', 'category_types', 'categories', 'category_aliases',
-			'file_categories', 'files_temp', 'file_categories_temp', 'drive_files'
-		}
+		if self._is_cached('schema'):
+			return True
+		own_conn = conn is None
 		try:
-			conn = get_db_connection()
-			c = conn.cursor()
-			c.execute("SELECT name FROM sqlite_master WHERE type='table';")
-			existing_tables = {row[0] for row in c.fetchall()}
+			conn = conn if conn else get_db_connection()
+			schema_version = conn.execute("PRAGMA user_version;").fetchone()[0]
+			if schema_version > SCHEMA_VERSION:
+				logger.error(f"Database schema version {schema_version} is newer than supported ({SCHEMA_VERSION}).")
+				return False
+			if schema_version < SCHEMA_VERSION:
+				logger.error(f"Database schema version {schema_version} is outdated, run 'init-db' to upgrade it.")
+				return False
 
-			missing_tables = required_tables - existing_tables
-			if missing_tables:
-				logger.error(f"Missing tables in database: {missing_tables}, try initializing the database again.")
+			if self._expected_schema is None:
+				self._expected_schema = expected_schema()
+			missing = []
+			for table_name, columns in self._expected_schema.items():
+				existing_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+				if not existing_columns:
+					missing.append(table_name)
+				else:
+					missing.extend(f"{table_name}.{column}" for column in sorted(columns - existing_columns))
+			if missing:
+				logger.error(f"Missing tables and columns in database: {', '.join(missing)}, run 'init-db' to create them.")
 				return False
+			self._remember('schema')
 			return True
 		except sqlite3.Error as e:
 			logger.error(f"Error while checking database schema: {e}")
 			return False
+		finally:
+			if own_conn and conn:
+				conn.close()
+
+	@staticmethod
+	def _files_state(database_file: str) -> tuple:
+		"""
+		Modification times and sizes of the database and its WAL file - any committed write changes them.
+		An empty WAL file is recreated by every connection, so only a non-empty one counts.
+		"""
+		state = []
+		for path in (database_file, database_file + '-wal'):
+			try:
+				stat = os.stat(path)
+				state.append((stat.st_mtime_ns, stat.st_size) if stat.st_size else None)
+			except OSError:
+				state.append(None)
+		return tuple(state)
 
-	def check_files_existence(self) -> bool:
+	def _is_cached(self, check: str) -> bool:
+		"""Checks whether the check passed before and the database has not changed since."""
+		from main import config_data
+		passed_state = self._passed_checks.get((config_data.database_file, check))
+		return passed_state is not None and passed_state == self._files_state(config_data.database_file)
+
+	def _remember(self, check: str) -> None:
+		"""
+		Caches a passed check. Like git's racy index entries, states younger than the file system timestamp
+		granularity are not cached, as a write in the same tick could leave them unchanged.
+		"""
+		from main import config_data
+		files_state = self._files_state(config_data.database_file)
+		newest_change = max((state[0] for state in files_state if state), default=0)
+		if time.time_ns() - newest_change > RACY_STATE_NS:
+			self._passed_checks[(config_data.database_file, check)] = files_state
+
+	def _has_rows(self, conn, query: str) -> bool:
+		"""Runs an EXISTS sentinel query on the given connection or, if None, a new one."""
+		from src.db.database import get_db_connection
+		if self._is_cached(query):
+			return True
+
+		own_conn = conn is None
+		conn = conn if conn else get_db_connection()
+		try:
+			has_rows = bool(conn.execute(f"SELECT EXISTS ({query});").fetchone()[0])
+		finally:
+			if own_conn:
+				conn.close()
+		if has_rows:
+			self._remember(query)
+		return has_rows
+
+	def check_files_existence(self, conn=None) -> bool:
 		"""Checks whether there is at least one file in the files table."""
-		from src.models import File
 		from main import logger
 		try:
-			files = File.get_all()
-			if not files:
+			if not self._has_rows(conn, "SELECT 1 FROM files"):
 				logger.error("No files found in the database. Please load file data into the database.")
 				return False
 			return True
@@ -103,13 +195,11 @@ class DBIntegrityChecker:
 			logger.error(f"Error while checking files existence: {e}")
 			return False
 
-	def check_category_types_existence(self) -> bool:
+	def check_category_types_existence(self, conn=None) -> bool:
 		"""Checks whether there is at least one category type in the database."""
-		from src.models.category_type import CategoryType
 		from main import logger
 		try:
-			category_types = CategoryType.get_all()
-			if not category_types:
+			if not self._has_rows(conn, "SELECT 1 FROM category_types"):
 				logger.error("No category types found in the database.")
 				return False
 			return True
@@ -117,13 +207,11 @@ class DBIntegrityChecker:
 			logger.error(f"Error while checking category types existence: {e}")
 			return False
 
-	def check_root_folder_existence(self) -> bool:
+	def check_root_folder_existence(self, conn=None) -> bool:
 		"""Checks whether a root folder (level 0) exists in the database."""
-		from src.models.drive_file import DriveFile
 		from main import logger
 		try:
-			root_folders = DriveFile.get_drive_files_by_level(0)
-			if not root_folders:
+			if not self._has_rows(conn, "SELECT 1 FROM drive_files WHERE level = 0"):
 				logger.error(
 					"No root folder found. First set or create a root folder using 'set-root-folder' or 'create-root-folder' command.")
 				return False
@@ -131,3 +219,84 @@ class DBIntegrityChecker:
 		except Exception as e:
 			logger.error(f"Error while checking root folder existence: {e}")
 			return False
+
+	def run_deep_checks(self, max_workers: int = 4) -> dict[str, list[str]] | None:
+		"""
+		Runs the slow checks (page structure, orphaned rows, index coverage, statistics) concurrently,
+		each on its own read-only connection.
+
+		:return: Problems found per check (empty lists if the check passed) and a 'statistics' entry
+				 with informational lines, or None if the database cannot be opened.
+		"""
+		from src.db.database import get_read_only_connection
+		from main import logger
+		checks = {
+			'quick_check': self._deep_quick_check,
+			'orphans': self._deep_orphans,
+			'index_coverage': self._deep_index_coverage,
+			'statistics': self._deep_statistics,
+		}
+
+		def run(check):
+			conn = get_read_only_connection()
+			try:
+				return check(conn)
+			finally:
+				conn.close()
+
+		try:
+			with ThreadPoolExecutor(max_workers=max_workers) as executor:
+				futures = {name: executor.submit(run, check) for name, check in checks.items()}
+				return {name: future.result() for name, future in futures.items()}
+		except sqlite3.Error as e:
+			logger.error(f"Error while running deep database checks: {e}")
+			return None
+
+	@staticmethod
+	def _deep_quick_check(conn) -> list[str]:
+		"""PRAGMA quick_check - page structure, record format and NOT NULL constraints, without matching indexes."""
+		results = [row[0] for row in conn.execute("PRAGMA quick_check;")]
+		return [] if results == ['ok'] else results
+
+	@staticmethod
+	def _deep_orphans(conn) -> list[str]:
+		"""Rows referencing rows which no longer exist."""
+		problems = []
+		for description, query in ORPHAN_QUERIES:
+			count = conn.execute(query).fetchone()[0]
+			if count:
+				problems.append(f"{count} {description}")
+		return problems
+
+	@staticmethod
+	def _deep_index_coverage(conn) -> list[str]:
+		"""Secondary indexes missing from the live and staging tables."""
+		from src.db.database import SECONDARY_INDEXES, STAGING_SUFFIX
+		problems = []
+		for suffix in ('', STAGING_SUFFIX):
+			for base_table, columns in SECONDARY_INDEXES:
+				table_name = base_table + suffix
+				column_list = [column.strip() for column in columns.split(',')]
+				indexed = [
+					[info[2] for info in conn.execute(f"PRAGMA index_info({index[1]})")]
+					for index in conn.execute(f"PRAGMA index_list({table_name})")
+				]
+				if not any(index_columns[:len(column_list)] == column_list for index_columns in indexed):
+					problems.append(f"No index on {table_name} ({columns}), run 'init-db' to create it")
+		return problems
+
+	@staticmethod
+	def _deep_statistics(conn) -> list[str]:
+		"""Row counts of the main tables and file size information."""
+		lines = []
+		for table_name in ('files', 'file_categories', 'file_closure', 'category_types', 'categories',
+						   'category_aliases', 'drive_files'):
+			lines.append(f"{table_name}: {conn.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]} rows")
+		page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+		page_count = conn.execute("PRAGMA page_count;").fetchone()[0]
+		free_pages = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+		lines.append(f"size: {page_size * page_count / 1024 / 1024:.1f} MiB, "
+					 f"{free_pages * 100 / page_count if page_count else 0:.1f}% free pages")
+		lines.append(f"schema version: {conn.execute('PRAGMA user_version;').fetchone()[0]}, "
+					 f"journal mode: {conn.execute('PRAGMA journal_mode;').fetchone()[0]}")
+		return lines
@@ -0,0 +1,126 @@
+import sqlite3
+import time
+
+from main import logger
+from src.db.database import get_db_connection, create_generation_tables, rebuild_name_index, table_exists, \
+	GENERATION_TABLES, STAGING_SUFFIX, PREVIOUS_SUFFIX
+from src.models.category_change import CategoryChange
+
+# Suffix used while two generations exchange names
+_SWAP_SUFFIX = '_swap'
+
+
+def _connect():
+	"""
+	Connection for generation changes. Foreign keys stay off (the default), so tables can be renamed and dropped
+	in any state. With legacy_alter_table off, ALTER TABLE ... RENAME also rewrites foreign keys
+	referencing the renamed table, e.g. file_categories_temp -> files_temp becomes -> files on promotion.
+	"""
+	conn = get_db_connection()
+	conn.isolation_level = None
+	conn.execute("PRAGMA legacy_alter_table = OFF;")
+	return conn
+
+
+def _rename_generation(conn, from_suffix: str, to_suffix: str) -> None:
+	"""Renames all existing tables of a generation. Tables referenced by foreign keys are renamed first."""
+	for table_name in GENERATION_TABLES:
+		if table_exists(conn, table_name + from_suffix):
+			conn.execute(f"ALTER TABLE {table_name}{from_suffix} RENAME TO {table_name}{to_suffix};")
+
+
+def _drop_generation(conn, suffix: str) -> None:
+	for table_name in reversed(GENERATION_TABLES):
+		conn.execute(f"DROP TABLE IF EXISTS {table_name}{suffix};")
+
+
+def reset_staging() -> bool:
+	"""
+	Recreates empty staging tables (files_temp, file_categories_temp, ...) for a new import,
+	discarding leftovers of an interrupted one.
+	"""
+	conn = _connect()
+	try:
+		conn.execute("BEGIN;")
+		_drop_generation(conn, STAGING_SUFFIX)
+		create_generation_tables(conn, STAGING_SUFFIX)
+		conn.execute("COMMIT;")
+		return True
+	except sqlite3.Error as e:
+		logger.error(f"Error while resetting the staging tables: {e}")
+		if conn.in_transaction:
+			conn.execute("ROLLBACK;")
+		return False
+	finally:
+		conn.close()
+
+
+def promote_staging() -> bool:
+	"""
+	Makes the staging generation live. The live generation becomes the previous one (see rollback_generation)
+	and the generation before it is discarded.
+
+	Everything heavy (name index, dropping old data, recording changed categories for the next Drive build)
+	happens before the switch. The switch itself only renames tables in one short transaction, so readers see
+	either the old or the new data and are never blocked for long.
+	"""
+	conn = _connect()
+	try:
+		conn.execute("BEGIN;")
+		rebuild_name_index(conn, STAGING_SUFFIX)
+		_drop_generation(conn, PREVIOUS_SUFFIX)
+		changed = CategoryChange.record_link_changes(conn, STAGING_SUFFIX, '')
+		conn.execute("COMMIT;")
+		logger.debug(f"File links of {changed} more categories changed since the last Drive build.")
+
+		start_time = time.perf_counter()
+		conn.execute("BEGIN IMMEDIATE;")
+		_rename_generation(conn, '', PREVIOUS_SUFFIX)
+		_rename_generation(conn, STAGING_SUFFIX, '')
+		create_generation_tables(conn, STAGING_SUFFIX)
+		conn.execute("COMMIT;")
+		logger.debug(f"Switched to the new data generation in {(time.perf_counter() - start_time) * 1000:.1f} ms.")
+		return True
+	except sqlite3.Error as e:
+		logger.error(f"Error while switching to the new data generation: {e}")
+		if conn.in_transaction:
+			conn.execute("ROLLBACK;")
+		return False
+	finally:
+		conn.close()
+
+
+def has_previous_generation() -> bool:
+	"""Checks whether the data replaced by the last import is still available."""
+	conn = get_db_connection()
+	try:
+		return table_exists(conn, f"files{PREVIOUS_SUFFIX}")
+	finally:
+		conn.close()
+
+
+def rollback_generation() -> bool:
+	"""
+	Exchanges the live and the previous generation, restoring files and category links from before the last import.
+	Rolling back twice restores the newer data again. Categories whose links differ are recorded for the next
+	Drive build.
+	"""
+	conn = _connect()
+	try:
+		if not table_exists(conn, f"files{PREVIOUS_SUFFIX}"):
+			logger.error("There is no previous data generation to roll back to.")
+			return False
+		conn.execute("BEGIN IMMEDIATE;")
+		CategoryChange.record_link_changes(conn, PREVIOUS_SUFFIX, '')
+		_rename_generation(conn, '', _SWAP_SUFFIX)
+		_rename_generation(conn, PREVIOUS_SUFFIX, '')
+		_rename_generation(conn, _SWAP_SUFFIX, PREVIOUS_SUFFIX)
+		conn.execute("COMMIT;")
+		return True
+	except sqlite3.Error as e:
+		logger.error(f"Error while rolling back to the previous data generation: {e}")
+		if conn.in_transaction:
+			conn.execute("ROLLBACK;")
+		return False
+	finally:
+		conn.close()
@@ -0,0 +1,58 @@
+import itertools
+import sqlite3
+from typing import Iterable, Iterator
+
+# Marker replaced by the key set in queries, e.g. f"SELECT * FROM files WHERE name IN ({KEYS})"
+KEYS = "{keys}"
+
+# Up to this many keys are bound as one IN (?, ?, ...) list - well below SQLite's variable limit
+IN_LIST_LIMIT = 500
+# Up to this many keys, queries which allow it are run once per IN_LIST_LIMIT keys,
+# above it the keys are loaded into an indexed temporary table and the query joins against it
+MAX_CHUNKED_KEYS = 5000
+
+_temp_table_ids = itertools.count()
+
+
+def _inline(query: str, keys: list, params) -> tuple[str, list]:
+	return query.replace(KEYS, ','.join('?' * len(keys))), [*keys, *params]
+
+
+def load_temp_key_table(conn: sqlite3.Connection, keys: Iterable) -> str:
+	"""
+	Loads keys into a new temporary table with a primary key index.
+	The table lives as long as the connection.
+
+	:return: Name of the table, with a single column named 'key'.
+	"""
+	table_name = f"temp.key_set_{next(_temp_table_ids)}"
+	conn.execute(f"CREATE TEMP TABLE {table_name.split('.')[1]} (key PRIMARY KEY) WITHOUT ROWID")
+	conn.executemany(f"INSERT OR IGNORE INTO {table_name} (key) VALUES (?)", ((key,) for key in keys))
+	return table_name
+
+
+def key_set_statements(conn: sqlite3.Connection, query: str, keys: Iterable, params=(),
+					   chunkable: bool = True) -> Iterator[tuple[str, list]]:
+	"""
+	Yields statements running a query for a set of keys of any size, picking the cheapest form:
+	a single IN list for small sets, one IN list per IN_LIST_LIMIT keys for medium sets of chunkable queries
+	and a join against a temporary table (see load_temp_key_table) otherwise.
+	The rows of all yielded statements together form the result.
+
+	:param conn: Connection the statements will be executed on (it owns the temporary table).
+	:param query: Query with KEYS in place of the key list, e.g. "... WHERE name IN ({KEYS})".
+				  Placeholders of params must come after KEYS.
+	:param keys: Keys, duplicates are removed.
+	:param params: Remaining parameters of the query.
+	:param chunkable: Whether running the query per chunk of keys gives the same rows. False for queries using
+					  DISTINCT, ORDER BY, LIMIT or aggregates across keys.
+	"""
+	keys = list(dict.fromkeys(keys))
+	if len(keys) <= IN_LIST_LIMIT:
+		yield _inline(query, keys, params)
+	elif chunkable and len(keys) <= MAX_CHUNKED_KEYS:
+		for start in range(0, len(keys), IN_LIST_LIMIT):
+			yield _inline(query, keys[start:start + IN_LIST_LIMIT], params)
+	else:
+		table_name = load_temp_key_table(conn, keys)
+		yield query.replace(KEYS, f"SELECT key FROM {table_name}"), list(params)
@@ -0,0 +1,165 @@
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Table names read by a query (FROM/JOIN clauses, subqueries included)
+_READ_TABLES_RE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_WRITE_RE = re.compile(r'\b(?:INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+# Authorizer actions modifying the table given as the first argument
+_WRITE_ACTIONS = {
+	sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE,
+	sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_CREATE_TABLE
+}
+
+
+class QueryCache:
+	"""
+	Memoizes SELECT results of BaseModel._execute_query for one unit of work (e.g. one drive update).
+
+	Outside of unit_of_work() the cache is inactive and every query hits the database.
+	Any statement modifying a table, also through connections not using _execute_query
+	and through ON DELETE CASCADE, drops the cached results reading that table - when it is prepared and
+	again when its transaction ends (see CachingConnection), as other connections read the old rows until then.
+	"""
+
+	def __init__(self):
+		self._entries: dict[tuple, tuple[set[str], object]] = {}
+		self._lock = threading.RLock()
+		self._depth = 0
+		self._version = 0
+		self.hits = 0
+		self.misses = 0
+		self.invalidations = 0
+
+	@property
+	def active(self) -> bool:
+		return self._depth > 0
+
+	@contextmanager
+	def unit_of_work(self, name: str = "unit of work"):
+		"""
+		Activates the cache for the duration of the block. Nested blocks share the outermost cache.
+		Hit and miss statistics are logged when the outermost block ends.
+		"""
+		from main import logger
+		with self._lock:
+			self._depth += 1
+		try:
+			yield self
+		finally:
+			with self._lock:
+				self._depth -= 1
+				if self._depth == 0:
+					logger.info(f"Query cache for {name}: {self.hits} hits, {self.misses} misses, "
+								f"{self.invalidations} invalidated results.")
+					self._entries.clear()
+					self.hits = self.misses = self.invalidations = 0
+
+	def lookup(self, query: str, params, result_format) -> tuple[object, bool, object]:
+		"""
+		Looks up a cached result.
+
+		:param result_format: Hashable description of how the result is fetched (e.g. fetch_one),
+							  results fetched differently are cached separately.
+
+		:return: (key, hit, result). key is None if the query is not cacheable and must be passed to put() on a miss.
+		"""
+		if not self.active or _WRITE_RE.search(query):
+			return None, False, None
+		key = (query, tuple(params), result_format)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return (key, self._version), False, None
+			self.hits += 1
+			return (key, self._version), True, entry[1]
+
+	def put(self, key, query: str, result) -> None:
+		"""Stores a result fetched after a lookup() miss, unless a table was modified in the meantime."""
+		if key is None:
+			return
+		cache_key, version = key
+		tables = {table.lower() for table in _READ_TABLES_RE.findall(query)}
+		with self._lock:
+			if self.active and version == self._version:
+				self._entries[cache_key] = (tables, result)
+
+	def invalidate(self, *tables: str) -> None:
+		"""Drops cached results reading any of the given tables."""
+		tables = {table.lower() for table in tables}
+		with self._lock:
+			self._version += 1
+			stale = [key for key, (entry_tables, _) in self._entries.items() if entry_tables & tables]
+			for key in stale:
+				del self._entries[key]
+			self.invalidations += len(stale)
+
+	def invalidate_all(self) -> None:
+		"""Drops all cached results."""
+		with self._lock:
+			self._version += 1
+			self.invalidations += len(self._entries)
+			self._entries.clear()
+
+	def authorizer(self, action, arg1, arg2, db_name, trigger_name):
+		"""SQLite authorizer callback invalidating results of tables modified by a statement being prepared."""
+		if not self.active:
+			return sqlite3.SQLITE_OK
+		if action == sqlite3.SQLITE_ALTER_TABLE:
+			# A renamed table (e.g. a generation swap) may take the name of another one
+			self.invalidate_all()
+		# Temporary tables (e.g. key sets) are private to their connection and never cached
+		elif action in _WRITE_ACTIONS and arg1 and db_name != 'temp':
+			self.invalidate(arg1)
+		return sqlite3.SQLITE_OK
+
+
+class CachingConnection(sqlite3.Connection):
+	"""
+	Connection opened inside QueryCache.unit_of_work(). Remembers the tables modified in the current transaction
+	and drops their cached results once more when it is committed, rolled back or closed: results read
+	by other connections between the statement and the commit hold the old rows.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._written_tables: set[str | None] = set()
+		self.set_authorizer(self._authorize)
+
+	def _authorize(self, action, arg1, arg2, db_name, trigger_name):
+		if action == sqlite3.SQLITE_ALTER_TABLE:
+			self._written_tables.add(None)
+		elif action in _WRITE_ACTIONS and arg1 and db_name != 'temp':
+			self._written_tables.add(arg1)
+		return query_cache.authorizer(action, arg1, arg2, db_name, trigger_name)
+
+	def _transaction_ended(self) -> None:
+		if None in self._written_tables:
+			query_cache.invalidate_all()
+		elif self._written_tables:
+			query_cache.invalidate(*self._written_tables)
+		self._written_tables.clear()
+
+	def commit(self):
+		super().commit()
+		self._transaction_ended()
+
+	def rollback(self):
+		super().rollback()
+		self._transaction_ended()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			return super().__exit__(exc_type, exc_value, traceback)
+		finally:
+			self._transaction_ended()
+
+	def close(self):
+		super().close()
+		self._transaction_ended()
+
+
+query_cache = QueryCache()
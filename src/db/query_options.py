@@ -7,7 +7,9 @@ class FileQueryOptions:
 				 active_only: bool = True):
 		self.folder_only = folder_only
 		self.exclude_shortcuts = exclude_shortcuts
+		self.temp = temp
 		self.table_name = "files_temp f" if temp else "files f"
+		self.closure_table_name = "file_closure_temp" if temp else "file_closure"
 		self.active_only = active_only
 
 	def get_mime_filter_sql(self) -> str:
@@ -20,7 +22,7 @@ class FileQueryOptions:
 
 	def get_active_filter_sql(self) -> str:
 		"""Returns the SQL fragment for filtering active records."""
-		return "active = 1" if self.active_only else ""
+		return " f.active = 1" if self.active_only else ""
 
 	def get_full_filter_sql(self, start_with_and=True) -> str:
 		"""Returns the full SQL fragment for all applied filters."""
@@ -0,0 +1,309 @@
+import math
+import zlib
+
+from src.db.query_options import FileQueryOptions
+from src.drive.drive_API_client import BATCH_LIMIT
+from src.models.category import Category
+from src.models.category_type import CategoryType
+from src.models.drive_file import DriveFile, DriveFileIndex
+from src.models.file import File
+from src.name_normalization import normalize_name
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+
+# Plan operations, in the order the executor applies them
+CREATE_FOLDER = 'create folder'
+CREATE_SHORTCUT = 'create shortcut'
+MOVE = 'move'
+RENAME = 'rename'
+DELETE = 'delete'
+ACTIONS = (CREATE_FOLDER, CREATE_SHORTCUT, MOVE, RENAME, DELETE)
+
+
+class PlanOperation:
+	"""
+	One change of the output tree.
+
+	Creations and moves reference their (new) parent either by Drive ID or, if the parent is created by the same
+	plan, by its creating operation, whose drive_file_id is set once it has been executed.
+	"""
+	__slots__ = ('action', 'level', 'name', 'category_type', 'parent', 'target_id', 'drive_file', 'drive_file_id',
+				 'mutation_id', 'category_id')
+
+	def __init__(self, action: str, level: int, name: str = None, category_type: CategoryType = None,
+				 parent: 'str | PlanOperation' = None, target_id: str = None, drive_file: DriveFile = None,
+				 category_id: int = None):
+		self.action = action
+		self.level = level
+		self.name = name
+		self.category_type = category_type
+		self.parent = parent
+		self.target_id = target_id
+		# Existing item moved, renamed or deleted by the operation
+		self.drive_file = drive_file
+		# Category the created item stands for
+		self.category_id = category_id
+		# ID of the created item, set by the executor
+		self.drive_file_id = None
+		# Journal entry of the operation while its outcome is unknown, see src.models.drive_mutation
+		self.mutation_id = None
+
+	@property
+	def parent_id(self) -> str | None:
+		"""Drive ID of the parent folder, None while the creation of the parent is pending or failed."""
+		return self.parent.drive_file_id if isinstance(self.parent, PlanOperation) else self.parent
+
+	def describe(self) -> str:
+		if self.action == DELETE:
+			return f"{self.action} level {self.level} '{self.drive_file.name}' ({self.drive_file.drive_file_id})"
+		if self.action == RENAME:
+			return f"{self.action} '{self.drive_file.name}' -> '{self.name}' ({self.drive_file.drive_file_id})"
+		parent = self.parent.name if isinstance(self.parent, PlanOperation) else self.parent
+		if self.action == MOVE:
+			return (f"{self.action} '{self.drive_file.name}' -> '{self.name}' ({self.drive_file.drive_file_id}) "
+					f"from {self.drive_file.parent_id} to {parent}")
+		target = f" -> {self.target_id}" if self.target_id else ""
+		return f"{self.action} level {self.level} '{self.name}'{target} in {parent}"
+
+
+class BuildPlan:
+	"""Operations turning the output tree recorded in drive_files into the desired one."""
+
+	def __init__(self):
+		self.operations: list[PlanOperation] = []
+		# Existing items which stay as they are
+		self.unchanged = 0
+		# Categories of kept items recorded before categories were, as (drive file ID, category ID) - no API calls
+		self.identities: list[tuple[str, int]] = []
+
+	def add(self, operation: PlanOperation) -> PlanOperation:
+		self.operations.append(operation)
+		return operation
+
+	def get(self, action: str, level: int = None) -> list[PlanOperation]:
+		return [op for op in self.operations if op.action == action and (level is None or op.level == level)]
+
+	def is_empty(self) -> bool:
+		return not self.operations
+
+	def api_cost(self) -> dict[str, tuple[int, int]]:
+		"""
+		Estimated cost of executing the plan per action, as (API calls, HTTP requests).
+		Calls are sent in batch requests (one per level for folders), every call still counts against the quota.
+		"""
+		cost = {}
+		for action in ACTIONS:
+			operations = self.get(action)
+			if action == CREATE_FOLDER:
+				levels = {op.level for op in operations}
+				requests = sum(math.ceil(len(self.get(action, level)) / BATCH_LIMIT) for level in levels)
+			elif action == DELETE:
+				# Items below a deleted folder go away with it
+				requests = math.ceil(len(self.drive_deletions()) / BATCH_LIMIT)
+				operations = self.drive_deletions()
+			else:
+				requests = math.ceil(len(operations) / BATCH_LIMIT)
+			cost[action] = (len(operations), requests)
+		return cost
+
+	def drive_deletions(self) -> list[PlanOperation]:
+		"""Deletions which must be sent to Drive - those of items whose parent folder is not deleted as well."""
+		deleted_ids = {op.drive_file.drive_file_id for op in self.get(DELETE)}
+		return [op for op in self.get(DELETE) if op.drive_file.parent_id not in deleted_ids]
+
+	def summary(self) -> str:
+		cost = self.api_cost()
+		parts = [f"{len(self.get(action))} x {action}" for action in ACTIONS if self.get(action)]
+		calls = sum(calls for calls, _ in cost.values())
+		requests = sum(requests for _, requests in cost.values())
+		return (f"{', '.join(parts) if parts else 'no changes'}; {self.unchanged} items unchanged; "
+				f"estimated cost: {calls} API calls in {requests} HTTP requests.")
+
+
+def shortcut_name(file: File) -> str:
+	"""Name of the shortcut to a file - folders get their creation date appended."""
+	return file.name + " (" + file.get_created_date() + ")" if file.mime_type == FOLDER_MIME_TYPE else file.name
+
+
+def shard_key(file: File, shard_by: str) -> str:
+	"""Sub-folder of a file in a sharded category folder, before splitting into buckets, see SHARD_KEYS."""
+	if shard_by == 'letter':
+		letter = (normalize_name(file.name) or '')[:1].upper()
+		return letter if letter.isalnum() else '#'
+	if shard_by == 'year':
+		return file.created_time[:4] if file.created_time else 'Unknown year'
+	if shard_by == 'owner':
+		return file.owner or 'Unknown owner'
+	return ''
+
+
+def shard_files(files: list[File], shard_by: str | None, shard_size: int,
+				sharded: bool = False) -> dict[str | None, list[File]]:
+	"""
+	Splits the files of a category with more than shard_size files into sub-folders by shard_key.
+	A category which is already sharded stays so until it shrinks to half of shard_size, so one
+	growing and shrinking around the limit is not moved in and out of sub-folders on every build.
+	Sub-folders which would still hold more than shard_size files are split further into numbered buckets
+	of about shard_size files by a hash of the file ID (all files of a 'hash' category are). A file keeps
+	its sub-folder while other files come and go - the number of buckets only doubles or halves when
+	a sub-folder outgrows or shrinks below the limit, which moves about half of its files.
+
+	:param sharded: Whether the category folder already holds sub-folders.
+	:return: Files by sub-folder name, {None: files} if the category is not sharded.
+	"""
+	if not shard_by or len(files) <= (shard_size // 2 if sharded else shard_size):
+		return {None: files}
+	groups: dict[str, list[File]] = {}
+	for file in files:
+		groups.setdefault(shard_key(file, shard_by), []).append(file)
+	shards = {}
+	for key, group in sorted(groups.items()):
+		buckets = 1
+		while len(group) > buckets * shard_size or (not key and buckets == 1):
+			buckets *= 2
+		if buckets == 1:
+			shards[key] = group
+			continue
+		for file in group:
+			bucket = zlib.crc32(file.drive_file_id.encode()) % buckets
+			shards.setdefault(f"{key} {bucket + 1}".strip(), []).append(file)
+	return shards
+
+
+def plan_build(root_folder_id: str, changed_categories: set[int] = None) -> BuildPlan:
+	"""
+	Computes the desired output tree - a folder per category type, in it a folder per category holding
+	shortcuts to the category's files (or, for 'shortcut' types with a single file, a shortcut named after
+	the category) - and diffs it against drive_files.
+
+	Categories of types with shard_by set hold their shortcuts in sub-folders once they outgrow shard_size,
+	see shard_files.
+
+	Existing items are matched by stable identity: category folders by category (by name for items recorded
+	before categories were), sub-folders by name, shortcuts by target. Matched items whose name or place changed
+	are renamed or moved in place, so they keep their IDs and links. Shortcuts of a file which moved to another category are moved too.
+
+	With changed_categories (see src.models.category_change) the plan is incremental: only categories whose links
+	changed and categories without an output item yet are diffed, the items of all other categories are kept
+	as they are without reading their files.
+
+	Nothing is changed, the plan is applied by DriveBuilder.apply_plan.
+	"""
+	plan = BuildPlan()
+	index = DriveFileIndex.load()
+	matched: set[int] = set()
+	# Shortcuts missing from their category folder, created or moved there once all other shortcuts are matched
+	missing_shortcuts: list[PlanOperation] = []
+
+	def keep(drive_file: DriveFile, name: str, parent: 'str | PlanOperation' = None, category_id: int = None,
+			 level: int = None) -> None:
+		matched.add(drive_file.id)
+		if category_id is not None and drive_file.category_id != category_id:
+			plan.identities.append((drive_file.drive_file_id, category_id))
+		if parent is not None and drive_file.parent_id != parent:
+			plan.add(PlanOperation(MOVE, level or drive_file.level, name, parent=parent, drive_file=drive_file))
+		elif drive_file.name != name:
+			plan.add(PlanOperation(RENAME, drive_file.level, name, drive_file=drive_file))
+		else:
+			plan.unchanged += 1
+
+	def unmatched(drive_file: DriveFile | None) -> DriveFile | None:
+		return drive_file if drive_file and drive_file.id not in matched else None
+
+	def unchanged_item(category: Category) -> DriveFile | None:
+		"""Output item of a category which is not diffed, see changed_categories."""
+		if changed_categories is None or category.id in changed_categories:
+			return None
+		return unmatched(index.find_by_category(2, category.id, shortcut=False)) or unmatched(
+			index.find_by_category(2, category.id, shortcut=True))
+
+	# Output items of categories which are not diffed, everything below them is kept
+	unchanged_items: set[str] = set()
+
+	for category_type in CategoryType.get_all():
+		type_folder = index.find_folder(1, category_type.id, root_folder_id, category_type.name) or next(
+			iter(index.children(1, category_type.id, root_folder_id)), None)
+		if type_folder:
+			keep(type_folder, category_type.name)
+			type_parent = type_folder.drive_file_id
+		else:
+			type_parent = plan.add(PlanOperation(CREATE_FOLDER, 1, category_type.name, category_type, root_folder_id))
+
+		options = FileQueryOptions(exclude_shortcuts=True, folder_only=category_type.aggregation_type == "shortcut")
+		categories = Category.get_by_type(category_type)
+		unchanged = {category.id: unchanged_item(category) for category in categories}
+		files_by_category = File.get_files_by_categories(
+			category_type, options,
+			[c.id for c in categories if not unchanged[c.id]] if changed_categories is not None else None)
+		for category in categories:
+			if unchanged[category.id]:
+				keep(unchanged[category.id], category.canonical_name, type_parent, category.id)
+				unchanged_items.add(unchanged[category.id].drive_file_id)
+				continue
+			files = files_by_category.get(category.id, [])
+
+			# A 'shortcut' category with a single file is a shortcut in the category type folder
+			if category_type.aggregation_type == "shortcut" and len(files) == 1:
+				shortcut = unmatched(index.find_shortcut(2, type_folder.drive_file_id, files[0].drive_file_id)
+									 if type_folder else None)
+				if shortcut:
+					keep(shortcut, category.canonical_name, category_id=category.id)
+				else:
+					plan.add(PlanOperation(CREATE_SHORTCUT, 2, category.canonical_name, category_type, type_parent,
+										   files[0].drive_file_id, category_id=category.id))
+				continue
+
+			folder = unmatched(index.find_by_category(2, category.id, shortcut=False)) or unmatched(
+				index.find_folder(2, category_type.id, type_folder.drive_file_id, category.canonical_name)
+				if type_folder else None)
+			if folder:
+				keep(folder, category.canonical_name, type_parent, category.id)
+				folder_parent = folder.drive_file_id
+			else:
+				folder_parent = plan.add(PlanOperation(CREATE_FOLDER, 2, category.canonical_name, category_type,
+													   type_parent, category_id=category.id))
+
+			sharded = folder is not None and any(f.shortcut_target_id is None for f in
+												 index.children(3, category_type.id, folder.drive_file_id))
+			for shard, shard_members in shard_files(files, category_type.shard_by, category_type.shard_size,
+													sharded).items():
+				shortcut_level, parent, parent_id = 3, folder_parent, folder.drive_file_id if folder else None
+				if shard is not None:
+					shard_folder = unmatched(index.find_folder(3, category_type.id, parent_id, shard)) if folder else None
+					if shard_folder:
+						keep(shard_folder, shard, category_id=category.id)
+						parent = parent_id = shard_folder.drive_file_id
+					else:
+						parent = plan.add(PlanOperation(CREATE_FOLDER, 3, shard, category_type, folder_parent,
+														category_id=category.id))
+						parent_id = None
+					shortcut_level = 4
+
+				for file in shard_members:
+					target_id = file.drive_file_id if file.shortcut_target_id is None else file.shortcut_target_id
+					shortcut = index.find_shortcut(shortcut_level, parent_id, target_id) if parent_id else None
+					if shortcut and shortcut.id not in matched:
+						keep(shortcut, shortcut_name(file))
+					elif not shortcut:
+						missing_shortcuts.append(PlanOperation(CREATE_SHORTCUT, shortcut_level, shortcut_name(file),
+															   category_type, parent, target_id))
+
+	for drive_file in index.subtree(unchanged_items):
+		if drive_file.id not in matched:
+			matched.add(drive_file.id)
+			plan.unchanged += 1
+
+	# Spares in other categories or sub-folders, e.g. of a category which was sharded or unsharded, are moved
+	for op in missing_shortcuts:
+		spares = [s for level in (3, 4) for s in index.shortcuts_to(level, op.target_id) if s.id not in matched]
+		spare = min(spares, key=lambda s: s.level != op.level, default=None)
+		if spare:
+			keep(spare, op.name, op.parent, level=op.level)
+		else:
+			plan.add(op)
+
+	for drive_file in index:
+		if drive_file.level > 0 and drive_file.id not in matched:
+			plan.add(PlanOperation(DELETE, drive_file.level, drive_file=drive_file))
+	return plan
@@ -1,6 +1,8 @@
 import http.client as http_client
 import logging
 import socket
+import threading
+import time
 
 import googleapiclient
 import httplib2
@@ -13,6 +15,7 @@ from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_excep
 from enum import Enum
 
 from main import logger
+from src.drive.write_scheduler import WriteScheduler
 from src.models.file import File
 
 # --- Configuration ---
@@ -28,6 +31,93 @@ RETRYABLE_EXCEPTIONS = (
 
 DEFAULT_HTTP_TIMEOUT = 30
 
+# Drive accepts at most 100 calls per batch request
+BATCH_LIMIT = 100
+# Page size of listings, the maximum files.list allows
+LIST_PAGE_SIZE = 1000
+# Folders whose items are listed by one files.list query, keeping the query string short
+PARENTS_PER_QUERY = 50
+# Statuses of batched calls worth retrying on their own (rate limits and server errors), see is_retryable_error
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_rate_limit_error(error: googleapiclient.errors.HttpError) -> bool:
+	"""Drive reports exceeded rate limits as 403 (rateLimitExceeded, userRateLimitExceeded) or 429."""
+	return error.resp.status == 429 or (error.resp.status == 403 and b'ateLimitExceeded' in (error.content or b''))
+
+
+def is_retryable_error(error: Exception) -> bool:
+	"""Whether a failed call may succeed when repeated later."""
+	if isinstance(error, googleapiclient.errors.HttpError):
+		return error.resp.status in RETRYABLE_STATUSES or is_rate_limit_error(error)
+	return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+class RateLimiter:
+	"""
+	Token bucket shared by threads: on average at most `rate` calls per second, in bursts of up to `burst` calls.
+	Callers reserve calls up front and sleep outside the lock, so a large batch only delays the calls after it.
+	"""
+
+	def __init__(self, rate: float, burst: int = None):
+		self.rate = rate
+		self.burst = burst if burst else max(1, int(rate))
+		self._tokens = float(self.burst)
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def acquire(self, calls: int = 1) -> float:
+		"""
+		Blocks until `calls` more calls fit into the rate. A rate of 0 or less disables the limit.
+
+		:return: Seconds spent waiting.
+		"""
+		if self.rate <= 0:
+			return 0.0
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			self._tokens -= calls
+			delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+		if delay:
+			time.sleep(delay)
+		return delay
+
+
+class ServicePool:
+	"""
+	Drive service instances for worker threads. Service objects are not thread-safe, so every thread
+	gets its own, created on first use and reused by later tasks of the thread until close().
+	"""
+
+	def __init__(self, credentials: Credentials):
+		self.credentials = credentials
+		self._local = threading.local()
+		self._services = []
+		self._lock = threading.Lock()
+
+	def get(self) -> googleapiclient.discovery.Resource:
+		service = getattr(self._local, 'service', None)
+		if service is None:
+			service = DriveAPIClient.create_drive_service(self.credentials)
+			self._local.service = service
+			with self._lock:
+				self._services.append(service)
+		return service
+
+	def close(self) -> None:
+		with self._lock:
+			for service in self._services:
+				service.close()
+			self._services.clear()
+		self._local = threading.local()
+
+
+def query_literal(value: str) -> str:
+	"""Quotes a value for a files.list query."""
+	return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
 
 # --- NEW: Enum for Drive Scope Modes ---
 class DriveScopeMode(Enum):
@@ -52,8 +142,15 @@ class DriveAPIClient:
 		DriveScopeMode.DRIVE: ['https://www.googleapis.com/auth/drive']
 	}
 
-	def __init__(self):
-		pass
+	def __init__(self, rate_limiter: RateLimiter = None, write_scheduler: WriteScheduler = None):
+		# Limiter shared by all threads using the client, None for no limit
+		self.rate_limiter = rate_limiter
+		# Pacing of write calls, see src.drive.write_scheduler - None for no pacing
+		self.write_scheduler = write_scheduler
+
+	def _wait_for_quota(self, calls: int = 1) -> None:
+		if self.rate_limiter:
+			self.rate_limiter.acquire(calls)
 
 	@retry(
 		stop=stop_after_attempt(5),
@@ -63,7 +160,10 @@ class DriveAPIClient:
 	def _execute_api_call_with_retry(self, api_call, error_entity_id: str, error_entity_type: str) -> dict:
 		"""
 		Executes a Google Drive API call with a retry mechanism.
+
+		:return: Response of the call, {} if the item was not found (404), None if the call was denied (403).
 		"""
+		self._wait_for_quota()
 		try:
 			response = api_call.execute()
 			return response
@@ -74,12 +174,12 @@ class DriveAPIClient:
 					f"Status: {e.resp.status}"
 				)
 				return {}
-			elif e.resp.status == 403:
+			elif e.resp.status == 403 and not is_rate_limit_error(e):
 				logger.error(
 					f"Permission denied for {error_entity_type} with ID {error_entity_id}. "
 					f"Status: {e.resp.status}"
 				)
-				return {}
+				return None
 			else:
 				logger.error(
 					f"HTTP Error ({e.resp.status}) while fetching {error_entity_type} {error_entity_id}. "
@@ -87,6 +187,68 @@ class DriveAPIClient:
 				)
 				raise
 
+	def execute_batch(self, service_instance: googleapiclient.discovery.Resource, api_requests: list,
+					  error_entity_type: str, priority: int = None) -> list[dict | None]:
+		"""
+		Executes API calls in batch requests of up to BATCH_LIMIT calls, so many calls cost one HTTP round trip.
+		Calls failing with a retryable status (e.g. rate limits) are retried on their own
+		with the retry policy of single calls.
+
+		:param api_requests: Requests built on the service instance, as (entity ID used in logs, request) pairs.
+		:param priority: Priority of write calls for the write scheduler (lower first), None for read calls.
+		:return: Response of every request, in the order of api_requests. {} for calls which found nothing
+				 (404), None for calls which were denied (403) or failed for good.
+		"""
+		results: list[dict | None] = [None] * len(api_requests)
+		to_retry = set()
+		scheduler = self.write_scheduler if priority is not None else None
+		rate_limited = []
+
+		def callback(request_id, response, exception):
+			index = int(request_id)
+			if exception is None:
+				# Calls without a response body (e.g. delete) succeed with an empty response
+				results[index] = response if response else {}
+			elif isinstance(exception, googleapiclient.errors.HttpError) and exception.resp.status == 404:
+				logger.warning(f"Could not find {error_entity_type} with ID {api_requests[index][0]} or no permissions.")
+				results[index] = {}
+			elif is_retryable_error(exception):
+				to_retry.add(index)
+				if isinstance(exception, googleapiclient.errors.HttpError) and is_rate_limit_error(exception):
+					rate_limited.append(index)
+			else:
+				logger.error(f"Batched {error_entity_type} of {api_requests[index][0]} failed: {exception}")
+
+		for start in range(0, len(api_requests), BATCH_LIMIT):
+			batch = service_instance.new_batch_http_request(callback=callback)
+			for index in range(start, min(start + BATCH_LIMIT, len(api_requests))):
+				batch.add(api_requests[index][1], request_id=str(index))
+			calls = min(BATCH_LIMIT, len(api_requests) - start)
+			if scheduler:
+				scheduler.acquire(calls, priority)
+			self._wait_for_quota(calls)
+			rate_limited.clear()
+			try:
+				batch.execute()
+			except RETRYABLE_EXCEPTIONS as e:
+				# The batch request itself failed before any response arrived - every call of it is retried on its own
+				logger.warning(f"Batch request of {error_entity_type} calls failed, retrying them one by one: {e}")
+				to_retry.update(range(start, min(start + BATCH_LIMIT, len(api_requests))))
+			if scheduler:
+				scheduler.report(calls, len(rate_limited))
+
+		for index in sorted(to_retry):
+			entity_id, api_request = api_requests[index]
+			if scheduler:
+				scheduler.acquire(1, priority)
+			try:
+				response = self._execute_api_call_with_retry(api_request, entity_id, error_entity_type)
+				if response is not None:
+					results[index] = response if response else {}
+			except Exception as e:
+				logger.error(f"{error_entity_type} of {entity_id} failed after retries: {e}")
+		return results
+
 	def fetch_file_data(self, service_instance: googleapiclient.discovery.Resource, file_id: str) -> File:
 		"""
 		Fetches metadata for a single file or folder from Google Drive using a given service instance.
@@ -128,6 +290,81 @@ class DriveAPIClient:
 			'nextPageToken': response.get('nextPageToken')
 		}
 
+	def list_folders_children(self, service_instance: googleapiclient.discovery.Resource,
+							  folder_ids: list[str]) -> list[File] | None:
+		"""
+		Lists the items of many folders with one files.list query ('a' in parents or 'b' in parents ...),
+		following all pages. Trashed items are left out, as if they were deleted.
+
+		:param folder_ids: At most PARENTS_PER_QUERY folder IDs.
+		:return: Items of all the folders, None if a page could not be fetched.
+		"""
+		parents = " or ".join(f"{query_literal(folder_id)} in parents" for folder_id in folder_ids)
+		query = f"({parents}) and trashed = false"
+		files: list[File] = []
+		page_token = None
+		while True:
+			api_request = service_instance.files().list(
+				q=query,
+				pageSize=LIST_PAGE_SIZE,
+				fields="files(id, name, mimeType, parents, shortcutDetails), nextPageToken",
+				supportsAllDrives=True,
+				includeItemsFromAllDrives=True,
+				pageToken=page_token
+			)
+			try:
+				response = self._execute_api_call_with_retry(api_request, folder_ids[0], "list: folders")
+			except Exception as e:
+				logger.error(f"Listing of {len(folder_ids)} folders starting with {folder_ids[0]} failed: {e}")
+				return None
+			if not response or 'files' not in response:
+				return None
+			files.extend(File.from_api_response(file) for file in response['files'])
+			page_token = response.get('nextPageToken')
+			if not page_token:
+				return files
+
+	def find_children(self, service_instance: googleapiclient.discovery.Resource,
+					  lookups: list[tuple[str, str | None, str | None]]) -> list[list[File] | None]:
+		"""
+		Looks up specific items in folders with one files.list query per lookup, sent in batch requests.
+
+		:param lookups: (parent folder ID, folder name or None, shortcut target ID or None) of every lookup.
+						A lookup with a name finds folders of that name, one with a target ID finds shortcuts to it.
+		:return: Items found by every lookup in the order of lookups, None where the lookup failed.
+		"""
+		api_requests = []
+		for parent_id, name, target_id in lookups:
+			conditions = [f"{query_literal(parent_id)} in parents", "trashed = false"]
+			if name is not None:
+				conditions.append(f"name = {query_literal(name)}")
+				conditions.append("mimeType = 'application/vnd.google-apps.folder'")
+			if target_id is not None:
+				conditions.append(f"shortcutDetails.targetId = {query_literal(target_id)}")
+			api_requests.append((parent_id, service_instance.files().list(
+				q=" and ".join(conditions),
+				fields="files(id, name, mimeType, parents, shortcutDetails)",
+				supportsAllDrives=True,
+				includeItemsFromAllDrives=True
+			)))
+		responses = self.execute_batch(service_instance, api_requests, 'find: item')
+		return [None if response is None else [File.from_api_response(file) for file in response.get('files', [])]
+				for response in responses]
+
+	def fetch_files(self, service_instance: googleapiclient.discovery.Resource,
+					file_ids: list[str]) -> list[File | dict | None]:
+		"""
+		Fetches names and parents of many items in batch requests, see execute_batch.
+
+		:return: Item of every ID in the order of file_ids, {} where it does not exist (404)
+				 and None where it could not be fetched.
+		"""
+		api_requests = [(file_id, service_instance.files().get(fileId=file_id, fields="id, name, mimeType, parents",
+															   supportsAllDrives=True))
+						for file_id in file_ids]
+		responses = self.execute_batch(service_instance, api_requests, 'fetch: file')
+		return [File.from_api_response(response) if response else response for response in responses]
+
 	def create_drive_folder(self, service_instance: googleapiclient.discovery.Resource, folder_name: str,
 							parent_folder_id: str) -> File:
 		file_metadata = {
@@ -165,6 +402,100 @@ class DriveAPIClient:
 		response = self._execute_api_call_with_retry(api_request, shortcut_name, 'create: shortcut')
 		return File.from_api_response(response) if response else None
 
+	def create_drive_folders(self, service_instance: googleapiclient.discovery.Resource,
+							 folders: list[tuple[str, str]], priority: int = 0) -> list[File | None]:
+		"""
+		Creates many folders in batch requests, see execute_batch.
+
+		:param folders: (folder name, parent folder ID) of every folder.
+		:return: Created folder of every entry in the order of folders, None where creation failed.
+		"""
+		api_requests = []
+		for folder_name, parent_folder_id in folders:
+			file_metadata = {
+				'name': folder_name,
+				'mimeType': 'application/vnd.google-apps.folder'
+			}
+			if parent_folder_id:
+				file_metadata['parents'] = [parent_folder_id]
+			api_requests.append((folder_name, service_instance.files().create(
+				body=file_metadata,
+				fields="id, name, mimeType, parents, owners, createdTime, modifiedTime, size, md5Checksum",
+				supportsAllDrives=True
+			)))
+		responses = self.execute_batch(service_instance, api_requests, 'create: folder', priority)
+		return [File.from_api_response(response) if response else None for response in responses]
+
+	def rename_drive_files(self, service_instance: googleapiclient.discovery.Resource,
+						   renames: list[tuple[str, str]], priority: int = 0) -> list[bool]:
+		"""
+		Renames many files in batch requests, see execute_batch.
+
+		:param renames: (file ID, new name) of every file.
+		:return: Whether each file was renamed, in the order of renames.
+		"""
+		api_requests = [(file_id, service_instance.files().update(fileId=file_id, body={'name': name}, fields="id, name",
+																  supportsAllDrives=True))
+						for file_id, name in renames]
+		responses = self.execute_batch(service_instance, api_requests, 'rename: file', priority)
+		return [bool(response) for response in responses]
+
+	def move_drive_files(self, service_instance: googleapiclient.discovery.Resource,
+						 moves: list[tuple[str, str, str, str]], priority: int = 0) -> list[bool]:
+		"""
+		Renames many files and moves them to another folder in batch requests, see execute_batch.
+		The files keep their IDs, so links to them keep working.
+
+		:param moves: (file ID, new name, new parent folder ID, old parent folder ID) of every file.
+		:return: Whether each file was moved, in the order of moves.
+		"""
+		api_requests = [(file_id, service_instance.files().update(fileId=file_id, body={'name': name},
+																  addParents=new_parent_id, removeParents=old_parent_id,
+																  fields="id, name, parents", supportsAllDrives=True))
+						for file_id, name, new_parent_id, old_parent_id in moves]
+		responses = self.execute_batch(service_instance, api_requests, 'move: file', priority)
+		return [bool(response) for response in responses]
+
+	def create_drive_shortcuts(self, service_instance: googleapiclient.discovery.Resource,
+							   shortcuts: list[tuple[str, str, str]], priority: int = 0) -> list[File | None]:
+		"""
+		Creates many shortcuts in batch requests, see execute_batch.
+
+		:param shortcuts: (shortcut name, target ID, parent folder ID) of every shortcut.
+		:return: Created shortcut of every entry in the order of shortcuts, None where creation failed.
+		"""
+		api_requests = []
+		for shortcut_name, target_id, parent_folder_id in shortcuts:
+			file_metadata = {
+				'name': shortcut_name,
+				'mimeType': 'application/vnd.google-apps.shortcut',
+				'shortcutDetails': {
+					'targetId': target_id
+				}
+			}
+			if parent_folder_id:
+				file_metadata['parents'] = [parent_folder_id]
+			api_requests.append((shortcut_name, service_instance.files().create(
+				body=file_metadata,
+				fields="id, name, mimeType, parents, owners, createdTime, modifiedTime, size, shortcutDetails, md5Checksum",
+				supportsAllDrives=True
+			)))
+		responses = self.execute_batch(service_instance, api_requests, 'create: shortcut', priority)
+		return [File.from_api_response(response) if response else None for response in responses]
+
+	def remove_drive_files(self, service_instance: googleapiclient.discovery.Resource,
+						   file_ids: list[str], priority: int = 0) -> list[bool]:
+		"""
+		Deletes many files in batch requests, see execute_batch.
+
+		:return: Whether each file is gone, in the order of file_ids. Missing files (404) count as deleted,
+				 files which could not be deleted (e.g. denied) do not.
+		"""
+		api_requests = [(file_id, service_instance.files().delete(fileId=file_id, supportsAllDrives=True))
+						for file_id in file_ids]
+		responses = self.execute_batch(service_instance, api_requests, 'remove: file', priority)
+		return [response is not None for response in responses]
+
 	def remove_drive_file(self, service_instance: googleapiclient.discovery.Resource, file_id: str):
 		"""
 		Deletes a Google Drive shortcut by its ID.
@@ -1,26 +1,45 @@
 import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 
-from main import logger
-from src.db.query_options import FileQueryOptions
-from src.drive.drive_API_client import DriveAPIClient, DriveScopeMode
-from src.models.category import Category
+from main import logger, config_data
+from src.drive.build_plan import BuildPlan, PlanOperation, CREATE_FOLDER, CREATE_SHORTCUT, MOVE, RENAME, DELETE, \
+	FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE
+from src.drive.drive_API_client import DriveAPIClient, DriveScopeMode, RateLimiter, ServicePool, BATCH_LIMIT, \
+	PARENTS_PER_QUERY
+from src.drive.write_scheduler import WriteScheduler
 from src.models.category_type import CategoryType
-from src.models.drive_file import DriveFile
+from src.models.drive_file import DriveFile, DriveFileIndex
+from src.models.drive_mutation import DriveMutation
 from src.models.file import File
 
+# Write priorities of the write scheduler (lower first). Folders other writes wait for go first, category type
+# folders (level 1) before category folders (level 2), see write_priority.
+WRITE_PRIORITIES = {CREATE_FOLDER: 0, CREATE_SHORTCUT: 10, MOVE: 11, RENAME: 11, DELETE: 12}
+# Seconds between progress logs of a running build
+PROGRESS_LOG_INTERVAL = 30
+
+
+def write_priority(action: str, level: int) -> int:
+	return WRITE_PRIORITIES[action] + (level - 1 if action == CREATE_FOLDER else 0)
+
 
 # --- DriveScanner Class for Concurrent Operations ---
 class DriveBuilder:
 	def __init__(self):
 
-		self.api_client = DriveAPIClient()
+		self.write_scheduler = WriteScheduler(config_data.drive_write_rate, config_data.drive_write_burst)
+		self.api_client = DriveAPIClient(RateLimiter(config_data.drive_api_rate), self.write_scheduler)
+		self.workers = config_data.drive_build_workers
+		self._tree_listing: TreeListing | None = None
 		self.credentials = DriveAPIClient.get_credentials(scope_mode=DriveScopeMode.DRIVE)
 		self.service = build('drive', 'v3', credentials=self.credentials)
-		self.root_folder_id = DriveFile.get_drive_files_by_level(0)[
-			0].drive_file_id if DriveFile.get_drive_files_by_level(0) else None
+		root_folders = DriveFile.get_drive_files_by_level(0)
+		self.root_folder_id = root_folders[0].drive_file_id if root_folders else None
 
 	def create_root_folder(self, root_folder_name: str, root_folder_location: str = "") -> str | None:
 		"""
@@ -41,175 +60,367 @@ class DriveBuilder:
 		task_service.close()
 		return self.root_folder_id
 
-	def get_folder_files(self, folder_id: str, folder_only: bool = False) -> list[File]:
+	def apply_plan(self, plan: BuildPlan) -> bool:
 		"""
-		Retrieves a list of folders in the folder.
-		Returns a list of dictionaries containing folder metadata.
+		Executes a build plan (see src.drive.build_plan) on a pool of worker threads and records the changes
+		in the drive_files table. A creation is sent as soon as its parent folder exists, so shortcuts of one
+		category folder are created while other folders are still pending. Calls of one kind are sent in batch
+		requests, paced by the rate limiter shared by all workers and by the write scheduler, which sends
+		folders before shortcuts and logs the progress. Workers only call the API, drive_files is
+		written by the calling thread as their results come in. Operations whose parent could not be created
+		are skipped.
+
+		Every call is recorded in the drive_mutations journal before it is sent and settled together with
+		its drive_files change, so a build killed midway can be resumed, see resume_journal.
+
+		:return: True if every operation succeeded.
 		"""
-		task_service = DriveAPIClient.create_drive_service(self.credentials)
-		# task_service = build('drive', 'v3', credentials=self.credentials)
-		response = self.api_client.fetch_folder_data(task_service, folder_id, None)
-		files_on_page: list[File] = response.get('files', [])
+		DriveFile.set_category_ids(plan.identities)
+		self.write_scheduler.announce(sum(calls for calls, _ in plan.api_cost().values()))
+		logger.info(f"Applying the build plan: {self.write_scheduler.status()}")
+		services = ServicePool(self.credentials)
+		failed = 0
+		try:
+			with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+				failed += self._create(executor, services, plan)
+				failed += self._move(executor, services, plan)
+
+				operations = plan.get(RENAME)
+				self._journal(operations)
+				renamed = self._map_batches(executor, services, self.api_client.rename_drive_files,
+											[(op.drive_file.drive_file_id, op.name) for op in operations],
+											write_priority(RENAME, 0))
+				done = [op for op, ok in zip(operations, renamed) if ok]
+				DriveFile.rename_many([(op.drive_file.drive_file_id, op.name) for op in done],
+									  confirmed_mutations=[op.mutation_id for op in done])
+				failed += renamed.count(False)
+
+				failed += self._delete(executor, services, plan)
+		finally:
+			services.close()
+			self.write_scheduler.clear_announced()
+
+		if failed:
+			logger.error(f"{failed} operations of the build plan failed, they will be retried by the next update.")
+		return failed == 0
+
+	@staticmethod
+	def _journal(operations: list[PlanOperation]) -> None:
+		"""Records operations about to be sent in the drive_mutations journal."""
+		mutations = [DriveMutation(action=op.action, level=op.level, name=op.name,
+								   category_type_id=op.category_type.id if op.category_type else None,
+								   parent_id=op.parent_id, target_id=op.target_id,
+								   drive_file_id=op.drive_file.drive_file_id if op.drive_file else None,
+								   category_id=op.category_id)
+					 for op in operations]
+		DriveMutation.record(mutations)
+		for op, mutation in zip(operations, mutations):
+			op.mutation_id = mutation.id
+
+	@staticmethod
+	def _map_batches(executor: ThreadPoolExecutor, services: ServicePool, call, items: list, priority: int) -> list:
+		"""
+		Splits items into batches of BATCH_LIMIT, runs call(service, batch, priority) for every batch on the pool
+		and returns the results of all items in the order of items.
+		"""
+		futures = [executor.submit(lambda batch: call(services.get(), batch, priority), items[start:start + BATCH_LIMIT])
+				   for start in range(0, len(items), BATCH_LIMIT)]
+		return [result for future in futures for result in future.result()]
+
+	def _create_batch(self, services: ServicePool, action: str, level: int,
+					  operations: list[PlanOperation]) -> tuple[list[PlanOperation], list[File | None]]:
+		"""Sends one batch of creations, run by a worker thread."""
+		priority = write_priority(action, level)
+		if action == CREATE_FOLDER:
+			created = self.api_client.create_drive_folders(services.get(), [(op.name, op.parent_id) for op in operations],
+														   priority)
+		else:
+			created = self.api_client.create_drive_shortcuts(
+				services.get(), [(op.name, op.target_id, op.parent_id) for op in operations], priority)
+		return operations, created
+
+	def _create(self, executor: ThreadPoolExecutor, services: ServicePool, plan: BuildPlan) -> int:
+		"""
+		Creates the folders and shortcuts of the plan, every operation once its parent folder exists.
 
-		files = []
-		for file in files_on_page:
-			if folder_only and file.mime_type != 'application/vnd.google-apps.folder':
+		:return: Number of failed and skipped creations.
+		"""
+		# Creations waiting for the creation of their parent folder
+		children: dict[PlanOperation, list[PlanOperation]] = defaultdict(list)
+		ready = []
+		for op in plan.get(CREATE_FOLDER) + plan.get(CREATE_SHORTCUT):
+			if isinstance(op.parent, PlanOperation):
+				children[op.parent].append(op)
+			else:
+				ready.append(op)
+
+		futures = set()
+
+		def submit(operations):
+			groups = defaultdict(list)
+			for op in operations:
+				groups[(op.action, op.level)].append(op)
+			for (action, level), group in groups.items():
+				for start in range(0, len(group), BATCH_LIMIT):
+					batch = group[start:start + BATCH_LIMIT]
+					self._journal(batch)
+					futures.add(executor.submit(self._create_batch, services, action, level, batch))
+
+		failed = 0
+		submit(ready)
+		last_log = time.monotonic()
+		while futures:
+			done, futures = wait(futures, return_when=FIRST_COMPLETED)
+			if time.monotonic() - last_log > PROGRESS_LOG_INTERVAL:
+				logger.info(f"Build in progress: {self.write_scheduler.status()}")
+				last_log = time.monotonic()
+			unblocked = []
+			for future in done:
+				operations, created = future.result()
+				failed += self._record_created(operations, created)
+				for op in operations:
+					if op.drive_file_id:
+						unblocked.extend(children.pop(op, []))
+			submit(unblocked)
+
+		# What is left waits for a failed creation, directly or through a skipped folder
+		skipped = [op for operations in children.values() for op in operations]
+		for op in skipped:
+			logger.error(f"Skipping {op.describe()}, its parent folder could not be created.")
+		return failed + len(skipped)
+
+	def _record_created(self, operations: list[PlanOperation], created: list[File | None]) -> int:
+		"""Records created items in drive_files and the cached tree listing. :return: Number of failed creations."""
+		entries = []
+		for op, file in zip(operations, created):
+			if not file:
+				logger.error(f"Failed to {op.describe()}")
 				continue
-			files.append(file)
-		task_service.close()
-		return files
+			logger.debug(f"Done: {op.describe()} with ID {file.drive_file_id}")
+			op.drive_file_id = file.drive_file_id
+			entries.append((file, op.level, op.category_type, op.category_id))
+			if self._tree_listing is not None:
+				self._tree_listing.files[file.drive_file_id] = file
+		# Failed calls stay in the journal, they may have been carried out nevertheless
+		DriveFile.add_drive_files(entries, confirmed_mutations=[op.mutation_id for op in operations if op.drive_file_id])
+		return len(operations) - len(entries)
+
+	def _move(self, executor: ThreadPoolExecutor, services: ServicePool, plan: BuildPlan) -> int:
+		"""
+		Moves (and renames) items to their new parent folders, which exist once the creations are done.
 
-	def build_category_type_normal(self, category_type: CategoryType):
+		:return: Number of failed and skipped moves.
 		"""
-		Builds categories and shortcuts for a given category type.
-		Creates folders and shortcuts only if they do not exist in drive_file table.
-		:param category_type:
-		:return:
+		operations = plan.get(MOVE)
+		ready = [op for op in operations if op.parent_id]
+		for op in operations:
+			if not op.parent_id:
+				logger.error(f"Skipping {op.describe()}, its new parent folder could not be created.")
+		self._journal(ready)
+		moved = self._map_batches(executor, services, self.api_client.move_drive_files,
+								  [(op.drive_file.drive_file_id, op.name, op.parent_id, op.drive_file.parent_id)
+								   for op in ready], write_priority(MOVE, 0))
+		done = [op for op, ok in zip(ready, moved) if ok]
+		for op in done:
+			logger.debug(f"Done: {op.describe()}")
+			if self._tree_listing is not None and op.drive_file.drive_file_id in self._tree_listing.files:
+				self._tree_listing.files[op.drive_file.drive_file_id].parent_id = op.parent_id
+		DriveFile.move_many([(op.drive_file.drive_file_id, op.name, op.parent_id, op.level) for op in done],
+							confirmed_mutations=[op.mutation_id for op in done])
+		return len(operations) - len(done)
+
+	def _delete(self, executor: ThreadPoolExecutor, services: ServicePool, plan: BuildPlan) -> int:
 		"""
-		task_service = DriveAPIClient.create_drive_service(self.credentials)
-		# task_service = build('drive', 'v3', credentials=self.credentials)
+		Deletes obsolete items from Drive and their rows from drive_files, together with the rows below them.
+		Items below a deleted folder are not sent to Drive. Rows stay if their item could not be deleted.
 
-		existing_category_type_folder = DriveFile.get_drive_files_by_level(1, category_type)
-		category_type_folder_id = existing_category_type_folder[
-			0].drive_file_id if existing_category_type_folder else None
-
-		# Create category type folder if it doesn't exist
-		if not category_type_folder_id:
-			category_type_folder = self.api_client.create_drive_folder(task_service, category_type.name,
-																	   self.root_folder_id)
-			if not category_type_folder:
-				logger.error(f"Failed to create folder for category '{category_type.name}'")
-				return
-			DriveFile.add_drive_file(category_type_folder, 1, category_type)
-			logger.debug(f"Created category type folder '{category_type.name}' with ID {category_type_folder.drive_file_id}")
-			category_type_folder_id = category_type_folder.drive_file_id
-
-		categories = Category.get_by_type(category_type)
-		if not categories:
-			logger.error(f"No categories found for type '{category_type.name}'")
-			return
-
-		for ca in categories:
-			query_options = FileQueryOptions(exclude_shortcuts=True,
-											 folder_only=category_type.aggregation_type == "shortcut")
-			files = File.get_from_category(ca, query_options)
-			self.add_shortcuts_normal(task_service, files, category_type, ca, category_type_folder_id)
+		:return: Number of failed deletions.
+		"""
+		deletions = plan.drive_deletions()
+		self._journal(deletions)
+		removed = self._map_batches(executor, services, self.api_client.remove_drive_files,
+									[op.drive_file.drive_file_id for op in deletions], write_priority(DELETE, 0))
+		deleted_ids = {op.drive_file.drive_file_id for op, ok in zip(deletions, removed) if ok}
+		if self._tree_listing is not None:
+			for drive_file_id in deleted_ids:
+				self._tree_listing.files.pop(drive_file_id, None)
+
+		# Items moved out of a deleted folder beforehand are no longer below it
+		DriveFile.delete_many(DriveFileIndex.load().subtree(deleted_ids),
+							  confirmed_mutations=[op.mutation_id for op, ok in zip(deletions, removed) if ok])
+		return len(deletions) - len(deleted_ids)
+
+	def resume_journal(self) -> int:
+		"""
+		Settles the drive_mutations journal entries left behind by an interrupted or failed build, with one lookup
+		per entry (sent in batch requests): created items which exist are recorded in drive_files instead of being
+		created again, renamed and moved items get their current name and parent and rows of deleted items
+		are removed. Entries whose lookup fails stay for the next run.
 
-		task_service.close()
+		:return: Number of settled entries.
+		"""
+		pending = DriveMutation.get_pending()
+		if not pending:
+			return 0
+		creations = [m for m in pending if m.action in (CREATE_FOLDER, CREATE_SHORTCUT)]
+		changes = [m for m in pending if m.action not in (CREATE_FOLDER, CREATE_SHORTCUT)]
+		task_service = DriveAPIClient.create_drive_service(self.credentials)
+		try:
+			found = self.api_client.find_children(
+				task_service, [(m.parent_id, m.name if m.action == CREATE_FOLDER else None, m.target_id) for m in creations])
+			fetched = self.api_client.fetch_files(task_service, [m.drive_file_id for m in changes])
+		finally:
+			task_service.close()
 
-	def add_shortcuts_normal(self, task_service, files: list[File], category_type: CategoryType, category: Category,
-							 category_type_folder_id: str):
-
-		# If aggregation type is "shortcut" and there's only one file, create a shortcut directly in the category type folder
-		if category_type.aggregation_type == "shortcut" and files.__len__() == 1:  # one file check can be redundant
-
-			existing_shortcuts = DriveFile.get_drive_files_by_level(2, category_type)
-			if files[0].drive_file_id in [f.shortcut_target_id for f in existing_shortcuts]:
-				return
-
-			shortcut = self.api_client.create_drive_shortcut(task_service, category.canonical_name,
-															 files[0].drive_file_id,
-															 category_type_folder_id)
-			if not shortcut:
-				logger.error(f"Failed to create shortcut for category '{category.canonical_name}'")
-				return
-			logger.debug(f"Creating shortcut '{category.canonical_name}' with ID {category_type_folder_id}'")
-			DriveFile.add_drive_file(shortcut, 2, category_type)
-			return
-
-		existing_category_folders = DriveFile.get_drive_files_by_level(2, category_type)
-		category_folder_id = next(
-			(f.drive_file_id for f in existing_category_folders if f.name == category.canonical_name), None)
-		# Create category folder if it doesn't exist
-		if not category_folder_id:
-			category_folder = self.api_client.create_drive_folder(task_service, category.canonical_name,
-																  category_type_folder_id)
-			if not category_folder:
-				logger.error(
-					f"Failed to create folder {category.canonical_name} in targeted ID - {category_folder.drive_file_id}")
-				return
-			logger.debug(f"Created category folder '{category.canonical_name}' with ID {category_folder.drive_file_id}")
-			DriveFile.add_drive_file(category_folder, 2, category_type)
-			category_folder_id = category_folder.drive_file_id
-
-		existing_shortcuts = DriveFile.get_drive_files_by_level(3, category_type, category_folder_id)
-		for file in files:
-			if file.drive_file_id in [f.shortcut_target_id for f in existing_shortcuts]:
+		known_files = DriveFileIndex.load()
+		adopted, settled = [], []
+		for mutation, files in zip(creations, found):
+			if files is None:
 				continue
+			settled.append(mutation.id)
+			file = next((file for file in files if file.drive_file_id not in known_files), None)
+			if file:
+				logger.debug(f"Adopting {file.name} with ID {file.drive_file_id} created by an interrupted build.")
+				category_type = CategoryType.find_by_id(mutation.category_type_id) if mutation.category_type_id else None
+				adopted.append((file, mutation.level, category_type, mutation.category_id))
+		DriveFile.add_drive_files(adopted, confirmed_mutations=settled)
+
+		# Entries whose item could not be fetched stay, {} means the item does not exist
+		resolved = [(m, file) for m, file in zip(changes, fetched) if file is not None]
+		moves = []
+		for m, file in resolved:
+			if m.action in (RENAME, MOVE) and file:
+				# Moves into or out of a sub-folder change the level, which only holds if the move went through
+				known = known_files.get(m.drive_file_id)
+				level = m.level if m.action == MOVE and file.parent_id == m.parent_id or not known else known.level
+				moves.append((m.drive_file_id, file.name, file.parent_id, level))
+		DriveFile.move_many(moves, confirmed_mutations=[m.id for m, file in resolved
+														if m.action in (RENAME, MOVE) and file])
+		# Rows of items which are gone are removed, deleted folders take the rows below them along
+		gone = {m.drive_file_id for m, file in resolved if not file}
+		DriveFile.delete_many(known_files.subtree(gone),
+							  confirmed_mutations=[m.id for m, file in resolved if m.action == DELETE or not file])
+
+		settled_count = len(settled) + len(resolved)
+		logger.info(f"Settled {settled_count} of {len(pending)} journal entries of an interrupted build, "
+					f"adopted {len(adopted)} created items.")
+		return settled_count
+
+	def list_managed_tree(self, refresh: bool = False) -> 'TreeListing | None':
+		"""
+		Lists the whole output tree under the root folder, following every page. Folders of a level are listed
+		together, PARENTS_PER_QUERY folders per query, in parallel. Only folders recorded in drive_files are
+		descended into - the content of unknown folders goes away with them.
 
-			# Create shortcut if it doesn't exist
-			shortcut_name = file.name + " (" + file.get_created_date() + ")" if file.mime_type == "application/vnd.google-apps.folder" else file.name
-			shortcut = self.api_client.create_drive_shortcut(task_service, shortcut_name,
-															 file.drive_file_id if file.shortcut_target_id is None else file.shortcut_target_id,
-															 category_folder_id)
-			if not shortcut:
-				logger.error(f"Failed to create shortcut for file {file.name} in category '{category.canonical_name}'")
-				continue
-			logger.debug(f"Creating shortcut '{shortcut_name}' in category '{category.canonical_name}' with ID {shortcut.drive_file_id}'")
-			DriveFile.add_drive_file(shortcut, 3, category_type)
+		The listing is cached until refresh is requested. Applying a build plan keeps it up to date.
 
-	def remove_old_files(self) -> bool:
+		:return: The listing, None if the root folder could not be listed.
 		"""
-		Removes old files and folders from Google Drive that are not present in drive_file table.
-		Deletes data in the following order: category_type_folder -> category_folder -> shortcuts.
+		if self._tree_listing is not None and not refresh:
+			return self._tree_listing
+		known_files = DriveFileIndex.load()
+		listing = TreeListing()
+		folder_ids = [self.root_folder_id]
+		services = ServicePool(self.credentials)
+		try:
+			with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+				while folder_ids:
+					groups = [folder_ids[start:start + PARENTS_PER_QUERY]
+							  for start in range(0, len(folder_ids), PARENTS_PER_QUERY)]
+					futures = [executor.submit(lambda group: self.api_client.list_folders_children(services.get(), group),
+											   group) for group in groups]
+					folder_ids = []
+					for group, future in zip(groups, futures):
+						children = future.result()
+						if children is None:
+							logger.error(f"Could not list {len(group)} folders of the output tree, their content is not reconciled.")
+							continue
+						listing.listed_folders.update(group)
+						for child in children:
+							listing.files[child.drive_file_id] = child
+							if (child.mime_type == FOLDER_MIME_TYPE and child.drive_file_id in known_files
+									and child.drive_file_id not in listing.listed_folders):
+								folder_ids.append(child.drive_file_id)
+		finally:
+			services.close()
+
+		if self.root_folder_id not in listing.listed_folders:
+			return None
+		logger.debug(f"Listed {len(listing.files)} items in {len(listing.listed_folders)} folders of the output tree.")
+		self._tree_listing = listing
+		return listing
+
+	def drop_missing_rows(self) -> int:
 		"""
-		task_service = DriveAPIClient.create_drive_service(self.credentials)
-		# task_service = build('drive', 'v3', credentials=self.credentials)
+		Removes drive_files rows of items which are gone from Drive (e.g. deleted by hand), together with the rows
+		below them, so the next build plan creates them again. Only rows in completely listed folders are checked.
 
-		all_files = DriveFile.get_all_drive_files()
-		drive_category_type_folders = self.get_folder_files(self.root_folder_id, folder_only=True)
-		if not drive_category_type_folders:
-			logger.error("No category type folders found in root folder.")
-			task_service.close()
+		:return: Number of removed rows.
+		"""
+		listing = self.list_managed_tree()
+		if listing is None:
+			return 0
+		known_files = DriveFileIndex.load()
+		missing = known_files.subtree({f.drive_file_id for f in known_files if f.level > 0
+									   and f.parent_id in listing.listed_folders and f.drive_file_id not in listing.files})
+		DriveFile.delete_many(missing)
+		if missing:
+			logger.info(f"Removed {len(missing)} entries of items missing from Drive, they will be created again.")
+		return len(missing)
+
+	def remove_old_files(self) -> bool:
+		"""
+		Removes items under the root folder which are not in the drive_files table - directly in the root folder
+		only folders, like the category type folders. The managed tree is listed once
+		(see list_managed_tree), the listing is compared against drive_files and obsolete items are deleted
+		in parallel batch requests.
+		"""
+		listing = self.list_managed_tree()
+		if listing is None:
+			logger.error("Could not list the root folder, obsolete items are not removed.")
 			return False
 
-		deleted_category_types = 0
-		deleted_categories = 0
-		deleted_shortcuts = 0
-
-		for drive_category_type_folder in drive_category_type_folders:
-			# Cleaning category type folders that are not in db
-			if drive_category_type_folder.drive_file_id not in [f.drive_file_id for f in all_files]:
-				logger.debug(
-					f"Removing category_type folder {drive_category_type_folder.name} with ID {drive_category_type_folder.drive_file_id} from drive.")
-				try:
-					self.api_client.remove_drive_file(task_service, drive_category_type_folder.drive_file_id)
-					deleted_category_types += 1
-				except Exception as e:
-					logger.error(f"Failed to remove folder {drive_category_type_folder.name}: {e}")
+		known_files = DriveFileIndex.load()
+		# Items in folders deleted in the meantime went away with them. The root folder may be a folder of the
+		# user's, only unknown folders are removed from it - files kept there are never touched.
+		obsolete = [file for drive_file_id, file in listing.files.items()
+					if drive_file_id not in known_files and file.parent_id in known_files
+					and (file.parent_id != self.root_folder_id or file.mime_type == FOLDER_MIME_TYPE)]
+		for file in obsolete:
+			logger.debug(f"Removing obsolete item {file.name} with ID {file.drive_file_id} from drive.")
+
+		services = ServicePool(self.credentials)
+		try:
+			with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+				removed = self._map_batches(executor, services, self.api_client.remove_drive_files,
+											[file.drive_file_id for file in obsolete], write_priority(DELETE, 0))
+		finally:
+			services.close()
+
+		deleted = {'folders': 0, 'shortcuts': 0, 'other items': 0}
+		for file, is_removed in zip(obsolete, removed):
+			if not is_removed:
+				logger.error(f"Failed to remove obsolete item {file.name} with ID {file.drive_file_id} from drive.")
 				continue
+			del listing.files[file.drive_file_id]
+			if file.mime_type == FOLDER_MIME_TYPE:
+				deleted['folders'] += 1
+			elif file.mime_type == SHORTCUT_MIME_TYPE:
+				deleted['shortcuts'] += 1
+			else:
+				deleted['other items'] += 1
 
-			# Cleaning category folders that are not in db
-			drive_category_folders = self.get_folder_files(drive_category_type_folder.drive_file_id)
-			for drive_category_folder in drive_category_folders:
-				if drive_category_folder.drive_file_id not in [f.drive_file_id for f in all_files]:
-					logger.debug(
-						f"Removing category folder {drive_category_folder.name} with ID {drive_category_folder.drive_file_id} from drive.")
-					try:
-						self.api_client.remove_drive_file(task_service, drive_category_folder.drive_file_id)
-						deleted_categories += 1
-					except Exception as e:
-						logger.error(f"Failed to remove folder {drive_category_folder.name}: {e}")
-					continue
-
-				if drive_category_folder.mime_type != "application/vnd.google-apps.folder":
-					continue
-
-				# Cleaning shortcuts that are not in db
-				drive_shortcuts = self.get_folder_files(drive_category_folder.drive_file_id)
-				for shortcut in drive_shortcuts:
-					if shortcut.drive_file_id not in [f.drive_file_id for f in all_files]:
-						logger.debug(f"Removing shortcut {shortcut.name} with ID {shortcut.drive_file_id} from drive.")
-						try:
-							self.api_client.remove_drive_file(task_service, shortcut.drive_file_id)
-							deleted_shortcuts += 1
-						except Exception as e:
-							logger.error(f"Failed to remove shortcut {shortcut.name}: {e}")
-
-
-		task_service.close()
 		logger.info("Deleted obsolete entries from Drive: "
-					f"{deleted_category_types} category type folders, "
-					f"{deleted_categories} category folders, "
-					f"{deleted_shortcuts} shortcuts.")
+					f"{deleted['folders']} folders, {deleted['shortcuts']} shortcuts, {deleted['other items']} other items.")
 		return True
+
+
+class TreeListing:
+	"""Items of the output tree as listed from Drive, see DriveBuilder.list_managed_tree."""
+	__slots__ = ('files', 'listed_folders')
+
+	def __init__(self):
+		# Listed items by Drive ID
+		self.files: dict[str, File] = {}
+		# Folders whose items were all listed
+		self.listed_folders: set[str] = set()
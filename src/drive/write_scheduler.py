@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import threading
+import time
+
+from main import logger
+
+# Lowest rate rate limit errors slow the scheduler down to, in writes per second
+MIN_WRITE_RATE = 0.5
+# Part of the configured rate regained by every batch of writes sent without rate limit errors
+RATE_RECOVERY = 0.05
+
+
+class WriteScheduler:
+	"""
+	Paces Drive write calls (creations, moves, renames and deletions), whose per-user quota is much tighter
+	than the one of reads: a token bucket of `rate` writes per second with bursts of up to `burst` writes.
+
+	Waiting callers are served by priority (lower first), so writes other work depends on, like category type
+	folders, are not stuck behind bulk shortcut creation. Rate limit errors halve the rate, which grows back
+	towards the configured one while writes succeed - the scheduler settles at the highest rate Drive sustains
+	instead of running into the limit over and over.
+
+	Writes announced up front (see announce) count as queued, so queue_depth and eta cover a whole build.
+	"""
+
+	def __init__(self, rate: float, burst: int = None):
+		# Configured rate, 0 or less for no pacing
+		self.max_rate = rate
+		# Current rate, lowered by rate limit errors
+		self.rate = rate
+		self.burst = burst if burst else max(1, int(rate))
+		self._tokens = float(self.burst)
+		self._updated = time.monotonic()
+		self._condition = threading.Condition()
+		# Waiting callers, as (priority, arrival, calls)
+		self._waiting: list[tuple[int, int, int]] = []
+		self._arrivals = itertools.count()
+		# Announced writes which have not been sent yet
+		self._announced = 0
+		self.sent = 0
+		self.rate_limited = 0
+
+	def announce(self, calls: int) -> None:
+		"""Adds writes about to be scheduled to the queue depth."""
+		with self._condition:
+			self._announced += calls
+
+	def clear_announced(self) -> None:
+		"""Forgets announced writes which were never sent, e.g. skipped operations."""
+		with self._condition:
+			self._announced = 0
+
+	@property
+	def queue_depth(self) -> int:
+		"""Writes announced or waiting, but not sent yet."""
+		with self._condition:
+			return max(self._announced, sum(calls for _, _, calls in self._waiting))
+
+	def eta(self) -> float:
+		"""Seconds until the queued writes are sent at the current rate."""
+		return self.queue_depth / self.rate if self.rate > 0 else 0.0
+
+	def status(self) -> str:
+		return f"{self.queue_depth} writes queued, {self.rate:.1f} writes/s, ETA {self.eta() / 60:.1f} min"
+
+	def _refill(self) -> None:
+		now = time.monotonic()
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def acquire(self, calls: int = 1, priority: int = 0) -> float:
+		"""
+		Blocks until `calls` writes may be sent, after all waiting callers of a lower priority value.
+		Batches larger than the burst go once the bucket is full and leave it in debt.
+
+		:return: Seconds spent waiting.
+		"""
+		start = time.monotonic()
+		with self._condition:
+			if self.max_rate > 0:
+				entry = (priority, next(self._arrivals), calls)
+				heapq.heappush(self._waiting, entry)
+				while True:
+					timeout = None
+					if self._waiting[0] is entry:
+						self._refill()
+						needed = min(calls, self.burst)
+						if self._tokens >= needed:
+							break
+						timeout = (needed - self._tokens) / self.rate
+					self._condition.wait(timeout)
+				heapq.heappop(self._waiting)
+				self._tokens -= calls
+				self._condition.notify_all()
+			self._announced = max(0, self._announced - calls)
+			self.sent += calls
+		return time.monotonic() - start
+
+	def report(self, calls: int, rate_limited: int) -> None:
+		"""Adapts the rate to the outcome of sent writes: halved on rate limit errors, regained slowly otherwise."""
+		if self.max_rate <= 0:
+			return
+		with self._condition:
+			if rate_limited:
+				self.rate_limited += rate_limited
+				self.rate = max(min(MIN_WRITE_RATE, self.max_rate), self.rate / 2)
+				self._tokens = min(self._tokens, 0.0)
+				logger.warning(f"Drive write rate limit hit {rate_limited} times, slowing down to {self.rate:.1f} writes/s.")
+			elif calls and self.rate < self.max_rate:
+				self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
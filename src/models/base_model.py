@@ -1,8 +1,19 @@
+from operator import itemgetter
+
 from src.db.database import get_db_connection
+from src.db.key_sets import key_set_statements
+from src.db.query_cache import query_cache
+
+
+# Rows fetched at once by the iter_* methods
+ITER_CHUNK_SIZE = 1000
 
 
 class BaseModel:
+	__slots__ = ()
 	_table_name = None
+	# Attributes of slotted models, in the order of their __init__ arguments
+	_fields: tuple[str, ...] = ()
 
 	def __init__(self, **kwargs):
 		# Dynamically set attributes from kwargs
@@ -11,6 +22,8 @@ class BaseModel:
 
 	def to_dict(self):
 		"""Converts the model instance to a dictionary."""
+		if self._fields:
+			return {field: getattr(self, field) for field in self._fields}
 		# Get all public instance attributes
 		# You might need to refine this to exclude certain internal attributes
 		return {
@@ -19,9 +32,48 @@ class BaseModel:
 		}
 
 	@classmethod
-	def _execute_query(cls, query, params=(), fetch_one=False, commit=True):
-		"""Helper method to execute database queries."""
+	def from_row(cls, row):
+		"""Creates a model instance from a database row. Columns which are not attributes of the model are ignored."""
+		return cls.from_rows([row])[0]
+
+	@classmethod
+	def from_rows(cls, rows) -> list:
+		"""
+		Creates model instances from database rows of one query.
+		Columns are matched to attributes once per result, not once per row.
+		Columns which are not attributes of the model are ignored.
+		"""
+		if not rows:
+			return []
+		if not cls._fields:
+			return [cls(**dict(row)) for row in rows]
+
+		columns = tuple(rows[0].keys())
+		if columns == cls._fields:
+			return [cls(*row) for row in rows]
+		indexes = [columns.index(field) if field in columns else None for field in cls._fields]
+		if None not in indexes and len(indexes) > 1:
+			# Extra columns only (e.g. SELECT * with database-only columns) - pick the fields in C
+			pick = itemgetter(*indexes)
+			return [cls(*pick(row)) for row in rows]
+		return [cls(*[row[i] if i is not None else None for i in indexes]) for row in rows]
+
+	@classmethod
+	def _execute_query(cls, query, params=(), fetch_one=False, commit=True, raw=False):
+		"""
+		Helper method to execute database queries.
+		Inside query_cache.unit_of_work() results of SELECT queries are served from the cache.
+
+		:param raw: Return plain tuples instead of sqlite3.Row objects (cheaper for large results).
+		"""
+		cache_key, hit, result = query_cache.lookup(query, params, (fetch_one, raw))
+		if hit:
+			# Copy, so callers modifying the returned list cannot change the cached one
+			return list(result) if isinstance(result, list) else result
+
 		conn = get_db_connection()
+		if raw:
+			conn.row_factory = None
 		c = conn.cursor()
 		c.execute("PRAGMA foreign_keys=ON;")
 		try:
@@ -29,12 +81,83 @@ class BaseModel:
 			if commit:
 				conn.commit()
 			if fetch_one:
-				return c.fetchone()
+				result = c.fetchone()
 			else:
-				return c.fetchall()
+				result = c.fetchall()
+			query_cache.put(cache_key, query, result)
+			return result
 		finally:
 			conn.close()
 
+	@classmethod
+	def _execute_key_query(cls, query, keys, params=(), chunkable=True):
+		"""
+		Executes a SELECT query for a set of keys of any size, see src.db.key_sets.key_set_statements.
+		Inside query_cache.unit_of_work() results are served from the cache.
+
+		:param query: Query with key_sets.KEYS in place of the key list, e.g. "... WHERE name IN ({KEYS})".
+		:param keys: Keys bound in place of KEYS.
+		:param params: Parameters following the key list.
+		:param chunkable: Whether the query may be run per chunk of keys.
+		"""
+		keys = tuple(keys)
+		cache_key, hit, result = query_cache.lookup(query, (keys, *params), 'keys')
+		if hit:
+			return list(result)
+
+		conn = get_db_connection()
+		try:
+			result = []
+			for statement, statement_params in key_set_statements(conn, query, keys, params, chunkable):
+				result.extend(conn.execute(statement, statement_params).fetchall())
+			query_cache.put(cache_key, query, result)
+			return result
+		finally:
+			conn.close()
+
+	@classmethod
+	def _iter_query(cls, query, params=(), chunk_size: int = ITER_CHUNK_SIZE, raw: bool = False, keys=None,
+					chunkable: bool = True):
+		"""
+		Executes a query and yields its rows in chunks fetched with fetchmany, keeping memory use constant.
+		The connection stays open until the generator is exhausted or closed, so avoid writing to the database
+		from another connection while iterating. Results are never cached.
+
+		:param chunk_size: Number of rows fetched at once.
+		:param raw: Yield plain tuples instead of sqlite3.Row objects.
+		:param keys: Keys bound in place of key_sets.KEYS in the query, see _execute_key_query.
+		:param chunkable: Whether the query may be run per chunk of keys.
+		"""
+		conn = get_db_connection()
+		if raw:
+			conn.row_factory = None
+		try:
+			statements = [(query, params)] if keys is None else key_set_statements(conn, query, keys, params, chunkable)
+			for statement, statement_params in statements:
+				c = conn.execute(statement, statement_params)
+				while rows := c.fetchmany(chunk_size):
+					yield rows
+		finally:
+			conn.close()
+
+	@classmethod
+	def _iter_models(cls, query, params=(), chunk_size: int = ITER_CHUNK_SIZE, keys=None, chunkable: bool = True):
+		"""Executes a query and lazily yields model instances, see _iter_query."""
+		for rows in cls._iter_query(query, params, chunk_size, keys=keys, chunkable=chunkable):
+			yield from cls.from_rows(rows)
+
+	@classmethod
+	def count(cls) -> int:
+		"""Returns the number of records in the table."""
+		row = cls._execute_query(f"SELECT COUNT(*) FROM {cls._table_name}", fetch_one=True)
+		return row[0]
+
+	@classmethod
+	def exists(cls) -> bool:
+		"""Checks whether the table has at least one record, without reading the table."""
+		row = cls._execute_query(f"SELECT EXISTS (SELECT 1 FROM {cls._table_name})", fetch_one=True)
+		return bool(row[0])
+
 	@classmethod
 	def find_by_id(cls, obj_id):
 		"""Fetches an object by its ID."""
@@ -42,7 +165,7 @@ class BaseModel:
 			raise NotImplementedError("Table name not defined for this model.")
 		query = f"SELECT * FROM {cls._table_name} WHERE id = ?"
 		row = cls._execute_query(query, (obj_id,), fetch_one=True)
-		return cls(**dict(row)) if row else None
+		return cls.from_row(row) if row else None
 
 	@classmethod
 	def all(cls):
@@ -51,4 +174,4 @@ class BaseModel:
 			raise NotImplementedError("Table name not defined for this model.")
 		query = f"SELECT * FROM {cls._table_name}"
 		rows = cls._execute_query(query)
-		return [cls(**dict(row)) for row in rows]
+		return cls.from_rows(rows)
@@ -35,6 +35,66 @@ class Category(BaseModel):
 		finally:
 			conn.close()
 
+	@classmethod
+	def replace_for_type(cls, category_type: CategoryType, definitions: dict[str, list[str]]) -> bool:
+		"""
+		Stores the category type with its options (see CategoryType.save) and replaces all its categories
+		and their aliases in one transaction, using batched inserts.
+		Categories are matched by canonical name and keep their IDs, so their Drive folders are updated in place.
+		A new canonical name takes over the ID of a removed category sharing most of its aliases (a rename).
+		Other removed categories are deleted, their file links go by ON DELETE CASCADE. File links of the kept
+		categories are removed too, as they have to be relinked with the new aliases.
+
+		:param category_type: Category type, created if it does not exist yet.
+		:param definitions: Aliases by canonical name of the category.
+		:return: True on success, False if nothing was changed.
+		"""
+		conn = get_db_connection()
+		try:
+			conn.execute("PRAGMA foreign_keys=ON;")
+			with conn:
+				category_type.save(conn)
+				category_type_id = category_type.id
+				category_ids = dict(conn.execute(
+					f"SELECT canonical_name, id FROM {cls._table_name} WHERE category_type_id = ?;", (category_type_id,)))
+				old_aliases = {}
+				for category_id, alias_name in conn.execute(f"""
+                    SELECT ca.category_id, ca.alias_name FROM category_aliases ca
+                    JOIN {cls._table_name} c ON c.id = ca.category_id
+                    WHERE c.category_type_id = ?;""", (category_type_id,)):
+					old_aliases.setdefault(category_id, set()).add(alias_name)
+
+				removed = {category_ids.pop(name) for name in list(category_ids) if name not in definitions}
+				added = [name for name in definitions if name not in category_ids]
+				# Renames: pairs sharing most aliases first
+				candidates = sorted(((len(old_aliases.get(old_id, set()) & set(definitions[name])), name, old_id)
+									 for name in added for old_id in removed), key=lambda c: (-c[0], c[1], c[2]))
+				renames = []
+				for overlap, name, old_id in candidates:
+					if overlap and name not in category_ids and old_id in removed:
+						category_ids[name] = old_id
+						removed.discard(old_id)
+						renames.append((name, old_id))
+				conn.executemany(f"UPDATE {cls._table_name} SET canonical_name = ? WHERE id = ?;", renames)
+				conn.executemany(f"DELETE FROM {cls._table_name} WHERE id = ?;", [(old_id,) for old_id in removed])
+
+				kept = f"SELECT id FROM {cls._table_name} WHERE category_type_id = ?"
+				conn.execute(f"DELETE FROM category_aliases WHERE category_id IN ({kept});", (category_type_id,))
+				conn.execute(f"DELETE FROM file_categories WHERE category_id IN ({kept});", (category_type_id,))
+				conn.executemany(f"INSERT INTO {cls._table_name} (category_type_id, canonical_name) VALUES (?, ?);",
+								 [(category_type_id, name) for name in definitions if name not in category_ids])
+				category_ids = dict(conn.execute(
+					f"SELECT canonical_name, id FROM {cls._table_name} WHERE category_type_id = ?;", (category_type_id,)))
+				conn.executemany("INSERT INTO category_aliases (category_id, alias_name) VALUES (?, ?);",
+								 [(category_ids[canonical_name], alias_name)
+								  for canonical_name, aliases in definitions.items() for alias_name in aliases])
+			return True
+		except sqlite3.Error as e:
+			logger.error(f"Error while replacing categories of category type '{category_type.name}': {e}")
+			return False
+		finally:
+			conn.close()
+
 	@classmethod
 	def get_by_type(cls, category_type: CategoryType):
 		"""
@@ -91,6 +151,26 @@ class Category(BaseModel):
 		link = self._execute_query(query, (file_id, self.id))
 		return link is not None
 
+	@classmethod
+	def link_files(cls, links: list[tuple[int, int]], temp: bool = False) -> bool:
+		"""
+		Links many files to categories in one transaction.
+
+		:param links: (file_id, category_id) pairs.
+		:param temp: Whether to link files of the staging tables.
+		"""
+		table_name = "file_categories_temp" if temp else "file_categories"
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"INSERT OR IGNORE INTO {table_name} (file_id, category_id) VALUES (?, ?)", links)
+			return True
+		except sqlite3.Error as e:
+			logger.error(f"Error while linking files to categories: {e}")
+			return False
+		finally:
+			conn.close()
+
 	def delete(self):
 		"""
 		Deletes all categories associated with this category type.
@@ -105,21 +185,3 @@ class Category(BaseModel):
 
 		rows_deleted = self._execute_query(query, (self.category_type_id,), commit=True)
 		return rows_deleted is not None
-
-	@classmethod
-	def replace_links(cls):
-		"""Replaces temporary file links in the database."""
-		conn = get_db_connection()
-		try:
-			with conn:
-				conn.execute("DELETE FROM file_categories;")
-
-				conn.execute("""
-                        INSERT OR IGNORE INTO file_categories (file_id, category_id)
-                        SELECT file_id, category_id FROM file_categories_temp;
-                    """)
-
-				conn.execute("DELETE FROM file_categories_temp;")
-		except Exception as e:
-			logger.error(f"Unexpected error occurred while replacing file links: {e}")
-			raise
@@ -0,0 +1,75 @@
+from src.db.database import get_db_connection
+from src.models.base_model import BaseModel
+
+# Columns of a file link the output tree depends on: shortcut names and targets, and which files are listed
+LINK_COLUMNS = ('fc.category_id', 'f.drive_file_id', 'f.name', 'f.mime_type', 'f.owner', 'f.created_time',
+				'f.shortcut_target_id', 'f.active')
+
+
+class CategoryChange(BaseModel):
+	"""
+	Category whose file links changed since the last successful Drive build. Recorded when a data generation
+	replaces another (see src.db.generations) and cleared once a build has applied the change, so a build
+	only needs to look at the output folders of these categories.
+	"""
+	_table_name = 'category_changes'
+	_fields = ('category_id',)
+	__slots__ = _fields
+
+	def __init__(self, category_id: int = None):
+		self.category_id = category_id
+
+	@classmethod
+	def record_link_changes(cls, conn, new_suffix: str, old_suffix: str) -> int:
+		"""
+		Records the categories gaining or losing file links, or whose linked files changed, when the generation
+		with new_suffix replaces the one with old_suffix. Runs on the given connection (and in its transaction).
+
+		:return: Number of newly recorded categories.
+		"""
+		columns = ', '.join(LINK_COLUMNS)
+
+		def links(suffix: str) -> str:
+			return f"SELECT {columns} FROM file_categories{suffix} fc JOIN files{suffix} f ON f.id = fc.file_id"
+
+		cursor = conn.execute(f"""
+            INSERT OR IGNORE INTO {cls._table_name} (category_id)
+            SELECT category_id FROM ({links(new_suffix)} EXCEPT {links(old_suffix)})
+            UNION
+            SELECT category_id FROM ({links(old_suffix)} EXCEPT {links(new_suffix)})
+        """)
+		return cursor.rowcount
+
+	@classmethod
+	def record(cls, category_ids: list[int]) -> None:
+		"""Records categories whose links were changed outside of an import, e.g. by relinking a category type."""
+		if not category_ids:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"INSERT OR IGNORE INTO {cls._table_name} (category_id) VALUES (?)",
+								 [(category_id,) for category_id in category_ids])
+		finally:
+			conn.close()
+
+	@classmethod
+	def get_category_ids(cls) -> set[int]:
+		rows = cls._execute_query(f"SELECT category_id FROM {cls._table_name}")
+		return {row[0] for row in rows} if rows else set()
+
+	@classmethod
+	def clear(cls, category_ids: set[int]) -> None:
+		"""Forgets changes applied by a build. Changes recorded while it ran stay."""
+		if not category_ids:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"DELETE FROM {cls._table_name} WHERE category_id = ?",
+								 [(category_id,) for category_id in category_ids])
+		finally:
+			conn.close()
+
+	def __repr__(self):
+		return f"CategoryChange(category_id={self.category_id})"
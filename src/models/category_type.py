@@ -1,17 +1,81 @@
+import re
+
 from main import logger
 from src.db.database import get_db_connection
 from src.db.query_options import FileQueryOptions
 from src.models.base_model import BaseModel
 
 
+AGGREGATION_TYPES = ('shortcut', 'collection', 'pattern')
+
+# How aliases of 'shortcut' and 'collection' types are compared with file names:
+# 'exact' - the raw names must be equal, 'normalized' - names are compared casefolded, trimmed,
+# with collapsed whitespace and (with NAME_FOLD_DIACRITICS) without diacritics, see normalize_file_name
+ALIAS_MATCH_MODES = ('exact', 'normalized')
+
+# Keys splitting the files of a category into sub-folders once it holds more than shard_size files:
+# 'letter' - first letter of the name, 'year' - year the file was created, 'owner' - owner of the file,
+# 'hash' - a bucket of the file ID, see src.drive.build_plan.shard_files
+SHARD_KEYS = ('letter', 'year', 'owner', 'hash')
+DEFAULT_SHARD_SIZE = 1000
+
+# File names sent to a pattern matching worker at once
+PATTERN_CHUNK_SIZE = 5000
+
+
 class CategoryType(BaseModel):
 	_table_name = 'category_types'
 
-	def __init__(self, id=None, name=None, aggregation_type=None):
+	def __init__(self, id=None, name=None, aggregation_type=None, max_depth=1, alias_match='exact', shard_by=None,
+				 shard_size=DEFAULT_SHARD_SIZE):
 		super().__init__(id=id, name=name)
 		self.id = id
 		self.name = name
 		self.aggregation_type = aggregation_type
+		self.max_depth = max_depth
+		self.alias_match = alias_match if alias_match else 'exact'
+		# One of SHARD_KEYS, None to keep all files of a category in its folder
+		self.shard_by = shard_by
+		self.shard_size = shard_size if shard_size else DEFAULT_SHARD_SIZE
+
+	def get_depth_limit(self) -> int | None:
+		"""Returns the depth limit of 'collection' aggregation, None meaning no limit (max_depth = -1)."""
+		if self.max_depth is None:
+			return 1
+		return self.max_depth if self.max_depth > 0 else None
+
+	def set_max_depth(self, max_depth: int):
+		"""Updates how deep 'collection' aggregation collects files (1 = direct children, -1 = no limit)."""
+		query = f"UPDATE {self._table_name} SET max_depth = ? WHERE id = ?"
+		self._execute_query(query, (max_depth, self.id))
+		self.max_depth = max_depth
+
+	def set_alias_match(self, alias_match: str):
+		"""Updates how aliases are compared with file names, one of ALIAS_MATCH_MODES."""
+		query = f"UPDATE {self._table_name} SET alias_match = ? WHERE id = ?"
+		self._execute_query(query, (alias_match, self.id))
+		self.alias_match = alias_match
+
+	def set_sharding(self, shard_by: str | None, shard_size: int):
+		"""Updates how categories with more than shard_size files are split into sub-folders, see SHARD_KEYS."""
+		query = f"UPDATE {self._table_name} SET shard_by = ?, shard_size = ? WHERE id = ?"
+		self._execute_query(query, (shard_by, shard_size, self.id))
+		self.shard_by = shard_by
+		self.shard_size = shard_size
+
+	def save(self, conn) -> None:
+		"""
+		Creates the category type or updates the options of the existing one with its name, on the given
+		connection (and in its transaction). An existing type keeps its aggregation type. Sets id and aggregation_type.
+		"""
+		conn.execute(f"""
+            INSERT INTO {self._table_name} (name, aggregation_type, max_depth, alias_match, shard_by, shard_size)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET max_depth = excluded.max_depth, alias_match = excluded.alias_match,
+                shard_by = excluded.shard_by, shard_size = excluded.shard_size
+        """, (self.name, self.aggregation_type, self.max_depth, self.alias_match, self.shard_by, self.shard_size))
+		self.id, self.aggregation_type = conn.execute(
+			f"SELECT id, aggregation_type FROM {self._table_name} WHERE name = ?", (self.name,)).fetchone()
 
 	@classmethod
 	def get_all(cls):
@@ -55,7 +119,8 @@ class CategoryType(BaseModel):
 			return False
 
 	@classmethod
-	def find_or_create(cls, name, aggregation_type=None, ):
+	def find_or_create(cls, name, aggregation_type=None, max_depth=1, alias_match='exact', shard_by=None,
+					   shard_size=DEFAULT_SHARD_SIZE):
 		"""Fetches a category type by name or creates a new one."""
 		conn = get_db_connection()
 		c = conn.cursor()
@@ -66,15 +131,17 @@ class CategoryType(BaseModel):
 				return cls(**dict(row))
 			elif aggregation_type is not None:
 				aggregation_type = aggregation_type.lower()
-				if aggregation_type not in ['shortcut', 'collection', 'pattern']:
+				if aggregation_type not in AGGREGATION_TYPES:
 					logger.error(
-						f"Unknown aggregation type '{aggregation_type}' provided for category type '{name}'. Valid types are 'shortcut', 'collection', 'pattern'.")
+						f"Unknown aggregation type '{aggregation_type}' provided for category type '{name}'. Valid types are {', '.join(AGGREGATION_TYPES)}.")
 
 					return None
-				c.execute(f"INSERT INTO {cls._table_name} (name, aggregation_type) VALUES (?, ?)",
-						  (name, aggregation_type))
+				c.execute(f"INSERT INTO {cls._table_name} (name, aggregation_type, max_depth, alias_match, shard_by, "
+						  f"shard_size) VALUES (?, ?, ?, ?, ?, ?)",
+						  (name, aggregation_type, max_depth, alias_match, shard_by, shard_size))
 				conn.commit()
-				return cls(id=c.lastrowid, name=name, aggregation_type=aggregation_type)
+				return cls(id=c.lastrowid, name=name, aggregation_type=aggregation_type, max_depth=max_depth,
+						   alias_match=alias_match, shard_by=shard_by, shard_size=shard_size)
 			else:
 				logger.error(
 					f"Category type '{name}' does not exist and no aggregation type provided. Cannot create.")
@@ -82,12 +149,65 @@ class CategoryType(BaseModel):
 		finally:
 			conn.close()
 
+	@classmethod
+	def link_pattern_files(cls, category_types: list['CategoryType'], temp=False) -> bool:
+		"""
+		Links files to the categories of 'pattern' category types in one pass over the file names.
+		Names are matched in worker processes (see src.pattern_matching.match_patterns) and the links
+		are written in one transaction by this process.
+		Categories with an invalid regex among their aliases are skipped.
+		"""
+		from main import config_data
+		from src.models.category import Category
+		from src.models.file import File
+		from src.models.category_alias import CategoryAlias
+		from src.pattern_matching import compile_pattern, match_patterns
+
+		patterns = {}
+		names = {}
+		for category_type in category_types:
+			for category in Category.get_by_type(category_type):
+				aliases = [alias.alias_name for alias in CategoryAlias.get_by_category(category)]
+				if not aliases:
+					logger.warning(f"Category '{category.canonical_name}' has no aliases. Skipping consolidation.")
+					continue
+				try:
+					for alias in aliases:
+						compile_pattern(alias)
+				except re.error as e:
+					logger.error(f"Invalid pattern among aliases of category '{category.canonical_name}': {e}. "
+								 f"Skipping consolidation.")
+					continue
+				patterns[category.id] = aliases
+				names[category.id] = category.canonical_name
+		if not patterns:
+			return True
+
+		options = FileQueryOptions(temp=temp)
+		links = []
+		for chunk_links in match_patterns(patterns, File.iter_names(options, PATTERN_CHUNK_SIZE), File.count(options),
+										  config_data.categorize_workers):
+			links.extend(chunk_links)
+
+		linked_categories = {category_id for _, category_id in links}
+		for category_id, canonical_name in names.items():
+			if category_id not in linked_categories:
+				logger.info(f"No files found for category '{canonical_name}' with aggregation type 'pattern'.")
+		logger.debug(f"Linked {len(links)} files to {len(linked_categories)} pattern categories.")
+		return Category.link_files(links, temp)
+
 	def link_all_files(self, temp=False):
 		from src.models.category import Category
 		from src.models.file import File
 		from src.models.category_alias import CategoryAlias
 
+		if self.aggregation_type == 'pattern':
+			self.link_pattern_files([self], temp)
+			return
+
 		categories = Category.get_by_type(self)
+		normalized = self.alias_match == 'normalized'
+		links = []
 		for category in categories:
 			category_aliases = CategoryAlias.get_by_category(category)
 			if not category_aliases:
@@ -98,19 +218,16 @@ class CategoryType(BaseModel):
 			match self.aggregation_type:
 				case 'shortcut':
 					files = File.get_files_by_names([alias.alias_name for alias in category_aliases],
-													FileQueryOptions(temp=temp))
+													FileQueryOptions(temp=temp), normalized)
 					if files.__len__() > 1:
 						info = [f"'{file.name}' (ID: {file.id})" for file in files]
 						logger.warning(
 							f"Category '{category.canonical_name}' has multiple files linked to aliases: {', '.join(info)}. Consolidating to one file.")
 						files = [files[0]]
 				case 'collection':
-					folders = File.get_files_by_names([alias.alias_name for alias in category_aliases],
-													  FileQueryOptions(folder_only=True, temp=temp))
-					files = File.get_files_from_folders(folders, FileQueryOptions(temp=temp))
-				case 'pattern':
-					files = File.get_files_by_regex([alias.alias_name for alias in category_aliases],
-													FileQueryOptions(temp=temp))
+					files = File.get_files_from_folders_by_names([alias.alias_name for alias in category_aliases],
+																 self.get_depth_limit(), FileQueryOptions(temp=temp),
+																 normalized)
 				case _:
 					logger.error(
 						f"Unknown aggregation type '{self.aggregation_type}' for category '{category.canonical_name}'. Skipping consolidation.")
@@ -121,10 +238,11 @@ class CategoryType(BaseModel):
 					f"No files found for category '{category.canonical_name}' with aggregation type '{self.aggregation_type}'.")
 				continue
 
-			for file in files:
-				category.link_file(file.id, temp)
-				logger.debug(
-					f"Linked file '{file.name}' (ID: {file.id}) to canonical category '{category.canonical_name}'.")
+			links.extend((file.id, category.id) for file in files)
+			logger.debug(f"Linking {len(files)} files to canonical category '{category.canonical_name}'.")
+
+		# One transaction for all links instead of one per file
+		Category.link_files(links, temp)
 
 	def __repr__(self):
 		return f"<CategoryType(id={self.id}, name='{self.name}')>"
@@ -1,15 +1,22 @@
+from collections import defaultdict
+from typing import Iterator
+
+from src.db.database import get_db_connection
 from src.models.base_model import BaseModel
 from src.models.category_type import CategoryType
+from src.models.drive_mutation import DriveMutation
 from src.models.file import File
 
 
 class DriveFile(BaseModel):
 	_table_name = 'drive_files'
+	_fields = ('id', 'name', 'category_type_id', 'level', 'drive_file_id', 'parent_id', 'shortcut_target_id',
+			   'category_id')
+	__slots__ = _fields
 
 	def __init__(self, id: int = None, name: int = None, category_type_id: int = None, level: int = None,
 				 drive_file_id: str = None, parent_id: str = None,
-				 shortcut_target_id: str = None):
-		super().__init__()
+				 shortcut_target_id: str = None, category_id: int = None):
 		self.id = id
 		self.name = name
 		self.category_type_id = category_type_id
@@ -17,6 +24,8 @@ class DriveFile(BaseModel):
 		self.drive_file_id = drive_file_id
 		self.parent_id = parent_id
 		self.shortcut_target_id = shortcut_target_id
+		# Category of a category folder or of a shortcut standing for a category
+		self.category_id = category_id
 
 	@classmethod
 	def add_drive_file(cls, file: File, level: int, category_type: CategoryType = None) -> None:
@@ -29,6 +38,98 @@ class DriveFile(BaseModel):
 		cls._execute_query(query, (
 		file.name, file.drive_file_id, file.parent_id, file.shortcut_target_id, category_type_id, level), commit=True)
 
+	@classmethod
+	def add_drive_files(cls, entries: list[tuple[File, int, CategoryType | None, int | None]],
+						confirmed_mutations: list[int] = ()) -> None:
+		"""
+		Adds many drive file entries, as (file, level, category type, category ID), to the database
+		in one transaction.
+
+		:param confirmed_mutations: Journal entries settled by the change, removed in the same transaction.
+		"""
+		if not entries and not confirmed_mutations:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"""
+                    INSERT INTO {cls._table_name}
+                        (name, drive_file_id, parent_id, shortcut_target_id, category_type_id, level, category_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [(file.name, file.drive_file_id, file.parent_id, file.shortcut_target_id,
+					   category_type.id if category_type else None, level, category_id)
+					  for file, level, category_type, category_id in entries])
+				DriveMutation.confirm(conn, confirmed_mutations)
+		finally:
+			conn.close()
+
+	@classmethod
+	def rename_many(cls, renames: list[tuple[str, str]], confirmed_mutations: list[int] = ()) -> None:
+		"""
+		Updates the names of many drive files, given as (drive file ID, new name), in one transaction.
+
+		:param confirmed_mutations: Journal entries settled by the change, removed in the same transaction.
+		"""
+		if not renames and not confirmed_mutations:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"UPDATE {cls._table_name} SET name = ? WHERE drive_file_id = ?",
+								 [(name, drive_file_id) for drive_file_id, name in renames])
+				DriveMutation.confirm(conn, confirmed_mutations)
+		finally:
+			conn.close()
+
+	@classmethod
+	def move_many(cls, moves: list[tuple[str, str, str, int]], confirmed_mutations: list[int] = ()) -> None:
+		"""
+		Updates names, parent folders and levels of many drive files, given as (drive file ID, name, parent ID, level),
+		in one transaction.
+
+		:param confirmed_mutations: Journal entries settled by the change, removed in the same transaction.
+		"""
+		if not moves and not confirmed_mutations:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"UPDATE {cls._table_name} SET name = ?, parent_id = ?, level = ? WHERE drive_file_id = ?",
+								 [(name, parent_id, level, drive_file_id) for drive_file_id, name, parent_id, level in moves])
+				DriveMutation.confirm(conn, confirmed_mutations)
+		finally:
+			conn.close()
+
+	@classmethod
+	def set_category_ids(cls, category_ids: list[tuple[str, int]]) -> None:
+		"""Records the categories of drive files created before categories were recorded, as (drive file ID, category ID)."""
+		if not category_ids:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"UPDATE {cls._table_name} SET category_id = ? WHERE drive_file_id = ?",
+								 [(category_id, drive_file_id) for drive_file_id, category_id in category_ids])
+		finally:
+			conn.close()
+
+	@classmethod
+	def delete_many(cls, drive_files: list['DriveFile'], confirmed_mutations: list[int] = ()) -> None:
+		"""
+		Deletes many drive files from the database in one transaction.
+
+		:param confirmed_mutations: Journal entries settled by the change, removed in the same transaction.
+		"""
+		if not drive_files and not confirmed_mutations:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				conn.executemany(f"DELETE FROM {cls._table_name} WHERE id = ?", [(f.id,) for f in drive_files])
+				DriveMutation.confirm(conn, confirmed_mutations)
+		finally:
+			conn.close()
+
 	@classmethod
 	def delete_by_category_type(cls, category_type: CategoryType) -> None:
 		"""Deletes all drive files associated with a specific category type."""
@@ -40,7 +141,7 @@ class DriveFile(BaseModel):
 		"""Fetches all drive files from the database."""
 		query = f"SELECT * FROM {cls._table_name}"
 		rows = cls._execute_query(query)
-		return [DriveFile(**dict(row)) for row in rows]
+		return cls.from_rows(rows)
 
 	@classmethod
 	def get_drive_files_by_level(cls, level: int, category_type: CategoryType = None, parent_id: str = None) -> list[
@@ -59,7 +160,7 @@ class DriveFile(BaseModel):
 				params = (level, category_type.id, parent_id)
 
 		rows = cls._execute_query(query, params)
-		return [DriveFile(**dict(row)) for row in rows]
+		return cls.from_rows(rows)
 
 	def delete(self) -> None:
 		"""Deletes this drive file from the database."""
@@ -74,3 +175,77 @@ class DriveFile(BaseModel):
 
 	def __repr__(self):
 		return f"DriveFile(id={self.id}, name='{self.name}', category_type_id={self.category_type_id})"
+
+
+class DriveFileIndex:
+	"""
+	All drive_files rows loaded once, with hash indexes for reconciling the output tree: by Drive ID,
+	by (level, category_type_id, parent_id), by name within a parent, by shortcut target and by category.
+	"""
+
+	def __init__(self, drive_files: list[DriveFile]):
+		self._files = drive_files
+		self._by_id: dict[str, DriveFile] = {}
+		self._by_parent: dict[tuple, list[DriveFile]] = defaultdict(list)
+		self._by_name: dict[tuple, DriveFile] = {}
+		self._by_target: dict[str, list[DriveFile]] = defaultdict(list)
+		self._by_category: dict[tuple, list[DriveFile]] = defaultdict(list)
+		for drive_file in drive_files:
+			self._by_id.setdefault(drive_file.drive_file_id, drive_file)
+			self._by_parent[(drive_file.level, drive_file.category_type_id, drive_file.parent_id)].append(drive_file)
+			if drive_file.shortcut_target_id is None:
+				self._by_name.setdefault(
+					(drive_file.level, drive_file.category_type_id, drive_file.parent_id, drive_file.name), drive_file)
+			else:
+				self._by_target[drive_file.shortcut_target_id].append(drive_file)
+			if drive_file.category_id is not None:
+				self._by_category[(drive_file.level, drive_file.category_id)].append(drive_file)
+
+	@classmethod
+	def load(cls) -> 'DriveFileIndex':
+		return cls(DriveFile.get_all_drive_files())
+
+	def __iter__(self) -> Iterator[DriveFile]:
+		return iter(self._files)
+
+	def __len__(self) -> int:
+		return len(self._files)
+
+	def __contains__(self, drive_file_id: str) -> bool:
+		return drive_file_id in self._by_id
+
+	def get(self, drive_file_id: str) -> DriveFile | None:
+		return self._by_id.get(drive_file_id)
+
+	def subtree(self, drive_file_ids: set[str]) -> list[DriveFile]:
+		"""Rows of the given items and of all items below them, parents first."""
+		subtree_ids = set(drive_file_ids)
+		rows = []
+		for drive_file in sorted(self._files, key=lambda f: f.level):
+			if drive_file.drive_file_id in subtree_ids or drive_file.parent_id in subtree_ids:
+				subtree_ids.add(drive_file.drive_file_id)
+				rows.append(drive_file)
+		return rows
+
+	def children(self, level: int, category_type_id: int | None, parent_id: str | None) -> list[DriveFile]:
+		"""Items of a level, category type and parent folder."""
+		return self._by_parent.get((level, category_type_id, parent_id), [])
+
+	def find_folder(self, level: int, category_type_id: int | None, parent_id: str | None,
+					name: str) -> DriveFile | None:
+		"""The first folder (or other item which is not a shortcut) with the name in the parent folder."""
+		return self._by_name.get((level, category_type_id, parent_id, name))
+
+	def find_shortcut(self, level: int, parent_id: str | None, target_id: str) -> DriveFile | None:
+		"""The first shortcut of a level to the target in the parent folder."""
+		return next((f for f in self._by_target.get(target_id, ()) if f.level == level and f.parent_id == parent_id),
+					None)
+
+	def find_by_category(self, level: int, category_id: int, shortcut: bool) -> DriveFile | None:
+		"""The first folder (or, if shortcut, the first shortcut) of a level standing for the category."""
+		return next((f for f in self._by_category.get((level, category_id), ())
+					 if (f.shortcut_target_id is not None) == shortcut), None)
+
+	def shortcuts_to(self, level: int, target_id: str) -> list[DriveFile]:
+		"""Shortcuts of a level to the target, in any folder."""
+		return [f for f in self._by_target.get(target_id, ()) if f.level == level]
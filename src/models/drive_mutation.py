@@ -0,0 +1,64 @@
+from src.db.database import get_db_connection
+from src.models.base_model import BaseModel
+
+
+class DriveMutation(BaseModel):
+	"""
+	Write-ahead journal entry of a Drive change made by a build: the change is recorded before its API call
+	and the entry is removed in the transaction recording the outcome in drive_files. Entries left behind
+	by an interrupted build are the calls with an unknown outcome, see DriveBuilder.resume_journal.
+	"""
+	_table_name = 'drive_mutations'
+	_fields = ('id', 'action', 'level', 'name', 'category_type_id', 'parent_id', 'target_id', 'drive_file_id',
+			   'category_id')
+	__slots__ = _fields
+
+	def __init__(self, id: int = None, action: str = None, level: int = None, name: str = None,
+				 category_type_id: int = None, parent_id: str = None, target_id: str = None,
+				 drive_file_id: str = None, category_id: int = None):
+		self.id = id
+		# Action of the build plan, see src.drive.build_plan
+		self.action = action
+		self.level = level
+		self.name = name
+		self.category_type_id = category_type_id
+		# Parent folder of a created item
+		self.parent_id = parent_id
+		# Target of a created shortcut
+		self.target_id = target_id
+		# Renamed or deleted item
+		self.drive_file_id = drive_file_id
+		self.category_id = category_id
+
+	@classmethod
+	def record(cls, mutations: list['DriveMutation']) -> None:
+		"""Stores new entries in one transaction and sets their IDs."""
+		if not mutations:
+			return
+		conn = get_db_connection()
+		try:
+			with conn:
+				for mutation in mutations:
+					cursor = conn.execute(f"""
+                        INSERT INTO {cls._table_name}
+                            (action, level, name, category_type_id, parent_id, target_id, drive_file_id, category_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (mutation.action, mutation.level, mutation.name, mutation.category_type_id,
+						  mutation.parent_id, mutation.target_id, mutation.drive_file_id, mutation.category_id))
+					mutation.id = cursor.lastrowid
+		finally:
+			conn.close()
+
+	@classmethod
+	def confirm(cls, conn, mutation_ids: list[int]) -> None:
+		"""Removes settled entries, on the connection (and in the transaction) recording their outcome."""
+		conn.executemany(f"DELETE FROM {cls._table_name} WHERE id = ?", [(mutation_id,) for mutation_id in mutation_ids])
+
+	@classmethod
+	def get_pending(cls) -> list['DriveMutation']:
+		"""Entries whose outcome was never recorded, oldest first."""
+		rows = cls._execute_query(f"SELECT * FROM {cls._table_name} ORDER BY id")
+		return cls.from_rows(rows)
+
+	def __repr__(self):
+		return f"DriveMutation(id={self.id}, action='{self.action}', name='{self.name}')"
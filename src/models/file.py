@@ -1,29 +1,41 @@
+import time
+from sys import intern
+from contextlib import nullcontext
+from itertools import islice
+from typing import Iterable, Iterator
+
 from main import logger
+from src.db.key_sets import KEYS
 from src.db.query_options import FileQueryOptions
-from src.models.base_model import BaseModel
-from src.db.database import get_db_connection
+from src.models.base_model import BaseModel, ITER_CHUNK_SIZE
+from src.db.database import get_db_connection, bulk_load_settings, drop_secondary_indexes, has_name_index, \
+	normalize_file_name, NAME_INDEX_TABLE
+from src.name_normalization import normalize_name
 from src.models.category import Category
 from src.models.category_type import CategoryType
 
 
+# Guards the closure build against cycles in broken parent data
+MAX_TREE_DEPTH = 256
+
+
 class File(BaseModel):
 	_table_name = 'files'
+	_fields = ('id', 'drive_file_id', 'name', 'mime_type', 'parent_id', 'owner', 'created_time', 'modified_time',
+			   'size', 'shortcut_target_id', 'md5_checksum', 'active')
+	# No per-instance __dict__, which matters for lists of millions of files
+	__slots__ = _fields
 
 	def __init__(self, id=None, drive_file_id=None, name=None, mime_type=None,
 				 parent_id=None, owner=None, created_time=None, modified_time=None,
 				 size=None, shortcut_target_id=None, md5_checksum=None, active=None):
-		super().__init__(
-			id=id, drive_file_id=drive_file_id, name=name, mime_type=mime_type,
-			parent_id=parent_id, owner=owner, created_time=created_time,
-			modified_time=modified_time, size=size, shortcut_target_id=shortcut_target_id,
-			md5_checksum=md5_checksum, active=active
-		)
 		self.id = id
 		self.drive_file_id = drive_file_id
 		self.name = name
-		self.mime_type = mime_type
+		# Few distinct values repeated in every row - share one string object
+		self.mime_type = intern(mime_type) if mime_type is not None else None
 		self.parent_id = parent_id
-		self.owner = owner
+		self.owner = intern(owner) if owner is not None else None
 		self.created_time = created_time
 		self.modified_time = modified_time
 		self.size = size
@@ -60,32 +72,45 @@ class File(BaseModel):
 		return cls(**remapped_data)
 
 	@classmethod
-	def add_batch(cls, files_data: list[dict], options: FileQueryOptions = None) -> int | None:
+	def add_batch(cls, files_data: Iterable[dict], options: FileQueryOptions = None, batch_size: int = 10000,
+				  bulk_load: bool = False) -> int | None:
 		"""
 		Adds multiple files to the database using a transaction.
 		Data is inserted into the specified table (default: cls._table_name).
+		Files are consumed lazily and inserted in chunks of batch_size, so the input can be a generator.
+
+		In bulk load mode the connection is tuned for bulk inserts (see bulk_load_settings) and secondary
+		indexes of the table are dropped before the load and rebuilt after it. Everything, including
+		the index changes, happens in one transaction, so a load killed midway leaves the table untouched.
 
 		:param options: Filter options for file queries.
-		:param files_data: List of dictionaries, each representing file data.
+		:param files_data: Iterable of dictionaries, each representing file data.
+		:param batch_size: Number of rows inserted per executemany call.
+		:param bulk_load: Whether to use the bulk load mode.
 		"""
+		from main import config_data
+		options = options if options else FileQueryOptions()
+		table_name = options.table_name.split(' ')[0]
+		fold_diacritics = config_data.name_fold_diacritics
 		conn = get_db_connection()
 		try:
-			with conn:
-				options = options if options else FileQueryOptions()
+			with bulk_load_settings(conn) if bulk_load else nullcontext(), conn:
 				c = conn.cursor()
+				c.execute("BEGIN;")
+				index_statements = drop_secondary_indexes(conn, table_name) if bulk_load else []
+				name_indexed = not options.temp and has_name_index(conn)
 
 				columns = [
 					'drive_file_id', 'name', 'mime_type', 'parent_id',
 					'owner', 'created_time', 'modified_time', 'size',
-					'shortcut_target_id', 'md5_checksum'
+					'shortcut_target_id', 'md5_checksum', 'name_normalized'
 				]
 				placeholders = ', '.join(['?' for _ in columns])
 
-				query = f"INSERT OR IGNORE INTO {options.table_name.split(' ')[0]} ({', '.join(columns)}) VALUES ({placeholders})"
+				query = f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
 
-				data_tuples = []
-				for file_data in files_data:
-					data_tuples.append((
+				data_tuples = (
+					(
 						file_data['drive_file_id'],
 						file_data['name'],
 						file_data['mime_type'],
@@ -95,38 +120,116 @@ class File(BaseModel):
 						file_data.get('modified_time'),
 						file_data.get('size'),
 						file_data.get('shortcut_target_id'),
-						file_data.get('md5_checksum')
-					))
-
-				c.executemany(query, data_tuples)
-				return c.rowcount
+						file_data.get('md5_checksum'),
+						normalize_name(file_data['name'], fold_diacritics)
+					) for file_data in files_data
+				)
+
+				start_time = time.perf_counter()
+				read_count = 0
+				added_count = 0
+				while chunk := list(islice(data_tuples, batch_size)):
+					c.executemany(query, chunk)
+					read_count += len(chunk)
+					added_count += c.rowcount
+					if not options.temp:
+						cls._extend_closure(c, options.closure_table_name, [(row[0], row[3]) for row in chunk])
+						if name_indexed:
+							c.executemany(f"""
+                                INSERT INTO {NAME_INDEX_TABLE} (rowid, name)
+                                SELECT id, name FROM {table_name} t
+                                WHERE drive_file_id = ? AND NOT EXISTS (SELECT 1 FROM {NAME_INDEX_TABLE} WHERE rowid = t.id)
+                            """, [(row[0],) for row in chunk])
+					elapsed = time.perf_counter() - start_time
+					logger.info(f"Imported {read_count} rows into {table_name} ({added_count} added, "
+								f"{read_count / elapsed if elapsed else 0:.0f} rows/s).")
+
+				if index_statements:
+					index_start_time = time.perf_counter()
+					for statement in index_statements:
+						c.execute(statement)
+					logger.info(f"Rebuilt {len(index_statements)} indexes on {table_name} "
+								f"in {time.perf_counter() - index_start_time:.1f}s.")
+				return added_count
 		except Exception as e:
-			logger.error(f"Unexpected error while adding batch files to {options.table_name}: {e}")
+			logger.error(f"Unexpected error while adding batch files to {table_name}: {e}")
 			return None
+		finally:
+			conn.close()
+
+	@classmethod
+	def has_closure(cls, options: FileQueryOptions = None) -> bool:
+		"""Checks whether the closure table of the files table has been built."""
+		options = options if options else FileQueryOptions()
+		row = cls._execute_query(f"SELECT EXISTS (SELECT 1 FROM {options.closure_table_name})", fetch_one=True)
+		return bool(row[0])
 
 	@classmethod
-	def replace_files(cls):
+	def build_closure(cls, options: FileQueryOptions = None) -> int | None:
 		"""
-		Deletes all existing files from the main 'files' table
-		and replaces them with files from the temporary 'files_temp' table.
-		This operation is executed in a single transaction.
+		Rebuilds the closure table (ancestor, descendant, depth) of the files table in a single pass.
+		Every file is its own ancestor at depth 0. A parent missing from the scan is kept as the top-most ancestor.
+
+		:param options: Selects the files table (temp or permanent) and its closure table.
+		:return: Number of closure rows, or None on error.
 		"""
+		options = options if options else FileQueryOptions()
+		table_name = options.table_name.split(' ')[0]
 		conn = get_db_connection()
 		try:
 			with conn:
-				conn.execute(f"DELETE FROM {cls._table_name};")
+				conn.execute(f"DELETE FROM {options.closure_table_name};")
+				c = conn.execute(f"""
+                    INSERT OR IGNORE INTO {options.closure_table_name} (ancestor_id, descendant_id, depth)
+                    WITH RECURSIVE ancestors(ancestor_id, descendant_id, depth) AS (
+                        SELECT drive_file_id, drive_file_id, 0 FROM {table_name}
+                        UNION ALL
+                        SELECT p.parent_id, a.descendant_id, a.depth + 1
+                        FROM ancestors a
+                        JOIN {table_name} p ON p.drive_file_id = a.ancestor_id
+                        WHERE p.parent_id IS NOT NULL AND a.depth < ?
+                    )
+                    SELECT ancestor_id, descendant_id, depth FROM ancestors;
+                """, (MAX_TREE_DEPTH,))
+				return c.rowcount
+		except Exception as e:
+			logger.error(f"Unexpected error while building {options.closure_table_name}: {e}")
+			return None
+		finally:
+			conn.close()
 
-				conn.execute(f"""
-                    INSERT INTO {cls._table_name}
-                    (id, drive_file_id, name, mime_type, parent_id, owner, created_time, modified_time, size, shortcut_target_id, md5_checksum, active)
-                    SELECT id, drive_file_id, name, mime_type, parent_id, owner, created_time, modified_time, size, shortcut_target_id, md5_checksum, active
-                    FROM files_temp;
-                """)
+	@staticmethod
+	def _extend_closure(cursor, closure_table: str, files: list[tuple[str, str | None]]) -> None:
+		"""
+		Adds newly inserted files to the closure table without rebuilding it.
+		Works in any insertion order: a file added before its parent is linked when the parent arrives.
 
-				conn.execute("DELETE FROM files_temp;")
-		except Exception as e:
-			logger.error(f"Unexpected error occurred while replacing files: {e}")
-			raise
+		:param cursor: Cursor of the transaction inserting the files.
+		:param closure_table: Name of the closure table to update.
+		:param files: (drive_file_id, parent_id) pairs of the inserted files.
+		"""
+		cursor.executemany(
+			f"INSERT OR IGNORE INTO {closure_table} (ancestor_id, descendant_id, depth) VALUES (?, ?, 0)",
+			[(file_id, file_id) for file_id, _ in files])
+
+		# Ancestors of the parent (or just the parent, if it is unknown) become ancestors of the file
+		with_parent = [(file_id, parent_id) for file_id, parent_id in files if parent_id is not None]
+		cursor.executemany(
+			f"INSERT OR IGNORE INTO {closure_table} (ancestor_id, descendant_id, depth) VALUES (?, ?, 1)",
+			[(parent_id, file_id) for file_id, parent_id in with_parent])
+		cursor.executemany(f"""
+            INSERT OR IGNORE INTO {closure_table} (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, ?, depth + 1 FROM {closure_table} WHERE descendant_id = ?
+        """, with_parent)
+
+		# Files already present below the new file get its ancestors too
+		cursor.executemany(f"""
+            INSERT OR IGNORE INTO {closure_table} (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth
+            FROM {closure_table} a
+            JOIN {closure_table} d ON d.ancestor_id = a.descendant_id
+            WHERE a.descendant_id = ? AND a.depth > 0 AND d.depth > 0
+        """, [(file_id,) for file_id, _ in files])
 
 	@classmethod
 	def deactivate_files(cls, files: list['File']) -> int | None:
@@ -178,19 +281,48 @@ class File(BaseModel):
 
 		rows = cls._execute_query(query, tuple(regex_patterns))
 
-		return [cls(**dict(row)) for row in rows]
+		return cls.from_rows(rows)
 
 	@classmethod
-	def get_files_by_names(cls, folder_names: list[str], options: FileQueryOptions = None) -> list['File']:
-		"""Retrieves folders based on their names."""
+	def iter_names(cls, options: FileQueryOptions = None,
+				   chunk_size: int = ITER_CHUNK_SIZE) -> Iterator[list[tuple[int, str]]]:
+		"""Lazily yields chunks of (id, name) tuples of all files, e.g. for matching names outside SQLite."""
+		options = options if options else FileQueryOptions()
+		query = f"SELECT f.id, f.name FROM {options.table_name} WHERE 1 {options.get_full_filter_sql()}"
+		return cls._iter_query(query, chunk_size=chunk_size, raw=True)
+
+	@classmethod
+	def get_files_by_names(cls, folder_names: list[str], options: FileQueryOptions = None,
+						   normalized: bool = False) -> list['File']:
+		"""
+		Retrieves folders based on their names.
+
+		:param normalized: Compare normalized names (see normalize_file_name), so 'Math  I' also finds 'math i'.
+		"""
 		if not folder_names:
 			return []
+		rows = cls._execute_key_query(cls._names_query(options, normalized), cls._name_keys(folder_names, normalized))
+		return cls.from_rows(rows)
+
+	@classmethod
+	def iter_files_by_names(cls, folder_names: list[str], options: FileQueryOptions = None,
+							chunk_size: int = ITER_CHUNK_SIZE, normalized: bool = False) -> Iterator['File']:
+		"""Lazily yields files with the given names, see get_files_by_names."""
+		if not folder_names:
+			return iter(())
+		return cls._iter_models(cls._names_query(options, normalized), chunk_size=chunk_size,
+								keys=cls._name_keys(folder_names, normalized))
+
+	@staticmethod
+	def _names_query(options: FileQueryOptions = None, normalized: bool = False) -> str:
 		options = options if options else FileQueryOptions()
-		placeholders = ','.join('?' for _ in folder_names)
+		name_column = 'name_normalized' if normalized else 'name'
+		return f"SELECT * FROM {options.table_name} WHERE {name_column} IN ({KEYS}) {options.get_full_filter_sql()}"
 
-		query = f"SELECT * FROM {options.table_name} WHERE name IN ({placeholders}) {options.get_full_filter_sql()}"
-		rows = cls._execute_query(query, folder_names)
-		return [cls(**dict(row)) for row in rows]
+	@staticmethod
+	def _name_keys(names: list[str], normalized: bool) -> list[str]:
+		"""Names to look up in the name or the name_normalized column."""
+		return [normalize_file_name(name) for name in names] if normalized else names
 
 	@classmethod
 	def get_files_by_ids(cls, files_ids: list[str], options: FileQueryOptions = None) -> list['File']:
@@ -198,10 +330,9 @@ class File(BaseModel):
 		if not files_ids:
 			return []
 		options = options if options else FileQueryOptions()
-		placeholders = ','.join('?' for _ in files_ids)
-		query = f"SELECT * FROM {options.table_name} WHERE drive_file_id IN ({placeholders}) {options.get_full_filter_sql()}"
-		rows = cls._execute_query(query, files_ids)
-		return [cls(**dict(row)) for row in rows]
+		query = f"SELECT * FROM {options.table_name} WHERE drive_file_id IN ({KEYS}) {options.get_full_filter_sql()}"
+		rows = cls._execute_key_query(query, files_ids)
+		return cls.from_rows(rows)
 
 	@classmethod
 	def get_from_category(cls, category: Category, options: FileQueryOptions = None) -> list['File']:
@@ -216,16 +347,29 @@ class File(BaseModel):
 			logger.error("Category object or its ID cannot be None.")
 			return []
 
-		options = options if options else FileQueryOptions()
+		query, params = cls._category_query(category, options)
+		rows = cls._execute_query(query, params)
+		return cls.from_rows(rows)
 
+	@classmethod
+	def iter_from_category(cls, category: Category, options: FileQueryOptions = None,
+						   chunk_size: int = ITER_CHUNK_SIZE) -> Iterator['File']:
+		"""Lazily yields files associated with a given category, see get_from_category."""
+		if category is None or category.id is None:
+			logger.error("Category object or its ID cannot be None.")
+			return iter(())
+		query, params = cls._category_query(category, options)
+		return cls._iter_models(query, params, chunk_size)
+
+	@staticmethod
+	def _category_query(category: Category, options: FileQueryOptions = None) -> tuple[str, tuple]:
+		options = options if options else FileQueryOptions()
 		query = f"""
         SELECT f.* FROM {options.table_name}
         JOIN file_categories fc ON f.id = fc.file_id 
         WHERE fc.category_id = ? {options.get_full_filter_sql()};
         """
-		# Używamy category.id jako parametru zapytania
-		rows = cls._execute_query(query, (category.id,))
-		return [cls(**dict(row)) for row in rows]
+		return query, (category.id,)
 
 	@classmethod
 	def get_files_from_folders(cls, folders: list['File'], options: FileQueryOptions = None) -> list['File']:
@@ -237,26 +381,158 @@ class File(BaseModel):
 		if not folders:
 			return []
 		options = options if options else FileQueryOptions()
-		placeholders = ','.join('?' for _ in folders)
-		query = f"SELECT * FROM {options.table_name} WHERE parent_id IN ({placeholders}) {options.get_full_filter_sql()}"
-		rows = cls._execute_query(query, [folder.drive_file_id for folder in folders])
-		return [cls(**dict(row)) for row in rows]
+		query = f"SELECT * FROM {options.table_name} WHERE parent_id IN ({KEYS}) {options.get_full_filter_sql()}"
+		rows = cls._execute_key_query(query, [folder.drive_file_id for folder in folders])
+		return cls.from_rows(rows)
+
+	@classmethod
+	def get_files_from_folders_by_names(cls, folder_names: list[str], max_depth: int = None,
+										options: FileQueryOptions = None, normalized: bool = False) -> list['File']:
+		"""
+		Retrieves files below all active folders with the given names in one query, using the closure table.
+
+		:param folder_names: Names of the parent folders.
+		:param max_depth: Maximum distance from the folder (1 = direct children). None means no limit.
+		:param options: Filter options for the returned files.
+		:param normalized: Compare normalized folder names, see get_files_by_names.
+		"""
+		if not folder_names:
+			return []
+		options = options if options else FileQueryOptions()
+		folder_table = options.table_name.split(' ')[0]
+		query = f"""
+        SELECT DISTINCT f.* FROM {folder_table} parent
+        JOIN {options.closure_table_name} fc ON fc.ancestor_id = parent.drive_file_id
+        JOIN {options.table_name} ON f.drive_file_id = fc.descendant_id
+        WHERE parent.{'name_normalized' if normalized else 'name'} IN ({KEYS})
+        AND parent.mime_type = 'application/vnd.google-apps.folder' AND parent.active = 1
+        AND fc.depth > 0 {'AND fc.depth <= ?' if max_depth else ''}
+        {options.get_full_filter_sql()}
+        """
+		rows = cls._execute_key_query(query, cls._name_keys(folder_names, normalized), [max_depth] if max_depth else [],
+									  chunkable=False)
+		return cls.from_rows(rows)
+
+	@classmethod
+	def get_files_by_categories(cls, category_type: CategoryType, options: FileQueryOptions = None,
+								category_ids: list[int] = None) -> dict[int, list['File']]:
+		"""
+		Retrieves the files of all categories of a category type in one query, grouped by category ID.
+
+		:param category_ids: Only retrieve the files of these categories.
+		"""
+		options = options if options else FileQueryOptions()
+		if category_ids is not None and not category_ids:
+			return {}
+		query = f"""
+        SELECT fc.category_id, f.* FROM categories c
+        JOIN file_categories fc ON fc.category_id = c.id
+        JOIN {options.table_name} ON f.id = fc.file_id
+        WHERE {f'c.id IN ({KEYS}) AND' if category_ids is not None else ''}
+        c.category_type_id = ? {options.get_full_filter_sql()}
+        ORDER BY fc.category_id, f.name;
+        """
+		files_by_category = {}
+		for rows in cls._iter_query(query, (category_type.id,), keys=category_ids):
+			for row, file in zip(rows, cls.from_rows(rows)):
+				files_by_category.setdefault(row[0], []).append(file)
+		return files_by_category
 
 	@classmethod
 	def get_files_from_category_type(cls, category_type: CategoryType, options: FileQueryOptions = None) -> list[
 		'File']:
 		"""Retrieves all files associated with a given category type."""
+		query, params = cls._category_type_query(category_type, options)
+		rows = cls._execute_query(query, params)
+		return cls.from_rows(rows)
+
+	@classmethod
+	def iter_files_from_category_type(cls, category_type: CategoryType, options: FileQueryOptions = None,
+									  chunk_size: int = ITER_CHUNK_SIZE) -> Iterator['File']:
+		"""Lazily yields files associated with a given category type, see get_files_from_category_type."""
+		query, params = cls._category_type_query(category_type, options)
+		return cls._iter_models(query, params, chunk_size)
+
+	@staticmethod
+	def _category_type_query(category_type: CategoryType, options: FileQueryOptions = None) -> tuple[str, tuple]:
 		options = options if options else FileQueryOptions()
 		query = f"""
         SELECT f.* FROM category_types ct
         JOIN categories c ON c.category_type_id = ct.id
         JOIN file_categories fc ON fc.category_id = c.id
         JOIN {options.table_name} ON f.id = fc.file_id
-        WHERE ct.name = '{category_type.name}' {options.get_full_filter_sql()}
+        WHERE ct.name = ? {options.get_full_filter_sql()}
         ORDER BY f.name;
         """
-		rows = cls._execute_query(query)
-		return [File(**dict(row)) for row in rows]
+		return query, (category_type.name,)
+
+	@classmethod
+	def search_by_name(cls, text: str, mode: str = 'contains', category_name: str = None,
+					   category_type_name: str = None, options: FileQueryOptions = None, limit: int = 100) -> list[
+		'File']:
+		"""
+		Searches files by name using the trigram name index (falls back to a table scan without it).
+
+		:param text: Text to search for.
+		:param mode: 'contains' - name contains every word of the text, 'phrase' - name contains the whole text,
+					 'prefix' - name starts with the text. Matching is case-insensitive.
+		:param category_name: Only return files linked to a category with this canonical name.
+		:param category_type_name: Only return files linked to a category of this category type.
+		:param options: Filter options for file queries. The permanent files table is always searched.
+		:param limit: Maximum number of results.
+		:return: List of matching File objects ordered by name.
+		"""
+		text = text.strip() if text else ''
+		if not text:
+			return []
+		options = options if options else FileQueryOptions()
+
+		needles = text.split() if mode == 'contains' else [text]
+		# Trigram index can only look up needles of at least 3 characters, shorter ones are checked row by row
+		indexed_needles = [n for n in needles if len(n) >= 3]
+		conn = get_db_connection()
+		try:
+			use_index = bool(indexed_needles) and has_name_index(conn)
+		finally:
+			conn.close()
+
+		conditions, params = [], []
+		if use_index:
+			conditions.append(f"{NAME_INDEX_TABLE} MATCH ?")
+			params.append(' AND '.join('"' + n.replace('"', '""') + '"' for n in indexed_needles))
+		if mode == 'prefix':
+			conditions.append("substr(CASEFOLD(f.name), 1, ?) = ?")
+			params.extend([len(text.casefold()), text.casefold()])
+		else:
+			for needle in needles:
+				if not use_index or needle not in indexed_needles:
+					conditions.append("instr(CASEFOLD(f.name), ?) > 0")
+					params.append(needle.casefold())
+
+		if category_name or category_type_name:
+			category_filters = []
+			if category_name:
+				category_filters.append("c.canonical_name = ?")
+				params.append(category_name)
+			if category_type_name:
+				category_filters.append("ct.name = ?")
+				params.append(category_type_name)
+			conditions.append(f"""f.id IN (
+                SELECT fc.file_id FROM file_categories fc
+                JOIN categories c ON c.id = fc.category_id
+                JOIN category_types ct ON ct.id = c.category_type_id
+                WHERE {' AND '.join(category_filters)})""")
+
+		source = f"{NAME_INDEX_TABLE} JOIN files f ON f.id = {NAME_INDEX_TABLE}.rowid" if use_index else "files f"
+		query = f"""
+        SELECT f.* FROM {source}
+        WHERE {' AND '.join(conditions)} {options.get_full_filter_sql()}
+        ORDER BY f.name
+        LIMIT ?
+        """
+		params.append(limit)
+		rows = cls._execute_query(query, params)
+		return cls.from_rows(rows)
 
 	@classmethod
 	def get_root_folders(cls, options: FileQueryOptions = None) -> list['File']:
@@ -264,27 +540,46 @@ class File(BaseModel):
 		options = options or FileQueryOptions(folder_only=True)
 		query = f"SELECT * FROM {options.table_name} WHERE parent_id IS NULL {options.get_full_filter_sql()}"
 		rows = cls._execute_query(query)
-		return [cls(**dict(row)) for row in rows]
+		return cls.from_rows(rows)
 
 	def get_created_date(self) -> str:
 		"""Returns the creation or modification date of the file."""
 		date_only = self.created_time.split('T')[0]
 		return date_only
 
-	def child_of(self, folder: 'File') -> int:
+	def child_of(self, folder: 'File', options: FileQueryOptions = None) -> int:
 		"""Checks if this file is a child of another folder.
 		:param folder: The folder to check against.
+		:param options: Selects the closure table (temp or permanent).
 		:return: Distance from the folder: -1 = not a child, 0 = same file, 1 = direct child, 2 = grandchild, etc.
 		"""
+		options = options if options else FileQueryOptions()
+		query = f"SELECT depth FROM {options.closure_table_name} WHERE ancestor_id = ? AND descendant_id = ?"
+		row = self._execute_query(query, (folder.drive_file_id, self.drive_file_id), fetch_one=True)
+		return row['depth'] if row else -1
 
-		distance = 0
-		current_file = self
-		while current_file and current_file.parent_id is not None:
-			if current_file.drive_file_id == folder.drive_file_id:
-				return distance
-			current_file = File.get_files_by_ids([current_file.parent_id])[0]
-			distance += 1
-		return -1
+	@classmethod
+	def get_descendants(cls, folders: list['File'], max_depth: int = None, options: FileQueryOptions = None) -> list[
+		'File']:
+		"""
+		Retrieves all files below the given folders, using the closure table.
+
+		:param folders: List of ancestor folders.
+		:param max_depth: Maximum distance from the folder (1 = direct children). None means no limit.
+		:param options: Filter options for file queries.
+		"""
+		if not folders:
+			return []
+		options = options if options else FileQueryOptions()
+		query = f"""
+        SELECT DISTINCT f.* FROM {options.closure_table_name} fc
+        JOIN {options.table_name} ON f.drive_file_id = fc.descendant_id
+        WHERE fc.ancestor_id IN ({KEYS}) AND fc.depth > 0 {'AND fc.depth <= ?' if max_depth else ''}
+        {options.get_full_filter_sql()}
+        """
+		rows = cls._execute_key_query(query, [folder.drive_file_id for folder in folders],
+									  [max_depth] if max_depth else [], chunkable=False)
+		return cls.from_rows(rows)
 
 	@classmethod
 	def get_from_list_by_name(cls, files_list: list['File'], name_to_find: str) -> list['File']:
@@ -300,12 +595,54 @@ class File(BaseModel):
 		return [f for f in files_list if f.name == name_to_find]
 
 	@classmethod
-	def get_all(cls, options: FileQueryOptions = None) -> list['File']:
-		"""Retrieves all files from the database."""
+	def get_all(cls, options: FileQueryOptions = None, raw: bool = False) -> list['File'] | list[tuple]:
+		"""
+		Retrieves all files from the database.
+
+		:param raw: Return plain tuples with values in File._fields order instead of File objects.
+					Much cheaper for bulk processing of large tables.
+		"""
+		query = cls._all_query(options, raw)
+		rows = cls._execute_query(query, raw=raw)
+		return rows if raw else cls.from_rows(rows)
+
+	@classmethod
+	def iter_all(cls, options: FileQueryOptions = None, raw: bool = False,
+				 chunk_size: int = ITER_CHUNK_SIZE) -> Iterator['File'] | Iterator[tuple]:
+		"""
+		Lazily yields all files from the database, fetching chunk_size rows at a time.
+
+		:param raw: Yield plain tuples with values in File._fields order instead of File objects.
+		"""
+		query = cls._all_query(options, raw)
+		if not raw:
+			yield from cls._iter_models(query, chunk_size=chunk_size)
+			return
+		for rows in cls._iter_query(query, chunk_size=chunk_size, raw=True):
+			yield from rows
+
+	@classmethod
+	def _all_query(cls, options: FileQueryOptions = None, raw: bool = False) -> str:
 		options = options if options else FileQueryOptions()
-		query = f"SELECT * FROM {options.table_name} where {options.get_full_filter_sql(False)}"
-		rows = cls._execute_query(query)
-		return [cls(**dict(row)) for row in rows]
+		columns = ', '.join(cls._fields) if raw else '*'
+		# "WHERE 1" keeps the query valid when no filter is applied
+		return f"SELECT {columns} FROM {options.table_name} WHERE 1 {options.get_full_filter_sql()}"
+
+	@classmethod
+	def count(cls, options: FileQueryOptions = None) -> int:
+		"""Returns the number of files matching the filter options."""
+		options = options if options else FileQueryOptions()
+		query = f"SELECT COUNT(*) FROM {options.table_name} WHERE 1 {options.get_full_filter_sql()}"
+		row = cls._execute_query(query, fetch_one=True)
+		return row[0]
+
+	@classmethod
+	def exists(cls, options: FileQueryOptions = None) -> bool:
+		"""Checks whether at least one file matches the filter options, without reading the whole table."""
+		options = options if options else FileQueryOptions()
+		query = f"SELECT EXISTS (SELECT 1 FROM {options.table_name} WHERE 1 {options.get_full_filter_sql()})"
+		row = cls._execute_query(query, fetch_one=True)
+		return bool(row[0])
 
 	def __repr__(self):
 		return f"<File(id={self.id}, name='{self.name}', type='{self.mime_type}')>"
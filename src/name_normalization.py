@@ -0,0 +1,41 @@
+import re
+import unicodedata
+
+# Letters which do not decompose into a base letter and a combining mark in NFKD
+_EXTRA_FOLDS = str.maketrans({
+	'ł': 'l', 'Ł': 'L', 'đ': 'd', 'Đ': 'D', 'ø': 'o', 'Ø': 'O',
+	'ß': 'ss', 'æ': 'ae', 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE'
+})
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_TOKEN_RE = re.compile(r'[^\W\d_]+|\d+')
+
+
+def fold_diacritics(text: str) -> str:
+	"""Removes diacritics, e.g. 'Łódź' -> 'Lodz'."""
+	text = unicodedata.normalize('NFKD', text.translate(_EXTRA_FOLDS))
+	return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_name(name: str | None, fold: bool = True) -> str | None:
+	"""
+	Normalizes a file or folder name for comparison: casefolds it, trims it and collapses whitespace.
+
+	:param name: Name to normalize.
+	:param fold: Whether to also remove diacritics.
+	:return: Normalized name, or None if name is None.
+	"""
+	if name is None:
+		return None
+	if fold:
+		name = fold_diacritics(name)
+	return _WHITESPACE_RE.sub(' ', name.casefold()).strip()
+
+
+def name_tokens(name: str) -> list[str]:
+	"""
+	Splits a name into letter and digit tokens, e.g. 'Sem_01a' -> ['sem', '1', 'a'].
+	The name is normalized with diacritic folding first and leading zeros are dropped from numbers.
+	"""
+	tokens = _TOKEN_RE.findall(normalize_name(name))
+	return [(token.lstrip('0') or '0') if token.isdigit() else token for token in tokens]
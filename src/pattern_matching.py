@@ -0,0 +1,117 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+from typing import Iterable, Iterator
+
+# Below this many name x pattern comparisons, matching runs in the calling process -
+# starting worker processes costs more than it saves
+PARALLEL_MIN_WORK = 2_000_000
+# Chunks of names per worker waiting in the pool, bounding the memory used by queued chunks
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+_REGEX_METACHARS_RE = re.compile(r'[.^$*+?{}\[\]\\|()]')
+_FLAGGED_PATTERN_RE = re.compile(r'^/(.*?)/([gmi]*)$')
+
+# Patterns of the worker process, set once by _init_worker
+_worker_patterns: list[tuple[int, list[re.Pattern]]] = []
+
+
+@lru_cache(maxsize=4096)
+def compile_pattern(expression_with_flags: str) -> re.Pattern:
+	"""
+	Compiles an alias of a 'pattern' category type: '/regex/flags' (only the 'i' flag has an effect),
+	a plain regex, or a plain name without regex metacharacters, which must then match the whole file name.
+
+	:raises re.error: If the expression is not a valid regex.
+	"""
+	match = _FLAGGED_PATTERN_RE.match(expression_with_flags)
+	if match:
+		pattern = match.group(1)
+		flags_str = match.group(2)
+	else:
+		pattern = expression_with_flags
+		flags_str = ''
+		if not (pattern.startswith('^') or pattern.endswith('$') or _REGEX_METACHARS_RE.search(pattern)):
+			pattern = '^' + re.escape(pattern) + '$'
+
+	return re.compile(pattern, re.IGNORECASE if 'i' in flags_str else 0)
+
+
+def compile_category_patterns(patterns: dict[int, list[str]]) -> list[tuple[int, list[re.Pattern]]]:
+	"""
+	Compiles the aliases of categories.
+
+	:param patterns: Aliases by category ID.
+	:raises re.error: If an alias is not a valid regex.
+	"""
+	return [(category_id, [compile_pattern(alias) for alias in aliases]) for category_id, aliases in patterns.items()]
+
+
+def match_names(compiled: list[tuple[int, list[re.Pattern]]], names: Iterable[tuple[int, str]]) -> list[tuple[int, int]]:
+	"""
+	Matches file names against compiled category patterns.
+
+	:param compiled: Patterns by category, see compile_category_patterns.
+	:param names: (file_id, name) pairs.
+	:return: (file_id, category_id) pairs of files matching any pattern of a category.
+	"""
+	links = []
+	for file_id, name in names:
+		if name is None:
+			continue
+		for category_id, regexes in compiled:
+			for regex in regexes:
+				if regex.match(name):
+					links.append((file_id, category_id))
+					break
+	return links
+
+
+def _init_worker(patterns: dict[int, list[str]]) -> None:
+	global _worker_patterns
+	_worker_patterns = compile_category_patterns(patterns)
+
+
+def _match_chunk(names: list[tuple[int, str]]) -> list[tuple[int, int]]:
+	return match_names(_worker_patterns, names)
+
+
+def default_workers() -> int:
+	"""Number of CPU cores this process may use."""
+	try:
+		return len(os.sched_getaffinity(0))
+	except AttributeError:
+		return os.cpu_count() or 1
+
+
+def match_patterns(patterns: dict[int, list[str]], name_chunks: Iterable[list[tuple[int, str]]], total_names: int,
+				   workers: int = 0) -> Iterator[list[tuple[int, int]]]:
+	"""
+	Matches chunks of file names against the patterns of many categories, spreading the chunks over a pool
+	of worker processes when the work is large enough. Every worker compiles the patterns once.
+
+	:param patterns: Aliases by category ID, all of them valid (see compile_category_patterns).
+	:param name_chunks: Chunks of (file_id, name) pairs, consumed lazily.
+	:param total_names: Number of names in all chunks, used to decide whether a pool pays off.
+	:param workers: Number of worker processes, 0 for all CPU cores.
+	:return: (file_id, category_id) links per chunk, in no particular order.
+	"""
+	workers = workers if workers > 0 else default_workers()
+	alias_count = sum(len(aliases) for aliases in patterns.values())
+	if workers == 1 or total_names * alias_count < PARALLEL_MIN_WORK:
+		compiled = compile_category_patterns(patterns)
+		for chunk in name_chunks:
+			yield match_names(compiled, chunk)
+		return
+
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(patterns,)) as executor:
+		pending = set()
+		for chunk in name_chunks:
+			if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					yield future.result()
+			pending.add(executor.submit(_match_chunk, chunk))
+		for future in pending:
+			yield future.result()
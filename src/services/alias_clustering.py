@@ -0,0 +1,117 @@
+from collections import Counter, defaultdict
+
+from src.name_normalization import name_tokens
+
+
+class _DisjointSet:
+	"""Union-find over integer ids."""
+
+	def __init__(self, size: int):
+		self.parents = list(range(size))
+
+	def find(self, item: int) -> int:
+		while self.parents[item] != item:
+			self.parents[item] = self.parents[self.parents[item]]
+			item = self.parents[item]
+		return item
+
+	def union(self, first: int, second: int) -> None:
+		first_root, second_root = self.find(first), self.find(second)
+		if first_root != second_root:
+			self.parents[max(first_root, second_root)] = min(first_root, second_root)
+
+
+class AliasClusterer:
+	"""
+	Groups folder names which most likely name the same thing, e.g. 'Sem1', 'Sem 1', 'S1' and 'Semestr 1'.
+
+	Names are compared by their normalized tokens (case, whitespace, diacritics and leading zeros ignored).
+	Numbers must always match exactly, so 'Sem 1' and 'Sem 2' are never grouped. Candidate pairs come from
+	an inverted index of letter trigrams blocked by the numbers of the name, so only names sharing
+	a block are ever compared, instead of all pairs.
+	"""
+
+	def __init__(self, similarity_threshold: float = 0.5, max_abbreviation_length: int = 4,
+				 max_block_size: int = 2000):
+		"""
+		:param similarity_threshold: Minimal Jaccard similarity of letter trigrams for two names to be grouped.
+		:param max_abbreviation_length: Names with at most this many letters are also matched as abbreviations
+										('S1' -> 'Semestr 1').
+		:param max_block_size: Trigram blocks larger than this are too common to be informative and are skipped.
+		"""
+		self.similarity_threshold = similarity_threshold
+		self.max_abbreviation_length = max_abbreviation_length
+		self.max_block_size = max_block_size
+
+	@staticmethod
+	def _trigrams(words: list[str]) -> set[str]:
+		padded = f" {' '.join(words)} "
+		return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+	@staticmethod
+	def _is_abbreviation(short_words: list[str], long_words: list[str]) -> bool:
+		"""Checks whether every word of the short name starts the corresponding word of the long name."""
+		if len(short_words) != len(long_words) or short_words == long_words:
+			return False
+		return all(long_word.startswith(short_word) for short_word, long_word in zip(short_words, long_words))
+
+	def cluster(self, names: list[str]) -> list[list[str]]:
+		"""
+		Groups the names.
+
+		:param names: Folder names, duplicates allowed (they are used to pick the canonical name).
+		:return: Groups of distinct names, each sorted so that the suggested canonical name
+				 (most frequent, then longest) comes first.
+		"""
+		name_counts = Counter(names)
+
+		# 1. Names with identical tokens are always the same entry
+		entries_by_key: dict[tuple, list[str]] = defaultdict(list)
+		for name in name_counts:
+			entries_by_key[tuple(name_tokens(name))].append(name)
+		keys = list(entries_by_key)
+		numbers = [tuple(t for t in key if t.isdigit()) for key in keys]
+		words = [[t for t in key if not t.isdigit()] for key in keys]
+		groups = _DisjointSet(len(keys))
+
+		# 2. Similar spelling - trigram index blocked by the numbers of the name
+		trigrams = [self._trigrams(entry_words) if entry_words else set() for entry_words in words]
+		trigram_index: dict[tuple, list[int]] = defaultdict(list)
+		for entry_id, entry_trigrams in enumerate(trigrams):
+			for trigram in entry_trigrams:
+				trigram_index[(numbers[entry_id], trigram)].append(entry_id)
+
+		for entry_id, entry_trigrams in enumerate(trigrams):
+			shared_counts = Counter()
+			for trigram in entry_trigrams:
+				block = trigram_index[(numbers[entry_id], trigram)]
+				if len(block) <= self.max_block_size:
+					shared_counts.update(other_id for other_id in block if other_id > entry_id)
+			for other_id, shared in shared_counts.items():
+				similarity = shared / (len(entry_trigrams) + len(trigrams[other_id]) - shared)
+				if similarity >= self.similarity_threshold:
+					groups.union(entry_id, other_id)
+
+		# 3. Abbreviations - blocked by numbers and the first letter, longest abbreviations first
+		#    so that 'Sem 1' joins 'Semestr 1' before 'S 1' is resolved. Ambiguous abbreviations are left alone.
+		initial_index: dict[tuple, list[int]] = defaultdict(list)
+		for entry_id, entry_words in enumerate(words):
+			if entry_words:
+				initial_index[(numbers[entry_id], entry_words[0][0])].append(entry_id)
+
+		short_entries = [entry_id for entry_id, entry_words in enumerate(words)
+						 if entry_words and len(''.join(entry_words)) <= self.max_abbreviation_length]
+		short_entries.sort(key=lambda entry_id: len(''.join(words[entry_id])), reverse=True)
+		for entry_id in short_entries:
+			block = initial_index[(numbers[entry_id], words[entry_id][0][0])]
+			matching_groups = {groups.find(other_id) for other_id in block
+							   if self._is_abbreviation(words[entry_id], words[other_id])}
+			if len(matching_groups) == 1:
+				groups.union(entry_id, matching_groups.pop())
+
+		clusters: dict[int, list[str]] = defaultdict(list)
+		for entry_id, key in enumerate(keys):
+			clusters[groups.find(entry_id)].extend(entries_by_key[key])
+
+		return [sorted(cluster, key=lambda name: (-name_counts[name], -len(name.strip()), name))
+				for cluster in clusters.values()]
@@ -1,16 +1,16 @@
 from src.db.query_options import FileQueryOptions
+from src.services.alias_clustering import AliasClusterer
 from src.models.file import File
 from src.models.category import Category
 from src.models.category_type import CategoryType
-from src.models.category_alias import CategoryAlias
 from main import logger
 
 
 class CategoryService:
 	@staticmethod
-	def generate_potential_aliases(parent_drive_file_ids: list[str] = None):
+	def get_alias_folder_names(parent_drive_file_ids: list[str] = None) -> list[str]:
 		"""
-		Generates a list of unique folder names that are direct children
+		Returns names (with duplicates) of folders that are direct children
 		of the given parent folders. If parent_drive_file_ids is None, scans top-level folders.
 
 		:param parent_drive_file_ids: List of drive_file_id of parent folders to scan.
@@ -26,41 +26,99 @@ class CategoryService:
 			folders = File.get_files_by_ids(parent_drive_file_ids, FileQueryOptions(folder_only=True))
 			out_folders = File.get_files_from_folders(folders, FileQueryOptions(folder_only=True))
 
-		return sorted(list(set([f.name for f in out_folders])))
+		return [f.name for f in out_folders]
+
+	@staticmethod
+	def generate_potential_aliases(parent_drive_file_ids: list[str] = None):
+		"""
+		Generates a list of unique folder names that are direct children
+		of the given parent folders. If parent_drive_file_ids is None, scans top-level folders.
+
+		:param parent_drive_file_ids: List of drive_file_id of parent folders to scan.
+									  If None, it looks for folders without parents (top-level).
+		:return: List of strings containing folder names.
+		"""
+		return sorted(set(CategoryService.get_alias_folder_names(parent_drive_file_ids)))
+
+	@staticmethod
+	def suggest_categories(parent_drive_file_ids: list[str] = None) -> tuple[list[dict], list[str]]:
+		"""
+		Generates potential aliases like generate_potential_aliases and groups names that look like
+		variants of each other ('Sem1', 'Sem 1', 'Semestr 1') into suggested categories.
+
+		:param parent_drive_file_ids: List of drive_file_id of parent folders to scan.
+		:return: Suggested category entries ({"canonical_name", "aliases"}) and names left ungrouped.
+		"""
+		names = CategoryService.get_alias_folder_names(parent_drive_file_ids)
+		categories = []
+		unassigned = []
+		for cluster in AliasClusterer().cluster(names):
+			if len(cluster) > 1:
+				categories.append({"canonical_name": cluster[0], "aliases": sorted(cluster)})
+			else:
+				unassigned.append(cluster[0])
+		categories.sort(key=lambda category: category["canonical_name"])
+		logger.info(f"Grouped {len(set(names)) - len(unassigned)} folder names into {len(categories)} suggested categories.")
+		return categories, sorted(unassigned)
 
 	@staticmethod
-	def load_aliases(config_data: list[dict], category_type: CategoryType):
+	def parse_category_definitions(categories: list) -> dict[str, list[str]] | None:
 		"""
-		Loads alias configuration and adds them to the database,
-		then consolidates associated files/folders.
+		Validates the 'categories' list of a category type definition before anything is written to the database.
+		Invalid alias values are skipped with a warning. Structural errors (missing canonical name, aliases
+		not being a list, duplicate canonical names) reject the whole definition.
 
-		:param config_data: Dictionary with alias configuration data (usually loaded from JSON).
-		:param category_type: CategoryType object, e.g., CategoryType("Virtual Folder").
+		:param categories: List of {"canonical_name": ..., "aliases": [...]} objects (usually loaded from JSON).
+		:return: Distinct aliases by canonical name, or None if the definition is invalid (all errors are logged).
 		"""
+		if not isinstance(categories, list):
+			logger.error(f"'categories' must be a list, got {type(categories).__name__}.")
+			return None
 
-		for category_obj in config_data:
+		definitions = {}
+		errors = []
+		for position, category_obj in enumerate(categories, start=1):
+			if not isinstance(category_obj, dict):
+				errors.append(f"Category #{position} is not an object: {category_obj!r}")
+				continue
 			canonical_name = category_obj.get("canonical_name")
 			aliases = category_obj.get("aliases")
-
-			if not canonical_name:
-				logger.warning(f"Found a category object without 'canonical_name'. Skipping: {category_obj}")
+			if not canonical_name or not isinstance(canonical_name, str):
+				errors.append(f"Category #{position} has no valid 'canonical_name': {category_obj}")
+				continue
+			if canonical_name in definitions:
+				errors.append(f"Category #{position} repeats the canonical name '{canonical_name}'")
 				continue
-			if aliases is None:
-				logger.warning(f"Found a category object without 'aliases'. Skipping: {category_obj}")
-				return
-
 			if not isinstance(aliases, list):
-				logger.warning(f"Aliases for '{canonical_name}' is not a list. Skipping aliases: {aliases}")
-				return
-
-			category = Category.find_or_create(category_type.id, canonical_name)
-			if not category:
-				logger.error(f"Failed to create or retrieve canonical category '{canonical_name}'.")
+				errors.append(f"Aliases of '{canonical_name}' must be a list, got: {aliases!r}")
 				continue
 
+			valid_aliases = []
 			for alias_name in aliases:
 				if alias_name and isinstance(alias_name, str):
-					CategoryAlias.find_or_create(category.id, alias_name)
-					logger.debug(f"Added alias: '{alias_name}' for category '{canonical_name}'")
+					valid_aliases.append(alias_name)
 				else:
 					logger.warning(f"Invalid alias found for '{canonical_name}': '{alias_name}'. Skipping.")
+			definitions[canonical_name] = list(dict.fromkeys(valid_aliases))
+
+		for error in errors:
+			logger.error(error)
+		return None if errors else definitions
+
+	@staticmethod
+	def load_aliases(definitions: dict[str, list[str]], category_type: CategoryType) -> bool:
+		"""
+		Stores a category type with its options and replaces its categories and aliases with the validated
+		definitions (see parse_category_definitions) in one transaction.
+
+		:param definitions: Distinct aliases by canonical name.
+		:param category_type: CategoryType object, e.g., CategoryType(name="Virtual Folder", aggregation_type="collection"),
+							  saved if it is new.
+		"""
+		if not Category.replace_for_type(category_type, definitions):
+			logger.error(f"Failed to load categories for category type '{category_type.name}'.")
+			return False
+		logger.info(f"Loaded {len(definitions)} categories with "
+					f"{sum(len(aliases) for aliases in definitions.values())} aliases "
+					f"for category type '{category_type.name}'.")
+		return True
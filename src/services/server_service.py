@@ -30,7 +30,8 @@ class ServerService:
 				})())
 				if scan_result:
 					update_data_in_database(args=type('Args', (object,), {
-						'file_with_data': self.scan_file
+						'file_with_data': self.scan_file,
+						'no_bulk_load': False
 					})())
 					drive_update(None)
 				time.sleep(scan_interval)
@@ -1,88 +1,103 @@
 from src import utils
+from src.db.generations import reset_staging, promote_staging
+from src.db.query_cache import query_cache
 from src.db.query_options import FileQueryOptions
+from src.drive.build_plan import BuildPlan, plan_build
 from src.drive.drive_builder import DriveBuilder
 from src.models.drive_file import DriveFile
 from src.models.file import File
-from src.models.category import Category
 from src.models.category_type import CategoryType
 from src.models.category_alias import CategoryAlias
-from main import logger
+from src.models.category_change import CategoryChange
+from main import logger, config_data
 
 
 class UpdateService:
 
 	@staticmethod
-	def data_update(new_file_with_data: str) -> bool:
+	def data_update(new_file_with_data: str, bulk_load: bool = False) -> bool:
+		"""
+		Imports a scan file into the temporary tables, links files to categories and replaces the permanent data.
+
+		:param new_file_with_data: JSON or NDJSON scan file.
+		:param bulk_load: Whether to load files_temp in bulk load mode (see File.add_batch).
+		"""
 		logger.info(f"Starting database update with file: {new_file_with_data}")
 
-		files_data = utils.get_json(new_file_with_data)
-		if files_data is None or not isinstance(files_data, list):
-			logger.error(f"Failed to load data from {new_file_with_data}. Invalid format.")
+		if not reset_staging():
 			return False
 
-		added_files_count = File.add_batch(files_data, FileQueryOptions(temp=True))
+		# The scan is streamed from disk, so parsing errors surface (and are logged) inside add_batch
+		added_files_count = File.add_batch(utils.iter_json_items(new_file_with_data), FileQueryOptions(temp=True),
+										   batch_size=config_data.import_batch_size, bulk_load=bulk_load)
 		if added_files_count is None:
-			logger.error("Failed to add files to temporary storage.")
+			logger.error(f"Failed to add files from {new_file_with_data} to temporary storage.")
+			return False
+		if added_files_count == 0:
+			# Promoting an empty scan would replace all files and links with nothing
+			logger.error(f"No files found in {new_file_with_data}, the database was not updated.")
 			return False
 
-		category_types = CategoryType.get_all()
-		for category_type in category_types:
-			category_type.link_all_files(temp=True)
+		closure_rows = File.build_closure(FileQueryOptions(temp=True))
+		if closure_rows is None:
+			logger.error("Failed to build the folder closure table.")
+			return False
+		logger.debug(f"Built folder closure table with {closure_rows} rows.")
+
+		with query_cache.unit_of_work("category linking"):
+			category_types = CategoryType.get_all()
+			for category_type in category_types:
+				if category_type.aggregation_type != 'pattern':
+					category_type.link_all_files(temp=True)
+			# All pattern types share one pass over the file names
+			CategoryType.link_pattern_files([ct for ct in category_types if ct.aggregation_type == 'pattern'], temp=True)
 		logger.debug("Linked files to categories in temporary storage.")
 
-		Category.replace_links()
-		File.replace_files()
-		logger.debug("Replaced temporary files and links with permanent ones.")
+		if not promote_staging():
+			return False
+		logger.debug("Replaced permanent files and links with the imported ones, the old ones are kept for rollback.")
 
 		logger.info(f"Added {added_files_count} files to the database.")
 		logger.info("Database update completed successfully.")
 		return True
 
 	@staticmethod
-	def drive_update_all(drive_builder: DriveBuilder = None):
-		"""
-		Updates Google Drive structure based on current database state.
-		"""
-		drive_builder = drive_builder or DriveBuilder()
-		category_types = CategoryType.get_all()
-		for category_type in category_types:
-			drive_builder.build_category_type_normal(category_type)
-
-
-		deleted_category_types = 0
-		deleted_categories = 0
-		deleted_shortcuts = 0
+	def plan_drive_update(full: bool = False) -> BuildPlan:
+		"""Computes the changes drive_update_all would make to Google Drive, without making them."""
+		root_folders = DriveFile.get_drive_files_by_level(0)
+		with query_cache.unit_of_work("drive update plan"):
+			return plan_build(root_folders[0].drive_file_id if root_folders else None,
+							  None if full else CategoryChange.get_category_ids())
 
-		# Remove obsolete category type folders from drive_file table
-		for category_type_drive in DriveFile.get_drive_files_by_level(1):
-			if category_type_drive.category_type_id not in [ct.id for ct in category_types]:
-				category_type_drive.delete()
-				deleted_category_types += 1
-				logger.debug(f"Deleted obsolete category type folder with ID {category_type_drive.drive_file_id} from drive_file table.")
+	@staticmethod
+	def drive_update_all(drive_builder: DriveBuilder = None, full: bool = False):
+		"""
+		Updates Google Drive structure based on current database state: settles calls of an interrupted update,
+		computes a build plan (see src.drive.build_plan) and applies it.
 
-		# Remove obsolete category folders and shortcuts from drive_file table
-		for category_type in category_types:
-			categories = Category.get_by_type(category_type)
-			for category_drive in DriveFile.get_drive_files_by_level(2, category_type):
-				if category_drive.name not in [c.canonical_name for c in categories]:
-					category_drive.delete()
-					deleted_categories += 1
-					logger.debug(f"Deleted obsolete category folder '{category_drive.name}' with ID {category_drive.drive_file_id} from drive_file table.")
+		By default only the folders of categories whose file links changed since the last successful update
+		(see src.models.category_change) are diffed, so an update without changes costs no API calls.
+		A full update diffs all categories and reconciles the output tree with Drive: it lists the tree once,
+		forgets items which are gone from Drive and removes items under the root which are not in drive_files.
 
-			for category in categories:
-				files = File.get_from_category(category, FileQueryOptions(exclude_shortcuts=False))
-				category_drive = next((cd for cd in DriveFile.get_drive_files_by_level(2, category_type) if
-									   cd.name == category.canonical_name), None)
-				if category_drive is None:
-					continue
-				for file_drive in DriveFile.get_drive_files_by_level(3, category_type, category_drive.drive_file_id):
-					if file_drive.shortcut_target_id not in [f.drive_file_id for f in files]:
-						file_drive.delete()
-						deleted_shortcuts += 1
-						logger.debug(f"Deleted obsolete shortcut '{file_drive.name}' with ID {file_drive.drive_file_id} from drive_file table.")
-		logger.info("Deleted obsolete entries from drive_file table: "
-					f"{deleted_category_types} category type folders, "
-					f"{deleted_categories} category folders, "
-					f"{deleted_shortcuts} shortcuts.")
-		if drive_builder.remove_old_files():
-			logger.info("Google Drive structure update completed successfully.")
+		:return: True if all changes were made, False if some failed (they are retried by the next update).
+		"""
+		drive_builder = drive_builder or DriveBuilder()
+		drive_builder.resume_journal()
+		if full:
+			drive_builder.drop_missing_rows()
+		changed_categories = CategoryChange.get_category_ids()
+		with query_cache.unit_of_work("drive update"):
+			plan = plan_build(drive_builder.root_folder_id, None if full else changed_categories)
+		logger.info(f"Drive update plan: {plan.summary()}")
+		applied = (plan.is_empty() and not plan.identities) or drive_builder.apply_plan(plan)
+		if applied:
+			# Changes recorded while the plan was applied stay for the next update
+			CategoryChange.clear(changed_categories)
+		if full and not drive_builder.remove_old_files():
+			applied = False
+		if not applied:
+			logger.error("Google Drive structure update failed, the failed changes are retried by the next update.")
+			return False
+		logger.info("Google Drive structure update completed successfully.")
+		return True
@@ -1,4 +1,7 @@
 # test_example.py
+import itertools
+import shutil
+import tempfile
 import unittest
 from time import sleep
 
@@ -20,16 +23,23 @@ SKIP_HEAVY_TESTS = config_data.skip_heavy_tests
 
 class Tester(unittest.TestCase):
 	def setUp(self):
-		self.files_data_path_test = 'test_data/files_t.json'
+		# Everything a test writes goes to its own temporary directory, test_data only holds inputs
+		self.output_dir = tempfile.mkdtemp(prefix='dyskownik_test_')
+		self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+
+		self.files_data_path_test = self.output_path('files_t.json')
 		self.starting_folders_path = 'test_data/starting_folders.txt'
 
 		self.files_data_path = 'test_data/files.json'
-		self.db_path_test = 'test_data/data_t.db'
+		self.db_path_test = self.output_path('data_t.db')
 		self.db_path = 'test_data/data_for_drive.db'
 
-		self.aliases_from_starting_folders_path_test = 'test_data/aliases_from_starting_folders_t.json'
+		self.aliases_from_starting_folders_path_test = self.output_path('aliases_from_starting_folders_t.json')
 		self.aliases_from_starting_folders_path = 'test_data/aliases_from_starting_folders.json'
 
+	def output_path(self, file_name: str) -> str:
+		return os.path.join(self.output_dir, file_name)
+
 	@unittest.skipIf(SKIP_HEAVY_TESTS, "Skipping scan test to avoid heavy operations.")
 	def test_scan(self):
 		from src.commands.drive_commands import drive_fetch_data
@@ -62,7 +72,7 @@ class Tester(unittest.TestCase):
 		from src.commands.db_commands import initialize_database, update_data_in_database
 		drop_database()
 		initialize_database(None)
-		update_data_in_database(type('Args', (object,), {'file_with_data': self.files_data_path})())
+		update_data_in_database(type('Args', (object,), {'file_with_data': self.files_data_path, 'no_bulk_load': False})())
 
 		from src.models.file import File
 		files = File.get_all(options=FileQueryOptions(exclude_shortcuts=False))
@@ -72,7 +82,8 @@ class Tester(unittest.TestCase):
 		from src.commands.category_commands import generate_aliases_from_folders
 		generate_aliases_from_folders(type('Args', (object,), {
 			'input_file': self.starting_folders_path,
-			'output_file': self.aliases_from_starting_folders_path_test
+			'output_file': self.aliases_from_starting_folders_path_test,
+			'no_grouping': False
 		})())
 
 		generated_aliases = utils.get_json(self.aliases_from_starting_folders_path_test)
@@ -80,10 +91,14 @@ class Tester(unittest.TestCase):
 
 		self.assertIsNotNone(generated_aliases)
 		unassigned_folders: list[str] = generated_aliases.get("unassigned_folders", [])
+		suggested_groups = [sorted(cat["aliases"]) for cat in generated_aliases.get("categories", [])]
 		categories = expected_aliases.get("categories", [])
 		all_aliases: list[str] = [alias for cat in categories for alias in cat.get("aliases", [])]
 
-		self.assertEqual(sorted(unassigned_folders), sorted(all_aliases))
+		grouped_aliases = [alias for group in suggested_groups for alias in group]
+		self.assertEqual(sorted(unassigned_folders + grouped_aliases), sorted(all_aliases))
+		expected_groups = [sorted(cat["aliases"]) for cat in categories if len(cat["aliases"]) > 1]
+		self.assertEqual(sorted(suggested_groups), sorted(expected_groups))
 
 		load_category_type(type('Args', (object,), {
 			'input_file': self.aliases_from_starting_folders_path
@@ -105,9 +120,865 @@ class Tester(unittest.TestCase):
 			categories_aliases.extend(aliases)
 		self.assertEqual(len(categories_aliases), 5)
 
+	def load_test_database(self):
+		config_data.database_file = self.db_path_test
+		from src.commands.db_commands import initialize_database, update_data_in_database
+		drop_database()
+		initialize_database(None)
+		update_data_in_database(type('Args', (object,), {'file_with_data': self.files_data_path, 'no_bulk_load': False})())
+
+	def test_folder_closure(self):
+		self.load_test_database()
+		from src.models.file import File
+		from src.db.database import get_db_connection
+
+		options = FileQueryOptions(exclude_shortcuts=False, active_only=False)
+		drive = File.get_files_by_names(["Drive1"], options)[0]
+		children = File.get_files_from_folders([drive], options)
+		self.assertTrue(children)
+		self.assertEqual(children[0].child_of(drive), 1)
+		self.assertEqual(drive.child_of(drive), 0)
+		self.assertEqual(drive.child_of(children[0]), -1)
+
+		descendants = File.get_descendants([drive], options=options)
+		self.assertTrue({f.id for f in children} < {f.id for f in descendants})
+		self.assertEqual(len(File.get_descendants([drive], max_depth=1, options=options)), len(children))
+
+		# Incremental maintenance must give the same closure as the full build, whatever the insertion order
+		conn = get_db_connection()
+		full_closure = set(conn.execute("SELECT * FROM file_closure").fetchall())
+		conn.execute("DELETE FROM file_categories")
+		conn.execute("DELETE FROM files")
+		conn.execute("DELETE FROM file_closure")
+		conn.commit()
+		conn.close()
+		File.add_batch(reversed(utils.get_json(self.files_data_path)), batch_size=7)
+
+		conn = get_db_connection()
+		self.assertEqual(set(conn.execute("SELECT * FROM file_closure").fetchall()), full_closure)
+		conn.close()
+
+	def test_recursive_collection(self):
+		self.load_test_database()
+		from src.models.file import File
+		from src.models.category import Category
+
+		self.assertEqual(len(File.get_files_from_folders_by_names(["cat_A_1", "cat_a_1"], 1)), 6)
+		self.assertEqual(len(File.get_files_from_folders_by_names(["cat_A_1", "cat_a_1"])), 21)
+
+		import json
+		definition = utils.get_json(self.aliases_from_starting_folders_path)
+		definition["max_depth"] = -1
+		definition_path = self.output_path('aliases_recursive_t.json')
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(definition, f)
+		load_category_type(type('Args', (object,), {'input_file': definition_path})())
+
+		category_type = CategoryType.get_by_name("Category_A")
+		self.assertEqual(category_type.max_depth, -1)
+		category = next(c for c in Category.get_by_type(category_type) if c.canonical_name == "cat_A_1")
+		self.assertEqual(len(File.get_from_category(category)), 21)
+
+	def test_search(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.models.file import File
+
+		names = {f.name for f in File.search_by_name("B_4")}
+		self.assertEqual(names, {"cat_B_4", "cat_B_4_folder_1"})
+		names = {f.name for f in File.search_by_name("cat_b_2 folder")}
+		self.assertEqual(names, {"cat_B_2_folder_1", "cat_B_2_folder_2", "cat_B_2_folder_1_2", "cat_B_2_folder_2_2"})
+		self.assertEqual(File.search_by_name("cat_b_2 folder", mode='phrase'), [])
+		self.assertEqual({f.name for f in File.search_by_name("Dokument", mode='prefix')}, {"Dokument bez tytułu"})
+		self.assertEqual(File.search_by_name("tytułu", mode='prefix'), [])
+		# Case of non-ASCII letters is folded the same way with and without the index
+		self.assertEqual({f.name for f in File.search_by_name("DOKUMENT BEZ TYTUŁ", mode='prefix')},
+						 {"Dokument bez tytułu"})
+		self.assertIn("Dokument bez tytułu", {f.name for f in File.search_by_name("ŁU")})
+
+		names = {f.name for f in File.search_by_name("cat_B", category_name="cat_A_2")}
+		self.assertEqual(names, {"cat_B_5", "cat_B_6", "cat_B_7", "cat_B_8"})
+
+	def test_query_cache(self):
+		self.load_test_database()
+		from src.db.query_cache import query_cache
+		from src.models.category import Category
+
+		with query_cache.unit_of_work():
+			self.assertEqual(CategoryType.get_all(), [])
+			self.assertEqual(CategoryType.get_all(), [])
+			self.assertEqual((query_cache.hits, query_cache.misses), (1, 1))
+
+			category_type = CategoryType.find_or_create("Cached", "collection")
+			self.assertEqual([ct.name for ct in CategoryType.get_all()], ["Cached"])
+
+			Category.find_or_create(category_type.id, "Category")
+			self.assertEqual(len(Category.get_by_type(category_type)), 1)
+			self.assertEqual(len(Category.get_by_type(category_type)), 1)
+			# Deleting the category type cascades to its categories
+			category_type.delete()
+			self.assertEqual(Category.get_by_type(category_type), [])
+
+			# A read on another connection before the commit of a write does not keep the old rows cached
+			from src.db.database import get_db_connection
+			conn = get_db_connection()
+			conn.execute("INSERT INTO category_types (name, aggregation_type) VALUES ('Uncommitted', 'collection')")
+			self.assertEqual(CategoryType.get_all(), [])
+			conn.commit()
+			self.assertEqual([ct.name for ct in CategoryType.get_all()], ["Uncommitted"])
+			with conn:
+				conn.execute("DELETE FROM category_types")
+				self.assertEqual(len(CategoryType.get_all()), 1)
+			conn.close()
+			self.assertEqual(CategoryType.get_all(), [])
+		self.assertFalse(query_cache.active)
+
+	def test_file_rows(self):
+		self.load_test_database()
+		from src.models.file import File
+
+		options = FileQueryOptions(exclude_shortcuts=False)
+		files = File.get_all(options)
+		raw_files = File.get_all(options, raw=True)
+		self.assertEqual([tuple(f.to_dict().values()) for f in files], raw_files)
+		self.assertFalse(hasattr(files[0], '__dict__'))
+		folders = [f for f in files if f.mime_type == 'application/vnd.google-apps.folder']
+		self.assertTrue(all(f.mime_type is folders[0].mime_type for f in folders))
+		self.assertEqual(File.find_by_id(files[0].id).to_dict(), files[0].to_dict())
+
+		self.assertEqual([f.to_dict() for f in File.iter_all(options, chunk_size=4)], [f.to_dict() for f in files])
+		self.assertEqual(list(File.iter_all(options, raw=True, chunk_size=4)), raw_files)
+		self.assertEqual(File.count(options), len(files))
+		self.assertEqual(File.count(FileQueryOptions(exclude_shortcuts=False, active_only=False)), len(files))
+		self.assertTrue(File.exists(options))
+		self.assertFalse(File.exists(FileQueryOptions(temp=True)))
+		names = ["cat_A_1", "cat_B_2"]
+		self.assertEqual({f.id for f in File.iter_files_by_names(names, chunk_size=1)},
+						 {f.id for f in File.get_files_by_names(names)})
+
+		# Models without _fields are built from the row as keyword arguments
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.models.category import Category
+		category_type = CategoryType.get_by_name("Category_A")
+		self.assertEqual(CategoryType.find_by_id(category_type.id).name, category_type.name)
+		self.assertEqual([ct.name for ct in CategoryType.all()], ["Category_A"])
+		category = Category.get_by_type(category_type)[0]
+		self.assertEqual(Category.find_by_id(category.id).canonical_name, category.canonical_name)
+		self.assertEqual(len(Category.all()), len(Category.get_by_type(category_type)))
+
+	def test_large_key_sets(self):
+		self.load_test_database()
+		from src.models.file import File
+		from src.db.query_cache import query_cache
+
+		drive = File.get_files_by_names(["Drive1"])[0]
+		names = ["cat_A_1", "cat_B_2", "Drive1"]
+		expected = {f.id for f in File.get_files_by_names(names)}
+		descendants = {f.id for f in File.get_descendants([drive])}
+		for padding in (600, 40000):  # chunked IN lists, temporary table
+			padded_names = names + [f"missing_{i}" for i in range(padding)]
+			self.assertEqual({f.id for f in File.get_files_by_names(padded_names)}, expected)
+			self.assertEqual({f.id for f in File.iter_files_by_names(padded_names)}, expected)
+			padded_folders = [drive] + [File(drive_file_id=f"missing_{i}") for i in range(padding)]
+			self.assertEqual({f.id for f in File.get_descendants(padded_folders)}, descendants)
+			with query_cache.unit_of_work():
+				File.get_files_by_names(padded_names)
+				self.assertEqual({f.id for f in File.get_files_by_names(padded_names)}, expected)
+				self.assertEqual(query_cache.hits, 1)
+
+	def test_generation_swap(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.commands.db_commands import update_data_in_database, rollback_data
+		from src.models.file import File
+		from src.models.category import Category
+
+		import json
+		files_data = utils.get_json(self.files_data_path)
+		smaller_path = self.output_path('files_small_t.json')
+		with open(smaller_path, 'w', encoding='utf-8') as f:
+			json.dump([item for item in files_data if not item['name'].startswith('cat_A_1')], f)
+
+		options = FileQueryOptions(exclude_shortcuts=False)
+		category = next(c for c in Category.get_by_type(CategoryType.get_by_name("Category_A"))
+						if c.canonical_name == "cat_A_2")
+		linked_before = {f.drive_file_id for f in File.get_from_category(category, options)}
+		self.assertTrue(linked_before)
+
+		update_data_in_database(type('Args', (object,), {'file_with_data': smaller_path, 'no_bulk_load': False})())
+		self.assertEqual(File.count(options), len(files_data) - 1)
+		self.assertEqual({f.drive_file_id for f in File.get_from_category(category, options)}, linked_before)
+
+		self.assertTrue(rollback_data(None))
+		self.assertEqual(File.count(options), len(files_data))
+		self.assertEqual({f.drive_file_id for f in File.get_from_category(category, options)}, linked_before)
+		self.assertIn("cat_A_1", {f.name for f in File.search_by_name("cat_A_1")})
+		self.assertTrue(rollback_data(None))
+		self.assertEqual(File.count(options), len(files_data) - 1)
+
+		# Links keep cascading from categories after the swap
+		category.delete()
+		self.assertEqual(File.get_from_category(category, options), [])
+
+	def test_check_db(self):
+		self.load_test_database()
+		from main import db_checker
+		from src.db.database import get_db_connection, SCHEMA_VERSION
+		from src.db.db_integrity_checker import IntegrityLevel
+		from src.commands.db_commands import initialize_database
+
+		self.assertTrue(db_checker.test_db_integrity(IntegrityLevel.FILES))
+		self.assertFalse(db_checker.test_db_integrity(IntegrityLevel.CATEGORY_ONLY))
+		results = db_checker.run_deep_checks()
+		self.assertEqual(results['quick_check'], [])
+		self.assertEqual(results['orphans'], [])
+		self.assertEqual(results['index_coverage'], [])
+		self.assertIn("files: 41 rows", results['statistics'])
+
+		conn = get_db_connection()
+		self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+		conn.execute("INSERT INTO file_categories (file_id, category_id) VALUES (-1, -1)")
+		index_name = conn.execute("SELECT name FROM sqlite_master "
+								  "WHERE type = 'index' AND tbl_name = 'files' AND sql LIKE '%(parent_id)'").fetchone()[0]
+		conn.execute(f"DROP INDEX {index_name}")
+		conn.commit()
+		conn.close()
+		results = db_checker.run_deep_checks()
+		self.assertEqual(results['orphans'], ["1 file links pointing at missing files",
+											  "1 file links pointing at missing categories"])
+		self.assertEqual(len(results['index_coverage']), 1)
+
+		# Outdated or incomplete schemas fail until init-db upgrades them
+		conn = get_db_connection()
+		conn.execute("PRAGMA user_version = 3")
+		conn.commit()
+		self.assertFalse(db_checker.test_db_integrity(IntegrityLevel.STRUCTURE))
+		conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+		conn.execute("DROP TABLE drive_mutations")
+		conn.commit()
+		conn.close()
+		self.assertFalse(db_checker.test_db_integrity(IntegrityLevel.STRUCTURE))
+		initialize_database(None)
+		self.assertTrue(db_checker.test_db_integrity(IntegrityLevel.STRUCTURE))
+
+	def test_load_category_type_bulk(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.models.category import Category
+		from src.models.category_alias import CategoryAlias
+		from src.models.file import File
+		from src.db.database import get_db_connection
+
+		import json
+		definition = utils.get_json(self.aliases_from_starting_folders_path)
+		category_type = CategoryType.get_by_name(definition["category_type_name"])
+		linked = {c.canonical_name: {f.id for f in File.get_from_category(c)} for c in Category.get_by_type(category_type)}
+
+		# Invalid definitions are rejected before anything is deleted
+		invalid = dict(definition, categories=definition["categories"] + [definition["categories"][0]])
+		definition_path = self.output_path('aliases_bulk_t.json')
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(invalid, f)
+		load_category_type(type('Args', (object,), {'input_file': definition_path})())
+		self.assertEqual(len(Category.get_by_type(category_type)), 3)
+
+		large = dict(definition, categories=definition["categories"] + [
+			{"canonical_name": f"generated_{i}", "aliases": [f"generated_{i}_{j}" for j in range(3)] + [None]}
+			for i in range(300)])
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(large, f)
+		load_category_type(type('Args', (object,), {'input_file': definition_path})())
+
+		categories = Category.get_by_type(category_type)
+		self.assertEqual(len(categories), 303)
+		conn = get_db_connection()
+		self.assertEqual(conn.execute("SELECT COUNT(*) FROM category_aliases").fetchone()[0], 5 + 900)
+		conn.close()
+		for category in categories:
+			if category.canonical_name in linked:
+				self.assertEqual({f.id for f in File.get_from_category(category)}, linked[category.canonical_name])
+				self.assertEqual(len(CategoryAlias.get_by_category(category)),
+								 len(next(c["aliases"] for c in definition["categories"]
+										  if c["canonical_name"] == category.canonical_name)))
+
+		# A failing load changes neither the categories nor the options of the type
+		conn = get_db_connection()
+		conn.execute("CREATE TRIGGER fail_insert BEFORE INSERT ON category_aliases BEGIN SELECT RAISE(ABORT, 'test'); END")
+		conn.commit()
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(dict(definition, max_depth=3, shard_by='letter'), f)
+		load_category_type(type('Args', (object,), {'input_file': definition_path})())
+		conn.execute("DROP TRIGGER fail_insert")
+		conn.commit()
+		conn.close()
+		category_type = CategoryType.get_by_name(definition["category_type_name"])
+		self.assertEqual((category_type.max_depth, category_type.shard_by), (1, None))
+		self.assertEqual(len(Category.get_by_type(category_type)), 303)
+
+	def test_normalized_alias_match(self):
+		self.load_test_database()
+		from src.models.category import Category
+		from src.models.file import File
+
+		options = FileQueryOptions(exclude_shortcuts=False, active_only=False)
+		drive = File.get_files_by_names(["Drive1"], options)[0]
+		self.assertEqual(File.get_files_by_names(["  DRIVE1 "], options), [])
+		self.assertEqual([f.id for f in File.get_files_by_names(["  DRIVE1 "], options, normalized=True)], [drive.id])
+
+		import json
+		definition = utils.get_json(self.aliases_from_starting_folders_path)
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		category_type = CategoryType.get_by_name(definition["category_type_name"])
+		exact = {c.canonical_name: {f.id for f in File.get_from_category(c)} for c in Category.get_by_type(category_type)}
+
+		normalized = dict(definition, alias_match="normalized", categories=[
+			# One alias per case variant group, e.g. 'cat_A_1' and 'cat_a_1' become ' CAT_A_1  '
+			{"canonical_name": c["canonical_name"], "aliases": [f" {a.upper()}  " for a in {a.casefold() for a in c["aliases"]}]}
+			for c in definition["categories"]])
+		definition_path = self.output_path('aliases_bulk_t.json')
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(normalized, f)
+		load_category_type(type('Args', (object,), {'input_file': definition_path})())
+		category_type = CategoryType.get_by_name(definition["category_type_name"])
+		self.assertEqual(category_type.alias_match, "normalized")
+		for category in Category.get_by_type(category_type):
+			self.assertEqual({f.id for f in File.get_from_category(category)}, exact[category.canonical_name])
+
+	def test_parallel_pattern_linking(self):
+		self.load_test_database()
+		from src import pattern_matching
+		from src.models.category import Category
+		from src.models.file import File
+
+		import json
+		definition = {
+			"category_type_name": "Patterns",
+			"aggregation_type": "pattern",
+			"categories": [
+				{"canonical_name": "B folders", "aliases": ["/^cat_b_\\d+$/i"]},
+				{"canonical_name": "Drives", "aliases": ["Drive1", "/^drive2$/i"]},
+				{"canonical_name": "Broken", "aliases": ["/cat_(/"]},
+			]
+		}
+		definition_path = self.output_path('aliases_bulk_t.json')
+		with open(definition_path, 'w', encoding='utf-8') as f:
+			json.dump(definition, f)
+
+		previous = pattern_matching.PARALLEL_MIN_WORK, config_data.categorize_workers
+		pattern_matching.PARALLEL_MIN_WORK, config_data.categorize_workers = 0, 2
+		try:
+			load_category_type(type('Args', (object,), {'input_file': definition_path})())
+		finally:
+			pattern_matching.PARALLEL_MIN_WORK, config_data.categorize_workers = previous
+
+		categories = {c.canonical_name: c for c in Category.get_by_type(CategoryType.get_by_name("Patterns"))}
+		for category_definition in definition["categories"][:2]:
+			expected = {f.id for f in File.get_files_by_regex(category_definition["aliases"])}
+			self.assertTrue(expected)
+			linked = {f.id for f in File.get_from_category(categories[category_definition["canonical_name"]])}
+			self.assertEqual(linked, expected)
+		self.assertEqual(File.get_from_category(categories["Broken"]), [])
+
+	def test_drive_batch_requests(self):
+		import httplib2
+		from googleapiclient.errors import HttpError
+		from src.drive import drive_API_client
+		from src.drive.drive_API_client import DriveAPIClient
+
+		def error(status, content=b''):
+			return HttpError(httplib2.Response({'status': status}), content)
+
+		# Outcome of every call in its batch; rate limited calls are retried on their own, where 'c' succeeds
+		# and 'f' is denied. Denied calls fail in both cases, only missing items (404) give {}.
+		outcomes = {'a': ({'id': 'A'}, None), 'b': (None, error(404)), 'c': (None, error(403, b'rateLimitExceeded')),
+					'd': (None, error(400)), 'e': (None, error(403, b'insufficientFilePermissions')),
+					'f': (None, error(403, b'rateLimitExceeded'))}
+		batches = []
+
+		class Request:
+			def __init__(self, key):
+				self.key = key
+
+			def execute(self):
+				if self.key == 'f':
+					raise error(403, b'insufficientFilePermissions')
+				return {'id': self.key.upper()}
+
+		class Batch:
+			def __init__(self, callback):
+				self.callback, self.added = callback, []
+				batches.append(self)
+
+			def add(self, request, request_id):
+				self.added.append((request_id, request))
+
+			def execute(self):
+				for request_id, request in self.added:
+					self.callback(request_id, *outcomes[request.key])
+
+		queries = []
+
+		class Files:
+			def delete(self, fileId, supportsAllDrives):
+				return Request(fileId)
+
+			def list(self, q, **kwargs):
+				queries.append(q)
+				return type('ListRequest', (object,), {'execute': lambda request: {'files': []}})()
+
+		class Service:
+			def new_batch_http_request(self, callback):
+				return Batch(callback)
+
+			def files(self):
+				return Files()
+
+		previous_limit = drive_API_client.BATCH_LIMIT
+		drive_API_client.BATCH_LIMIT = 3
+		try:
+			results = DriveAPIClient().execute_batch(Service(), [(key, Request(key)) for key in 'abcdef'], 'test')
+			removed = DriveAPIClient().remove_drive_files(Service(), list('abef'))
+		finally:
+			drive_API_client.BATCH_LIMIT = previous_limit
+		self.assertEqual([len(batch.added) for batch in batches], [3, 3, 3, 1])
+		self.assertEqual(results, [{'id': 'A'}, {}, {'id': 'C'}, None, None, None])
+		# A denied delete leaves the item on Drive, a missing item is gone already
+		self.assertEqual(removed, [True, True, False, False])
+		# Trashed items are not listed, folder IDs are quoted
+		self.assertEqual(DriveAPIClient().list_folders_children(Service(), ['a', "b'c"]), [])
+		self.assertEqual(queries, ["('a' in parents or 'b\\'c' in parents) and trashed = false"])
+
+	def fake_drive_builder(self):
+		"""DriveBuilder whose API client records calls instead of changing Google Drive."""
+		from src.drive.drive_builder import DriveBuilder
+		from src.drive.drive_API_client import DriveAPIClient
+		from src.drive.write_scheduler import WriteScheduler
+		from src.models.file import File
+
+		class FakeService:
+			def close(self):
+				pass
+
+		class FakeClient:
+			def __init__(self):
+				self.calls = []
+				self.ids = itertools.count(1)
+
+				# Items in the fake Drive by ID
+				self.items = {}
+
+			def _created(self, name, parent_id, mime_type, target_id=None):
+				file = File(drive_file_id=f"fake_{next(self.ids)}", name=name, parent_id=parent_id, mime_type=mime_type,
+							shortcut_target_id=target_id)
+				self.items[file.drive_file_id] = file
+				return file
+
+			def find_children(self, service, lookups):
+				self.calls.extend(('find', parent_id) for parent_id, _, _ in lookups)
+				return [[file for file in self.items.values() if file.parent_id == parent_id
+						 and (name is None or file.name == name) and (target_id is None or file.shortcut_target_id == target_id)]
+						for parent_id, name, target_id in lookups]
+
+			def fetch_files(self, service, file_ids):
+				return [self.items.get(file_id, {}) for file_id in file_ids]
+
+			def list_folders_children(self, service, folder_ids):
+				self.calls.append(('list', len(folder_ids)))
+				return [file for file in list(self.items.values()) if file.parent_id in folder_ids]
+
+			def create_drive_folders(self, service, folders, priority=0):
+				self.calls.extend(('create folder', name) for name, _ in folders)
+				return [self._created(name, parent, 'application/vnd.google-apps.folder') for name, parent in folders]
+
+			def create_drive_shortcuts(self, service, shortcuts, priority=0):
+				self.calls.extend(('create shortcut', name) for name, _, _ in shortcuts)
+				return [self._created(name, parent, 'application/vnd.google-apps.shortcut', target)
+						for name, target, parent in shortcuts]
+
+			def rename_drive_files(self, service, renames, priority=0):
+				self.calls.extend(('rename', name) for _, name in renames)
+				for file_id, name in renames:
+					self.items[file_id].name = name
+				return [True] * len(renames)
+
+			def move_drive_files(self, service, moves, priority=0):
+				self.calls.extend(('move', name) for _, name, _, _ in moves)
+				for file_id, name, new_parent_id, _ in moves:
+					self.items[file_id].name = name
+					self.items[file_id].parent_id = new_parent_id
+				return [True] * len(moves)
+
+			def remove_drive_files(self, service, file_ids, priority=0):
+				self.calls.extend(('delete', file_id) for file_id in file_ids)
+				for file_id in file_ids:
+					self.items.pop(file_id, None)
+				return [True] * len(file_ids)
+
+		create_drive_service = DriveAPIClient.__dict__['create_drive_service']
+		self.addCleanup(setattr, DriveAPIClient, 'create_drive_service', create_drive_service)
+		DriveAPIClient.create_drive_service = staticmethod(lambda credentials: FakeService())
+		builder = DriveBuilder.__new__(DriveBuilder)
+		builder.api_client = FakeClient()
+		builder.credentials = None
+		builder.workers = 2
+		builder.write_scheduler = WriteScheduler(0)
+		builder._tree_listing = None
+		builder.root_folder_id = 'fake_root'
+		DriveFile.delete_all()
+		DriveFile.add_drive_file(File(drive_file_id='fake_root', name='root'), 0)
+		return builder
+
+	def test_build_plan(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		import json
+		from src.drive import build_plan
+		from src.models.category import Category
+		from src.models.file import File
+
+		builder = self.fake_drive_builder()
+		plan = build_plan.plan_build(builder.root_folder_id)
+		category_type = CategoryType.get_by_name("Category_A")
+		categories = Category.get_by_type(category_type)
+		linked_files = sum(len(File.get_from_category(c)) for c in categories)
+		self.assertEqual(len(plan.get(build_plan.CREATE_FOLDER, 1)), 1)
+		self.assertEqual(len(plan.get(build_plan.CREATE_FOLDER, 2)), len(categories))
+		self.assertEqual(len(plan.get(build_plan.CREATE_SHORTCUT)), linked_files)
+		self.assertEqual(plan.api_cost()[build_plan.CREATE_SHORTCUT], (linked_files, 1))
+
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertEqual(len(DriveFile.get_all_drive_files()), 1 + 1 + len(categories) + linked_files)
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# A renamed category keeps its folder, which is renamed in place
+		from src.db.database import get_db_connection
+		conn = get_db_connection()
+		conn.execute("UPDATE categories SET canonical_name = 'renamed' WHERE id = ?", (categories[0].id,))
+		conn.commit()
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertEqual([op.action for op in plan.operations], [build_plan.RENAME])
+		builder.api_client.calls.clear()
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertEqual(builder.api_client.calls, [('rename', 'renamed')])
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# A file moving to another category has its shortcut moved instead of deleted and created again
+		file_id, = conn.execute("SELECT file_id FROM file_categories WHERE category_id = ? LIMIT 1",
+								(categories[0].id,)).fetchone()
+		conn.execute("UPDATE file_categories SET category_id = ? WHERE file_id = ? AND category_id = ?",
+					 (categories[1].id, file_id, categories[0].id))
+		conn.commit()
+		conn.close()
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertEqual([op.action for op in plan.operations], [build_plan.MOVE])
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# Reloading the definitions keeps the IDs of the categories, renamed ones included
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		self.assertEqual({c.id for c in Category.get_by_type(category_type)}, {c.id for c in categories})
+		self.assertTrue(builder.apply_plan(build_plan.plan_build(builder.root_folder_id)))
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+		definition = utils.get_json(self.aliases_from_starting_folders_path)
+		definition["categories"][1]["canonical_name"] = "cat_A_two"
+		renamed_path = self.output_path('aliases_renamed_t.json')
+		with open(renamed_path, 'w', encoding='utf-8') as f:
+			json.dump(definition, f)
+		load_category_type(type('Args', (object,), {'input_file': renamed_path})())
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertEqual([op.action for op in plan.operations], [build_plan.RENAME])
+		builder.api_client.calls.clear()
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertEqual(builder.api_client.calls, [('rename', 'cat_A_two')])
+
+	def test_parallel_plan_execution(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.drive import build_plan
+		from src.drive.drive_API_client import RateLimiter
+
+		builder = self.fake_drive_builder()
+		builder.workers = 4
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertTrue(builder.apply_plan(plan))
+		# Every item was created in a folder which existed at that time
+		drive_files = DriveFile.get_all_drive_files()
+		known_ids = {drive_file.drive_file_id for drive_file in drive_files}
+		self.assertTrue(all(drive_file.parent_id in known_ids for drive_file in drive_files if drive_file.level > 0))
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		limiter = RateLimiter(rate=100, burst=5)
+		self.assertEqual(limiter.acquire(5), 0)
+		self.assertGreater(limiter.acquire(5), 0.03)
+		self.assertEqual(RateLimiter(rate=0).acquire(1000), 0)
+
+	def test_reconcile_output_tree(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.drive import build_plan
+		from src.models.file import File
+
+		builder = self.fake_drive_builder()
+		fake_drive = builder.api_client
+		self.assertTrue(builder.apply_plan(build_plan.plan_build(builder.root_folder_id)))
+		shortcuts = [f for f in fake_drive.items.values() if f.mime_type == build_plan.SHORTCUT_MIME_TYPE]
+		folder = next(f for f in fake_drive.items.values() if f.mime_type == build_plan.FOLDER_MIME_TYPE)
+
+		# One item added and one deleted by hand
+		fake_drive.items['stray'] = File(drive_file_id='stray', name='stray', parent_id=folder.drive_file_id,
+										 mime_type='text/plain')
+		# A document of the user's in the root folder stays, an unknown folder there goes
+		fake_drive.items['document'] = File(drive_file_id='document', name='document', parent_id=builder.root_folder_id,
+											mime_type='text/plain')
+		fake_drive.items['old_type'] = File(drive_file_id='old_type', name='old type', parent_id=builder.root_folder_id,
+											mime_type=build_plan.FOLDER_MIME_TYPE)
+		del fake_drive.items[shortcuts[0].drive_file_id]
+		fake_drive.calls.clear()
+		self.assertEqual(builder.drop_missing_rows(), 1)
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertEqual(len(plan.get(build_plan.CREATE_SHORTCUT)), 1)
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertTrue(builder.remove_old_files())
+		self.assertIn(('delete', 'stray'), fake_drive.calls)
+		self.assertIn(('delete', 'old_type'), fake_drive.calls)
+		self.assertEqual(len([c for c in fake_drive.calls if c[0] == 'delete']), 2)
+		self.assertIn('document', fake_drive.items)
+		# The tree was listed once, by one query per level
+		self.assertEqual(len([c for c in fake_drive.calls if c[0] == 'list']), 3)
+
+	def test_resume_interrupted_build(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.drive import build_plan
+		from src.models.drive_mutation import DriveMutation
+
+		builder = self.fake_drive_builder()
+		fake_drive = builder.api_client
+		plan = build_plan.plan_build(builder.root_folder_id)
+		shortcut_count = len(plan.get(build_plan.CREATE_SHORTCUT))
+
+		# The process dies after Drive created the shortcuts, before they were recorded
+		create_drive_shortcuts = fake_drive.create_drive_shortcuts
+
+		def create_and_die(service, shortcuts, priority=0):
+			create_drive_shortcuts(service, shortcuts)
+			raise KeyboardInterrupt
+
+		fake_drive.create_drive_shortcuts = create_and_die
+		with self.assertRaises(KeyboardInterrupt):
+			builder.apply_plan(plan)
+		self.assertEqual(len(DriveMutation.get_pending()), shortcut_count)
+		fake_drive.create_drive_shortcuts = create_drive_shortcuts
+
+		fake_drive.calls.clear()
+		self.assertEqual(builder.resume_journal(), shortcut_count)
+		self.assertEqual(len([c for c in fake_drive.calls if c[0] == 'find']), shortcut_count)
+		self.assertEqual(DriveMutation.get_pending(), [])
+		# Nothing is created twice
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+		self.assertEqual(len(fake_drive.items), len(DriveFile.get_all_drive_files()) - 1)
+
+		# The process dies after Drive deleted a category's items, and their lookups fail on the first resume
+		from src.db.database import get_db_connection
+		conn = get_db_connection()
+		with conn:
+			conn.execute("DELETE FROM categories WHERE id = (SELECT MIN(id) FROM categories)")
+		conn.close()
+		plan = build_plan.plan_build(builder.root_folder_id)
+		delete_count = len(plan.get(build_plan.DELETE))
+		self.assertEqual(len(plan.operations), delete_count)
+		remove_drive_files = fake_drive.remove_drive_files
+
+		def remove_and_die(service, file_ids, priority=0):
+			remove_drive_files(service, file_ids)
+			raise KeyboardInterrupt
+
+		fake_drive.remove_drive_files = remove_and_die
+		with self.assertRaises(KeyboardInterrupt):
+			builder.apply_plan(plan)
+		fake_drive.remove_drive_files = remove_drive_files
+		pending_count = len(DriveMutation.get_pending())
+		self.assertTrue(pending_count)
+		row_count = len(DriveFile.get_all_drive_files())
+		fetch_files = fake_drive.fetch_files
+		fake_drive.fetch_files = lambda service, file_ids: [None] * len(file_ids)
+		self.assertEqual(builder.resume_journal(), 0)
+		self.assertEqual(len(DriveMutation.get_pending()), pending_count)
+		self.assertEqual(len(DriveFile.get_all_drive_files()), row_count)
+
+		# Once the lookups succeed the rows of the deleted items are removed
+		fake_drive.fetch_files = fetch_files
+		self.assertEqual(builder.resume_journal(), pending_count)
+		self.assertEqual(DriveMutation.get_pending(), [])
+		self.assertLess(len(DriveFile.get_all_drive_files()), row_count)
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+	def test_incremental_drive_update(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		import json
+		from src.commands.db_commands import update_data_in_database
+		from src.drive import build_plan
+		from src.models.category import Category
+		from src.models.category_change import CategoryChange
+		from src.services.update_service import UpdateService
+
+		builder = self.fake_drive_builder()
+		fake_drive = builder.api_client
+		self.assertTrue(UpdateService.drive_update_all(builder))
+		self.assertEqual(CategoryChange.get_category_ids(), set())
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# Nothing changed, nothing is sent - not even a listing
+		fake_drive.calls.clear()
+		update_data_in_database(type('Args', (object,), {'file_with_data': self.files_data_path, 'no_bulk_load': False})())
+		self.assertEqual(CategoryChange.get_category_ids(), set())
+		UpdateService.drive_update_all(builder)
+		self.assertEqual(fake_drive.calls, [])
+
+		# Only the categories whose links changed are diffed, and the result equals a full build
+		files_data = utils.get_json(self.files_data_path)
+		smaller_path = self.output_path('files_small_t.json')
+		with open(smaller_path, 'w', encoding='utf-8') as f:
+			json.dump([item for item in files_data if not item['name'].startswith('cat_A_1')], f)
+		update_data_in_database(type('Args', (object,), {'file_with_data': smaller_path, 'no_bulk_load': False})())
+		changed = CategoryChange.get_category_ids()
+		self.assertTrue(changed)
+		self.assertLess(len(changed), len(Category.get_by_type(CategoryType.get_by_name("Category_A"))))
+
+		# A failed update reports the failure and keeps the changes for the next one
+		remove_drive_files = fake_drive.remove_drive_files
+		fake_drive.remove_drive_files = lambda service, file_ids, priority=0: [False] * len(file_ids)
+		self.assertFalse(UpdateService.drive_update_all(builder))
+		self.assertEqual(CategoryChange.get_category_ids(), changed)
+		fake_drive.remove_drive_files = remove_drive_files
+		fake_drive.calls.clear()
+		self.assertTrue(UpdateService.drive_update_all(builder))
+		self.assertTrue(fake_drive.calls)
+		self.assertNotIn('list', {call[0] for call in fake_drive.calls})
+		self.assertEqual(CategoryChange.get_category_ids(), set())
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+	def test_sharded_category_folders(self):
+		self.load_test_database()
+		load_category_type(type('Args', (object,), {'input_file': self.aliases_from_starting_folders_path})())
+		from src.drive import build_plan
+		from src.models.category import Category
+		from src.models.drive_file import DriveFileIndex
+		from src.models.file import File
+
+		files = [File(drive_file_id=f"id_{name}", name=name) for name in ('apple', 'Avocado', 'banana', 'Ćma', '_x')]
+		shards = build_plan.shard_files(files, 'letter', 2)
+		self.assertEqual({shard: len(members) for shard, members in shards.items()}, {'A': 2, 'B': 1, 'C': 1, '#': 1})
+		self.assertEqual(build_plan.shard_files(files, 'letter', 5), {None: files})
+		# A sharded category stays sharded until it shrinks to half of the limit
+		self.assertEqual(set(build_plan.shard_files(files, 'hash', 8, sharded=True)), {'1', '2'})
+		self.assertEqual(build_plan.shard_files(files, 'hash', 8), {None: files})
+		self.assertEqual(build_plan.shard_files(files, 'hash', 10, sharded=True), {None: files})
+		# Files keep their buckets while others are added
+		buckets = build_plan.shard_files(files, 'hash', 3)
+		more_buckets = build_plan.shard_files(files + [File(drive_file_id='id_new', name='new')], 'hash', 3)
+		self.assertEqual(set(buckets), {'1', '2'})
+		self.assertEqual({f.drive_file_id: shard for shard, members in buckets.items() for f in members},
+						 {f.drive_file_id: shard for shard, members in more_buckets.items() for f in members
+						  if f.drive_file_id != 'id_new'})
+
+		category_type = CategoryType.get_by_name("Category_A")
+		category_type.set_sharding('hash', 2)
+		builder = self.fake_drive_builder()
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertTrue(plan.get(build_plan.CREATE_FOLDER, 3))
+		self.assertTrue(plan.get(build_plan.CREATE_SHORTCUT, 4))
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# The largest category stays sharded below the limit, unshards at half of it and shards again above it
+		sizes = {c.id: len(File.get_from_category(c)) for c in Category.get_by_type(category_type)}
+		largest = max(sizes, key=sizes.get)
+
+		def shard_folders():
+			index = DriveFileIndex.load()
+			folder = index.find_by_category(2, largest, shortcut=False)
+			return [f for f in index.children(3, category_type.id, folder.drive_file_id) if f.shortcut_target_id is None]
+
+		for shard_size, sharded in ((sizes[largest], True), (2 * sizes[largest], False), (sizes[largest] - 1, True)):
+			category_type.set_sharding('hash', shard_size)
+			self.assertTrue(builder.apply_plan(build_plan.plan_build(builder.root_folder_id)))
+			self.assertEqual(bool(shard_folders()), sharded)
+			self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+		# Unsharding moves the shortcuts up instead of creating them again
+		category_type.set_sharding(None, 2)
+		plan = build_plan.plan_build(builder.root_folder_id)
+		self.assertEqual({op.action for op in plan.operations}, {build_plan.MOVE, build_plan.DELETE})
+		self.assertTrue(builder.apply_plan(plan))
+		self.assertEqual({f.level for f in DriveFile.get_all_drive_files()}, {0, 1, 2, 3})
+		self.assertTrue(build_plan.plan_build(builder.root_folder_id).is_empty())
+
+	def test_write_scheduler(self):
+		import threading
+		from src.drive.write_scheduler import WriteScheduler
+
+		scheduler = WriteScheduler(rate=10, burst=1)
+		scheduler.announce(3)
+		self.assertEqual(scheduler.queue_depth, 3)
+		self.assertAlmostEqual(scheduler.eta(), 0.3)
+		scheduler.acquire(1)
+
+		# With the bucket empty, a shortcut batch waiting first is overtaken by a folder arriving later
+		order = []
+		shortcuts = threading.Thread(target=lambda: order.append(scheduler.acquire(1, priority=10) and 'shortcut'))
+		folder = threading.Thread(target=lambda: order.append(scheduler.acquire(1, priority=0) and 'folder'))
+		shortcuts.start()
+		sleep(0.02)
+		folder.start()
+		shortcuts.join()
+		folder.join()
+		self.assertEqual(order, ['folder', 'shortcut'])
+		self.assertEqual(scheduler.queue_depth, 0)
+
+		# Rate limit errors halve the rate, successful writes bring it back
+		scheduler.report(100, rate_limited=3)
+		self.assertEqual(scheduler.rate, 5)
+		for _ in range(10):
+			scheduler.report(100, rate_limited=0)
+		self.assertEqual(scheduler.rate, 10)
+
+	def test_stream_scan_file(self):
+		files_data = utils.get_json(self.files_data_path)
+		streamed = list(utils.iter_json_items(self.files_data_path, read_size=64))
+		self.assertEqual(streamed, files_data)
+
+		import json
+		ndjson_path = self.output_path('files_t.ndjson')
+		with open(ndjson_path, 'w', encoding='utf-8') as f:
+			for item in files_data:
+				f.write(json.dumps(item, ensure_ascii=False) + "\n")
+		self.assertEqual(list(utils.iter_json_items(ndjson_path)), files_data)
+
+		# An empty scan is rejected and does not replace the imported files
+		empty_path = self.output_path('files_empty_t.json')
+		with open(empty_path, 'w', encoding='utf-8') as f:
+			f.write(" \n")
+		with self.assertRaises(json.JSONDecodeError):
+			list(utils.iter_json_items(empty_path, read_size=1))
+		self.load_test_database()
+		from src.models.file import File
+		from src.services.update_service import UpdateService
+		file_count = File.count()
+		self.assertTrue(file_count)
+		self.assertFalse(UpdateService.data_update(empty_path))
+		with open(empty_path, 'w', encoding='utf-8') as f:
+			f.write("[]")
+		self.assertFalse(UpdateService.data_update(empty_path))
+		self.assertEqual(File.count(), file_count)
+
 	@unittest.skipIf(SKIP_HEAVY_TESTS, "Skipping building test to avoid heavy operations.")
 	def test_build_drive(self):
-		config_data.database_file = self.db_path
+		# The fixture is an input like the others - the test works on a copy, upgraded to the current schema
+		from src.commands.db_commands import initialize_database
+		config_data.database_file = shutil.copy(self.db_path, self.output_path('data_for_drive_t.db'))
+		initialize_database(None)
 		DriveFile.delete_all()
 		no_root_test = drive_update(None)
 		self.assertFalse(no_root_test)
@@ -36,18 +36,23 @@ def append_to_json(data: list, filename: str) -> None:
 		f.write("\n]")
 
 
-def save_aliases_to_json(data, file_name: str = 'category_aliases.json') -> None:
+def save_aliases_to_json(data, file_name: str = 'category_aliases.json', categories: list[dict] = None) -> None:
 	"""
 	Save data to a JSON file. If the file already exists, it appends the data in JSON format.
 
 	:param data: Data to be saved. List of objects.
 	:param file_name: Name of the file to save the data to. If None, defaults to category_aliases.json.
+	:param categories: Pre-filled category entries. If None, an example entry is written.
 	"""
 
 	json_data = {
 		"category_type_name": "category_type_name",
 		"aggregation_type": "aggregation_type",
-		"categories": [
+		"max_depth": 1,
+		"alias_match": "exact",
+		"shard_by": None,
+		"shard_size": 1000,
+		"categories": categories if categories is not None else [
 			{
 				"canonical_name": "Example1",
 				"aliases": ["Example1", "example1", "example 1"]
@@ -81,6 +86,64 @@ def get_json(json_file):
 	return data
 
 
+def iter_json_items(json_file: str, read_size: int = 1024 * 1024):
+	"""
+	Yields objects from a scan file one at a time, without loading the whole file into memory.
+	Supports a JSON array (the format written by append_to_json) and NDJSON (one object per line).
+
+	:param json_file: Path to the JSON or NDJSON file.
+	:param read_size: Number of characters read from the file at once.
+	:raises json.JSONDecodeError: If the file is empty or its content is not valid JSON.
+	:raises OSError: If the file cannot be read.
+	"""
+	decoder = json.JSONDecoder()
+	with open(json_file, 'r', encoding='utf-8') as f:
+		buffer = f.read(read_size).lstrip()
+		while not buffer:
+			chunk = f.read(read_size)
+			if not chunk:
+				raise json.JSONDecodeError("Empty scan file", '', 0)
+			buffer = chunk.lstrip()
+		if not buffer.startswith('['):
+			# NDJSON - every non-empty line is a separate object
+			f.seek(0)
+			for line_number, line in enumerate(f, start=1):
+				line = line.strip()
+				if line:
+					try:
+						yield json.loads(line)
+					except json.JSONDecodeError as e:
+						raise json.JSONDecodeError(f"Line {line_number}: {e.msg}", e.doc, e.pos) from e
+			return
+
+		pos = 1
+		eof = False
+		while True:
+			# Skip whitespace and separators between array items
+			while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+				pos += 1
+			if pos < len(buffer) and buffer[pos] == ']':
+				return
+
+			try:
+				item, end = decoder.raw_decode(buffer, pos)
+				# An item ending exactly at the end of the buffer may be cut (e.g. a number), so read more first
+				if end < len(buffer) or eof:
+					yield item
+					pos = end
+					continue
+			except json.JSONDecodeError:
+				if eof:
+					raise
+
+			if eof:
+				raise json.JSONDecodeError("Unexpected end of JSON array", buffer, len(buffer))
+			chunk = f.read(read_size)
+			eof = not chunk
+			buffer = buffer[pos:] + chunk
+			pos = 0
+
+
 def get_lines_from_file(filename: str, first_word_only: bool = False) -> list[str]:
 	"""
 	Get lines from a file. Line is considered valid if it is not empty and does not start with whitespace.